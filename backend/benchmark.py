@@ -0,0 +1,349 @@
+"""
+Benchmarks du backend SmartBreath.
+
+    python -m backend.benchmark workers --workers 1 2 4   # montée en charge multi-processus
+    python -m backend.benchmark fanout --subscribers 1000 5000 10000   # diffusion temps réel (en mémoire)
+    python -m backend.benchmark fanout --http --subscribers 1000 2000  # idem, de bout en bout en SSE
+    python -m backend.benchmark polling --clients 16 --patients 300      # /status : cache et 304 vs requête SQL
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _patient_ids(n_patients):
+    """Identifiants de patients existants : une mesure d'un patient inconnu est refusée (503), pas comptée"""
+    from backend.database import db
+    try:
+        return [r[0] for r in db.fetchall("SELECT patient_id::text FROM patients ORDER BY patient_id LIMIT %s",
+                                          (n_patients,))]
+    finally:
+        db.close()
+
+
+def _client(port, path, duration, patient_ids, seed, results):
+    """Client HTTP keep-alive : envoie des mesures en boucle pendant `duration` secondes"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    ok = errors = 0
+    end = time.time() + duration
+    while time.time() < end:
+        body = json.dumps({
+            "patient_id": rng.choice(patient_ids), "flow_rate": 4.0, "muscle_strength": 72.0,
+            "spo2": round(rng.uniform(86, 99), 1), "bpm": rng.randint(60, 120),
+            "temperature": round(rng.uniform(36.3, 38.8), 1),
+        })
+        try:
+            conn.request("POST", path, body, {"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 200:
+                ok += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    results.put((ok, errors))
+
+
+def bench_workers(worker_counts, clients, duration, n_patients):
+    """
+    Lance le backend avec 1..N workers (python -m backend.serve) et mesure le débit
+    de /analyze. Le gain dépend des coeurs disponibles et de la contention sur l'état
+    partagé (SQLite, NOTIFY) : il se mesure sur la machine cible, il n'est pas garanti.
+    """
+    patient_ids = _patient_ids(n_patients)
+    print(f"CPU disponibles : {os.cpu_count()} | clients : {clients} | patients : {len(patient_ids)} | durée : {duration}s")
+    baseline = None
+    for workers in worker_counts:
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "backend.serve", "--workers", str(workers),
+             "--port", str(port), "--host", "127.0.0.1", "--log-level", "warning"],
+            env={**os.environ, "HISTORY_WARM_START": "0"},
+        )
+        try:
+            if not _wait_ready(port):
+                print(f"{workers} worker(s) : le serveur n'a pas démarré")
+                continue
+            results = multiprocessing.Queue()
+            procs = [
+                multiprocessing.Process(target=_client, args=(port, "/analyze", duration, patient_ids, i, results))
+                for i in range(clients)
+            ]
+            for p in procs:
+                p.start()
+            totals = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            ok = sum(t[0] for t in totals)
+            errors = sum(t[1] for t in totals)
+            rps = ok / duration
+            baseline = baseline or rps
+            print(f"{workers:>2} worker(s) : {rps:9.1f} req/s | erreurs {errors:5d} | "
+                  f"accélération x{rps / baseline:.2f} (idéal x{workers / worker_counts[0]:.0f})")
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def _poller(port, duration, n_patients, seed, results):
+    """Application mobile : interroge /status en renvoyant le dernier ETag reçu pour chaque patient"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    etags = {}
+    counts = {200: 0, 304: 0, "errors": 0}
+    latencies = []
+    end = time.time() + duration
+    while time.time() < end:
+        patient_id = str(rng.randrange(1, n_patients + 1))
+        headers = {"If-None-Match": etags[patient_id]} if patient_id in etags else {}
+        start = time.perf_counter()
+        try:
+            conn.request("GET", f"/status/{patient_id}", headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            counts["errors"] += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if resp.status in (200, 304):
+            counts[resp.status] += 1
+            etags[patient_id] = resp.getheader("ETag") or etags.get(patient_id)
+        else:
+            counts["errors"] += 1
+    results.put((counts, latencies))
+
+
+def bench_polling(clients, duration, n_patients, workers):
+    """
+    Interrogation de /status par les applications mobiles, avec puis sans le cache du
+    dernier état (LATEST_STATUS_CACHE_SIZE=0 : une requête SQL par appel).
+    """
+    print(f"CPU disponibles : {os.cpu_count()} | clients : {clients} | patients : {n_patients} | durée : {duration}s")
+    for label, cache_size in (("cache", "100000"), ("sans cache", "0")):
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "backend.serve", "--workers", str(workers),
+             "--port", str(port), "--host", "127.0.0.1", "--log-level", "warning"],
+            env={**os.environ, "HISTORY_WARM_START": "0", "LATEST_STATUS_CACHE_SIZE": cache_size},
+        )
+        try:
+            if not _wait_ready(port):
+                print(f"{label} : le serveur n'a pas démarré")
+                continue
+            results = multiprocessing.Queue()
+            procs = [
+                multiprocessing.Process(target=_poller, args=(port, duration, n_patients, i, results))
+                for i in range(clients)
+            ]
+            for p in procs:
+                p.start()
+            totals = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            ok = sum(c[200] for c, _ in totals)
+            not_modified = sum(c[304] for c, _ in totals)
+            errors = sum(c["errors"] for c, _ in totals)
+            latencies = [l for _, lat in totals for l in lat]
+            print(f"{label:>10} : {(ok + not_modified) / duration:9.1f} req/s | 304 {not_modified / max(ok + not_modified, 1):6.1%} | "
+                  f"erreurs {errors:4d} | {_latency_summary(latencies)}")
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return "aucune livraison"
+    lat = np.array(latencies) * 1000
+    return f"latence p50 {np.percentile(lat, 50):7.2f} ms | p99 {np.percentile(lat, 99):7.2f} ms | max {lat.max():7.2f} ms"
+
+
+async def _fanout_memory(n_subscribers, n_topics, n_messages, rate, slow_ratio):
+    """Broker en mémoire : n_subscribers consommateurs répartis sur n_topics patients"""
+    from backend.pubsub import Broker
+
+    broker = Broker(max_subscribers=n_subscribers)
+    latencies = []
+    n_slow = int(n_subscribers * slow_ratio)
+    subs = [broker.subscribe(str(i % n_topics)) for i in range(n_subscribers)]
+
+    async def consume(sub, slow):
+        while True:
+            data = await sub.get()
+            if slow:
+                # Client bloqué (réseau mobile coupé) : sa file déborde, les autres ne sont pas ralentis
+                await asyncio.sleep(3600)
+            else:
+                latencies.append(time.perf_counter() - json.loads(data)["sent"])
+
+    consumers = [asyncio.create_task(consume(sub, i < n_slow)) for i, sub in enumerate(subs)]
+    await asyncio.sleep(0)
+
+    publish_max = 0.0
+    start = time.perf_counter()
+    for i in range(n_messages):
+        t0 = time.perf_counter()
+        broker.publish(str(i % n_topics), {"data_id": i, "status": "STABLE", "risk_score": 0.1, "sent": t0})
+        publish_max = max(publish_max, time.perf_counter() - t0)
+        # Laisse les consommateurs vider leurs files au rythme de publication visé
+        await asyncio.sleep(1 / rate if rate else 0)
+    await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - start - 0.2
+    for task in consumers:
+        task.cancel()
+    stats = broker.stats()
+    print(f"{n_subscribers:>6} abonnés : {stats['fanned_out'] / elapsed:10.0f} livraisons/s | "
+          f"{_latency_summary(latencies)} | publish max {publish_max * 1000:.2f} ms | "
+          f"perdus (clients bloqués) {stats['dropped']}")
+
+
+async def _sse_client(port, patient_id, latencies, ready):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET /stream/status/{patient_id} HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    event = None
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.decode().strip()
+            if line.startswith("event: "):
+                event = line[7:]
+                if event == "status":
+                    ready.release()
+            elif line.startswith("data: ") and event == "measure":
+                sent = datetime.fromisoformat(json.loads(line[6:])["last_update"])
+                latencies.append((datetime.now() - sent).total_seconds())
+    finally:
+        writer.close()
+
+
+async def _fanout_http(port, n_subscribers, n_topics, n_messages):
+    latencies = []
+    ready = asyncio.Semaphore(0)
+    clients = [asyncio.create_task(_sse_client(port, str(i % n_topics + 1), latencies, ready))
+               for i in range(n_subscribers)]
+    for _ in range(n_subscribers):
+        await asyncio.wait_for(ready.acquire(), 60)
+
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    for i in range(n_messages):
+        body = json.dumps({"patient_id": str(i % n_topics + 1), "flow_rate": 4.0, "muscle_strength": 72.0,
+                           "spo2": 95.0, "bpm": 75, "temperature": 36.8})
+        await loop.run_in_executor(None, _post, port, "/analyze", body)
+    expected = n_subscribers * n_messages // n_topics
+    deadline = time.time() + 30
+    while len(latencies) < expected and time.time() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    for task in clients:
+        task.cancel()
+    print(f"{n_subscribers:>6} abonnés SSE : {len(latencies)}/{expected} livrés en {elapsed:.1f}s | "
+          f"{_latency_summary(latencies)}")
+
+
+def _post(port, path, body):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("POST", path, body, {"Content-Type": "application/json"})
+    conn.getresponse().read()
+    conn.close()
+
+
+def bench_fanout(subscriber_counts, topics, messages, rate, slow_ratio, http_mode, workers):
+    """
+    Diffusion des résultats d'analyse à des milliers d'abonnés. En mémoire, mesure le coût
+    du fan-out seul ; avec --http, lance le backend et ouvre de vraies connexions SSE.
+    """
+    if not http_mode:
+        for n in subscriber_counts:
+            asyncio.run(_fanout_memory(n, topics, messages, rate, slow_ratio))
+        return
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "backend.serve", "--workers", str(workers),
+         "--port", str(port), "--host", "127.0.0.1", "--log-level", "warning"],
+        env={**os.environ, "HISTORY_WARM_START": "0", "PUBSUB_MAX_SUBSCRIBERS": str(max(subscriber_counts))},
+    )
+    try:
+        if not _wait_ready(port):
+            print("Le serveur n'a pas démarré")
+            return
+        for n in subscriber_counts:
+            asyncio.run(_fanout_http(port, n, topics, messages))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks du backend SmartBreath")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_workers = sub.add_parser("workers", help="Débit de /analyze selon le nombre de workers")
+    p_workers.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p_workers.add_argument("--clients", type=int, default=16)
+    p_workers.add_argument("--duration", type=float, default=10.0)
+    p_workers.add_argument("--patients", type=int, default=500)
+    p_fanout = sub.add_parser("fanout", help="Diffusion temps réel vers de nombreux abonnés")
+    p_fanout.add_argument("--subscribers", type=int, nargs="+", default=[1000, 5000, 10000])
+    p_fanout.add_argument("--topics", type=int, default=100, help="Nombre de patients suivis")
+    p_fanout.add_argument("--messages", type=int, default=5000)
+    p_fanout.add_argument("--rate", type=float, default=2000, help="Publications/s (0 = sans limite)")
+    p_fanout.add_argument("--slow", type=float, default=0.05, help="Part des abonnés bloqués")
+    p_fanout.add_argument("--http", action="store_true", help="Connexions SSE réelles vers le backend")
+    p_fanout.add_argument("--workers", type=int, default=1)
+    p_polling = sub.add_parser("polling", help="Interrogation de /status (cache du dernier état, ETag)")
+    p_polling.add_argument("--clients", type=int, default=16)
+    p_polling.add_argument("--duration", type=float, default=10.0)
+    p_polling.add_argument("--patients", type=int, default=300)
+    p_polling.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "workers":
+        bench_workers(args.workers, args.clients, args.duration, args.patients)
+    elif args.command == "fanout":
+        bench_fanout(args.subscribers, args.topics, args.messages, args.rate, args.slow, args.http, args.workers)
+    elif args.command == "polling":
+        bench_polling(args.clients, args.duration, args.patients, args.workers)
+
+
+if __name__ == "__main__":
+    main()
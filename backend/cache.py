@@ -0,0 +1,139 @@
+import hashlib
+import json
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU à durée de vie bornée, partagé entre les threads du backend.
+    Les entrées expirent après `ttl` secondes ; au-delà de `maxsize` entrées,
+    la moins récemment utilisée est évincée.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Lecture sans effet sur les statistiques ni sur l'ordre LRU"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def etag_of(payload):
+    """ETag fort : empreinte du contenu JSON (identique d'un worker à l'autre)"""
+    body = json.dumps(payload, sort_keys=True, default=str).encode()
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match (liste d'ETags, faibles ou forts, ou *) correspond-il à l'ETag courant ?"""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+class LatestResults:
+    """
+    Dernier résultat d'analyse de chaque patient (format /status) et son ETag.
+    Une entrée n'est remplacée que par un résultat plus récent (last_update, data_id) :
+    les publications relayées par les autres workers peuvent arriver dans le désordre.
+    """
+
+    def __init__(self, maxsize=100000, ttl=300.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.updates = 0
+        self.stale = 0
+
+    @staticmethod
+    def _version(payload):
+        return payload.get("last_update") or "", payload.get("data_id") or 0
+
+    def get(self, patient_id):
+        """(payload, etag) ou None"""
+        return self._cache.get(patient_id)
+
+    def update(self, patient_id, payload):
+        """Enregistre le résultat s'il est au moins aussi récent que l'entrée courante. Retourne l'entrée retenue."""
+        current = self._cache.peek(patient_id)
+        if current is not None and current[0] == payload:
+            return current
+        if current is not None and self._version(payload) < self._version(current[0]):
+            self.stale += 1
+            return current
+        entry = (payload, etag_of(payload))
+        self._cache.set(patient_id, entry)
+        self.updates += 1
+        return entry
+
+    def invalidate(self, patient_id):
+        self._cache.invalidate(patient_id)
+
+    def stats(self):
+        return {**self._cache.stats(), "updates": self.updates, "stale_updates": self.stale}
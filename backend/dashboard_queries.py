@@ -0,0 +1,80 @@
+"""
+Requêtes de l'interface Streamlit (dashboard.py) appelées à chaque rafraîchissement.
+
+Regroupées ici pour être vérifiées par python -m backend.query_plans sans lancer
+l'interface. Paramètres nommés au format SQLAlchemy text() (:p_id).
+"""
+
+# Dernières mesures d'un patient (remplissage initial du tampon)
+LIVE_INITIAL_QUERY = """
+    SELECT data_id, patient_id::text as patient_id,
+        spo2, bpm, temperature, flow_rate, muscle_strength,
+        risk_score, status, recommendation,
+        actual_outcome, feedback_notes,
+        timestamp AT TIME ZONE 'UTC' as timestamp
+    FROM sensor_data
+    WHERE patient_id = CAST(:p_id AS INTEGER)
+    ORDER BY timestamp DESC, data_id DESC
+    LIMIT :n
+"""
+
+# Mesures arrivées depuis la dernière vue (horodatage moins la marge), hors data_id déjà affichés
+LIVE_DELTA_QUERY = """
+    SELECT data_id, patient_id::text as patient_id,
+        spo2, bpm, temperature, flow_rate, muscle_strength,
+        risk_score, status, recommendation,
+        actual_outcome, feedback_notes,
+        timestamp AT TIME ZONE 'UTC' as timestamp
+    FROM sensor_data
+    WHERE patient_id = CAST(:p_id AS INTEGER)
+      AND timestamp >= CAST(:since AS TIMESTAMP)
+      AND NOT (data_id = ANY(CAST(:seen AS BIGINT[])))
+    ORDER BY timestamp DESC, data_id DESC
+    LIMIT :n
+"""
+
+# Feedback reçu entre-temps sur les mesures affichées
+LIVE_FEEDBACK_QUERY = """
+    SELECT data_id, actual_outcome, feedback_notes FROM sensor_data
+    WHERE patient_id = CAST(:p_id AS INTEGER)
+      AND timestamp >= CAST(:oldest AS TIMESTAMP) AND actual_outcome IS NOT NULL
+      AND data_id = ANY(CAST(:ids AS BIGINT[]))
+"""
+
+# Historique jusqu'à 24 h : agrégation des mesures brutes par intervalle (date_bin)
+HISTORY_RAW_QUERY = """
+    SELECT date_bin(CAST(:step AS INTERVAL), timestamp, TIMESTAMP '2000-01-01') AS t,
+           AVG(spo2), MIN(spo2), MAX(spo2), AVG(bpm), MIN(bpm), MAX(bpm)
+    FROM sensor_data
+    WHERE patient_id = CAST(:p_id AS INTEGER)
+      AND timestamp > NOW() - CAST(:span AS INTERVAL) AND timestamp <= NOW()
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+# Historique au-delà : agrégats horaires
+HISTORY_ROLLUP_QUERY = """
+    SELECT bucket, sum_spo2 / n, min_spo2, max_spo2,
+           sum_bpm / NULLIF(n_bpm, 0), min_bpm, max_bpm
+    FROM sensor_rollup_hourly
+    WHERE patient_id = CAST(:p_id AS INTEGER)
+      AND bucket >= date_trunc('hour', NOW() - CAST(:span AS INTERVAL)) AND n > 0
+    ORDER BY bucket
+"""
+
+# Vue service : dernière mesure de chaque patient sur la fenêtre (un accès d'index par patient)
+WARD_QUERY = """
+    SELECT p.patient_id::text, p.nom, p.prenom, p.pathologie,
+           s.status, s.risk_score, s.spo2, s.bpm, s.temperature, s.actual_outcome, s.timestamp
+    FROM patients p
+    CROSS JOIN LATERAL (
+        SELECT status, risk_score, spo2, bpm, temperature, actual_outcome, timestamp
+        FROM sensor_data
+        WHERE patient_id = p.patient_id
+          AND timestamp > NOW() - CAST(:window AS INTERVAL) AND timestamp <= NOW()
+        ORDER BY timestamp DESC, data_id DESC
+        LIMIT 1
+    ) s
+    ORDER BY CASE s.status WHEN 'CRITIQUE' THEN 0 WHEN 'PRÉVENTION' THEN 1 WHEN 'SURVEILLANCE' THEN 2 ELSE 3 END,
+             s.risk_score DESC NULLS LAST
+"""
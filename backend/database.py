@@ -0,0 +1,230 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import cursor as _cursor
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+from backend.metrics import metrics, observe_query
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+POOL_CONFIG = {
+    "minconn": int(os.getenv("DB_POOL_MIN", "2")),
+    "maxconn": int(os.getenv("DB_POOL_MAX", "10")),
+    # Attente maximale (s) pour obtenir une connexion quand le pool est saturé
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", "5")),
+    "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
+}
+
+
+class PoolTimeout(Exception):
+    """Aucune connexion libérée dans le délai imparti."""
+
+
+class TimedCursor(_cursor):
+    """Curseur des connexions du pool : durée et erreurs de chaque requête dans GET /metrics"""
+
+    def execute(self, query, vars=None):
+        if not metrics.enabled:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            observe_query(query, start, failed=True)
+            raise
+        observe_query(query, start)
+        return result
+
+
+class DatabasePool:
+    """
+    Pool de connexions PostgreSQL partagé par tous les endpoints.
+    Les requêtes (bloquantes) sont exécutées dans le threadpool de FastAPI
+    pour ne jamais bloquer la boucle asyncio.
+    """
+
+    def __init__(self, config=None, minconn=None, maxconn=None, timeout=None, connect_timeout=None):
+        self.config = config or DB_CONFIG
+        self.minconn = minconn if minconn is not None else POOL_CONFIG["minconn"]
+        self.maxconn = maxconn if maxconn is not None else POOL_CONFIG["maxconn"]
+        self.timeout = timeout if timeout is not None else POOL_CONFIG["timeout"]
+        self.connect_timeout = connect_timeout if connect_timeout is not None else POOL_CONFIG["connect_timeout"]
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # psycopg2 lève PoolError immédiatement si le pool est vide : le sémaphore
+        # permet d'attendre une connexion libre jusqu'au timeout configuré.
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._stats = {
+            "acquired": 0, "released": 0, "timeouts": 0, "errors": 0,
+            "discarded": 0, "wait_time_total": 0.0, "wait_time_max": 0.0,
+        }
+        self._in_use = 0
+
+    def open(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = pool.ThreadedConnectionPool(
+                    self.minconn, self.maxconn,
+                    connect_timeout=self.connect_timeout, cursor_factory=TimedCursor, **self.config
+                )
+                logger.info(f"Pool PostgreSQL ouvert ({self.minconn}-{self.maxconn} connexions)")
+        return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                logger.info("Pool PostgreSQL fermé")
+
+    def getconn(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._stats["timeouts"] += 1
+            raise PoolTimeout(f"Aucune connexion disponible après {self.timeout}s")
+        try:
+            conn = (self._pool or self.open()).getconn()
+        except Exception:
+            self._slots.release()
+            self._stats["errors"] += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._stats["acquired"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            if self._pool is not None:
+                self._pool.putconn(conn, close=close or bool(conn.closed))
+            else:
+                conn.close()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._stats["released"] += 1
+                if close:
+                    self._stats["discarded"] += 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Prête une connexion : commit si tout va bien, rollback sinon."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Connexion probablement morte : on la retire du pool
+            broken = True
+            self._stats["errors"] += 1
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    # --- Helpers synchrones (à appeler depuis un thread) ---
+
+    def fetchone(self, query, params=None):
+        with self.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchone()
+
+    def fetchall(self, query, params=None):
+        with self.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+
+    def execute(self, query, params=None):
+        with self.cursor() as cur:
+            cur.execute(query, params)
+            return cur.rowcount
+
+    # --- Exécution non bloquante pour les endpoints async ---
+
+    async def run(self, func, *args, **kwargs):
+        """Exécute une fonction bloquante (qui utilise le pool) hors de la boucle asyncio."""
+        return await run_in_threadpool(func, *args, **kwargs)
+
+    def health_check(self):
+        start = time.perf_counter()
+        try:
+            self.fetchone("SELECT 1")
+            return {"status": "up", "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+        except Exception as e:
+            logger.error(f"Health check BDD en échec : {e}")
+            return {"status": "down", "error": str(e)}
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            in_use = self._in_use
+        acquired = stats["acquired"] or 1
+        return {
+            "open": self._pool is not None,
+            "min_size": self.minconn,
+            "max_size": self.maxconn,
+            "in_use": in_use,
+            "available": self.maxconn - in_use,
+            "acquired": stats["acquired"],
+            "released": stats["released"],
+            "timeouts": stats["timeouts"],
+            "errors": stats["errors"],
+            "discarded": stats["discarded"],
+            "wait_ms_avg": round(stats["wait_time_total"] / acquired * 1000, 3),
+            "wait_ms_max": round(stats["wait_time_max"] * 1000, 3),
+        }
+
+
+@contextmanager
+def advisory_lock(key, config=None):
+    """
+    Verrou consultatif de session sur une connexion dédiée (hors pool, autocommit) : une tâche
+    longue le garde sans immobiliser de connexion du pool ni de transaction ouverte.
+    Produit la connexion, ou None si un autre processus détient déjà le verrou.
+    Fermer la connexion libère le verrou, y compris si le processus meurt.
+    """
+    conn = psycopg2.connect(connect_timeout=POOL_CONFIG["connect_timeout"], **(config or DB_CONFIG))
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+            locked = cur.fetchone()[0]
+        yield conn if locked else None
+    finally:
+        conn.close()
+
+
+db = DatabasePool()
@@ -0,0 +1,63 @@
+"""
+Réduction de séries temporelles à un budget de points fixe pour l'affichage.
+
+Le coût de rendu d'un graphique reste constant quelle que soit la période demandée :
+la courbe est réduite par LTTB (Largest-Triangle-Three-Buckets, conserve la forme)
+et l'enveloppe min/max par paquets (aucune désaturation ponctuelle n'est lissée).
+"""
+import numpy as np
+
+
+def lttb(x, y, n_out):
+    """Indices des n_out points retenus par LTTB (premier et dernier points toujours conservés)"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # n_out - 2 paquets entre le premier et le dernier point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Point moyen du paquet suivant (le dernier point pour le dernier paquet)
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        # Aire du triangle (point retenu précédent, candidat, moyenne suivante)
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def minmax_envelope(x, y_min, y_max, n_out):
+    """Enveloppe réduite à n_out paquets : minimum des minima et maximum des maxima de chaque paquet"""
+    n = len(x)
+    if n <= n_out:
+        return np.asarray(x), np.asarray(y_min), np.asarray(y_max)
+    starts = np.linspace(0, n, n_out, endpoint=False).astype(np.int64)
+    # fmin / fmax ignorent les valeurs manquantes (NaN)
+    return (np.asarray(x)[starts],
+            np.fmin.reduceat(np.asarray(y_min, dtype=np.float64), starts),
+            np.fmax.reduceat(np.asarray(y_max, dtype=np.float64), starts))
+
+
+def downsample_series(x, y, y_min, y_max, n_out):
+    """
+    Réduit une série agrégée (moyenne + min/max par intervalle) à n_out points.
+    x : horodatages numériques (secondes). Les intervalles sans valeur sont ignorés.
+    Retourne (x_ligne, y_ligne, x_enveloppe, y_min, y_max).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~np.isnan(y)
+    x, y = x[valid], y[valid]
+    y_min = np.asarray(y_min, dtype=np.float64)[valid]
+    y_max = np.asarray(y_max, dtype=np.float64)[valid]
+    idx = lttb(x, y, n_out)
+    env_x, env_min, env_max = minmax_envelope(x, y_min, y_max, n_out)
+    return x[idx], y[idx], env_x, env_min, env_max
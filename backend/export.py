@@ -0,0 +1,286 @@
+"""
+Export des séries de mesures (sensor_data) pour l'analyse hors ligne.
+
+Les lignes sont lues par un curseur côté serveur, EXPORT_FETCH_ROWS à la fois, et chaque
+lot est encodé puis envoyé aussitôt : la mémoire reste constante quelle que soit la
+période exportée. Formats : csv (toujours disponible), parquet (un row group par lot)
+et arrow (flux IPC), ces deux derniers si pyarrow est installé.
+
+    python -m backend.export --patients 12 --format parquet -o patient12.parquet
+    python -m backend.export --pathologie Asthme --start 2026-01-01 --columns timestamp,spo2,risk_score
+"""
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+
+import psycopg2
+from psycopg2 import sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # export csv uniquement
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "10000"))
+# Chaque export garde une connexion du pool pendant toute sa durée
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+# Colonnes exportables (ordre par défaut) -> type Arrow
+EXPORT_COLUMNS = {
+    "data_id": "int64",
+    "patient_id": "int32",
+    "timestamp": "timestamp",
+    "spo2": "float64",
+    "bpm": "int32",
+    "flow_rate": "float64",
+    "muscle_strength": "float64",
+    "temperature": "float64",
+    "risk_score": "float64",
+    "status": "string",
+    "recommendation": "string",
+    "model_version": "string",
+    "actual_outcome": "int16",
+    "feedback_notes": "string",
+    "feedback_at": "timestamp",
+}
+# Format -> (type MIME, extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+_ORDER_BY = sql.SQL(" ORDER BY patient_id, timestamp, data_id")
+
+
+class ExportError(ValueError):
+    """Paramètres d'export invalides (colonne ou format inconnu, format indisponible)."""
+
+
+def parse_columns(value):
+    """Colonnes demandées ("spo2,bpm" ou liste), dans l'ordre donné ; toutes si vide"""
+    names = [c.strip() for c in value.split(",")] if isinstance(value, str) else list(value or ())
+    names = [c for c in names if c]
+    if not names:
+        return tuple(EXPORT_COLUMNS)
+    unknown = [c for c in names if c not in EXPORT_COLUMNS]
+    if unknown:
+        raise ExportError(f"Colonne(s) inconnue(s) : {', '.join(unknown)} (disponibles : {', '.join(EXPORT_COLUMNS)})")
+    return tuple(dict.fromkeys(names))
+
+
+def check_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Format inconnu : {fmt} ({', '.join(EXPORT_FORMATS)})")
+    if fmt != "csv" and pa is None:
+        raise ExportError(f"Format {fmt} indisponible : pyarrow n'est pas installé (utiliser csv)")
+    return fmt
+
+
+def build_query(columns, patient_ids=None, pathologie=None, start=None, end=None):
+    """Requête d'export ; seuls les filtres fournis sont ajoutés (bornes constantes : élagage des partitions)"""
+    conditions, params = [], []
+    if patient_ids is not None:
+        conditions.append(sql.SQL("patient_id = ANY(%s::int[])"))
+        params.append(list(patient_ids))
+    if pathologie is not None:
+        conditions.append(sql.SQL("patient_id IN (SELECT patient_id FROM patients WHERE pathologie = %s)"))
+        params.append(pathologie)
+    if start is not None:
+        conditions.append(sql.SQL("timestamp >= %s"))
+        params.append(start)
+    if end is not None:
+        conditions.append(sql.SQL("timestamp < %s"))
+        params.append(end)
+    query = sql.SQL("SELECT {} FROM sensor_data").format(sql.SQL(", ").join(map(sql.Identifier, columns)))
+    if conditions:
+        query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    return query + _ORDER_BY, params
+
+
+def arrow_schema(columns):
+    types = {
+        "int16": pa.int16(), "int32": pa.int32(), "int64": pa.int64(), "float64": pa.float64(),
+        "string": pa.string(), "timestamp": pa.timestamp("us"),
+    }
+    return pa.schema([(c, types[EXPORT_COLUMNS[c]]) for c in columns])
+
+
+class _ChunkSink:
+    """Fichier en écriture seule vidé après chaque lot ; tell() reste la position absolue (pieds Parquet)"""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class CsvEncoder:
+    def __init__(self, columns):
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+        self._writer.writerow(columns)
+
+    def _drain(self):
+        data = self._buf.getvalue().encode("utf-8")
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+    def encode(self, rows):
+        # Horodatages ISO 8601 (séparateur T), valeur manquante = champ vide
+        self._writer.writerows(
+            [v.isoformat() if hasattr(v, "isoformat") else v for v in row] for row in rows
+        )
+        return self._drain()
+
+    def finish(self):
+        return self._drain()
+
+
+class ArrowEncoder:
+    """Flux Arrow IPC (fmt=arrow) ou fichier Parquet (fmt=parquet), un lot de lignes à la fois"""
+
+    def __init__(self, columns, fmt):
+        self._schema = arrow_schema(columns)
+        self._sink = _ChunkSink()
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(self._sink, self._schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_stream(self._sink, self._schema)
+
+    def encode(self, rows):
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), self._schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        return self._sink.drain()
+
+    def finish(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+class Export:
+    """
+    Un export en cours : connexion du pool et curseur côté serveur ouverts par open(),
+    lots encodés renvoyés par next_chunk() (None à la fin), libérés par close().
+    """
+
+    def __init__(self, pool, fmt="csv", columns=None, patient_ids=None, pathologie=None, start=None, end=None,
+                 fetch_rows=EXPORT_FETCH_ROWS):
+        self.pool = pool
+        self.format = check_format(fmt)
+        self.columns = parse_columns(columns)
+        self.query, self.params = build_query(self.columns, patient_ids, pathologie, start, end)
+        self.fetch_rows = fetch_rows
+        self.rows = 0
+        self.bytes = 0
+        self._conn = self._cursor = self._encoder = None
+        self._done = False
+
+    def open(self):
+        self._conn = self.pool.getconn()
+        try:
+            self._cursor = self._conn.cursor(name=f"export_{id(self):x}")
+            self._cursor.itersize = self.fetch_rows
+            self._cursor.execute(self.query, self.params)
+            self._encoder = CsvEncoder(self.columns) if self.format == "csv" else ArrowEncoder(self.columns, self.format)
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def next_chunk(self):
+        if self._done:
+            return None
+        rows = self._cursor.fetchmany(self.fetch_rows)
+        if rows:
+            data = self._encoder.encode(rows)
+            self.rows += len(rows)
+        else:
+            data = self._encoder.finish()
+            self._done = True
+        self.bytes += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.next_chunk, None)
+
+    def close(self):
+        """Ferme le curseur et rend la connexion (idempotent)"""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        broken = bool(conn.closed)
+        try:
+            if not broken:
+                conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+        finally:
+            self.pool.putconn(conn, close=broken)
+        if not self._done:
+            logger.info(f"Export interrompu après {self.rows} lignes ({self.bytes} octets)")
+
+
+def main():
+    from datetime import datetime
+    from backend.database import DatabasePool
+
+    parser = argparse.ArgumentParser(description="Export des mesures SmartBreath (csv, parquet, arrow)")
+    parser.add_argument("--patients", help="Identifiants séparés par des virgules (défaut : tous)")
+    parser.add_argument("--pathologie", help="Cohorte : patients ayant cette pathologie")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Début inclus (ISO 8601)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Fin exclue (ISO 8601)")
+    parser.add_argument("--columns", help=f"Colonnes (défaut : {','.join(EXPORT_COLUMNS)})")
+    parser.add_argument("--format", default="csv", choices=list(EXPORT_FORMATS))
+    parser.add_argument("-o", "--output", help="Fichier de sortie (défaut : sortie standard)")
+    args = parser.parse_args()
+
+    patient_ids = [int(p) for p in args.patients.split(",")] if args.patients else None
+    pool = DatabasePool(minconn=1, maxconn=1)
+    try:
+        export = Export(pool, args.format, args.columns, patient_ids, args.pathologie, args.start, args.end)
+    except ExportError as e:
+        parser.error(str(e))
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export.open():
+            out.write(chunk)
+    finally:
+        export.close()
+        pool.close()
+        if args.output:
+            out.close()
+    print(f"{export.rows} lignes exportées ({export.bytes} octets)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,32 @@
-import psycopg2
 import pandas as pd
 import os
 import logging
 import json
-from fastapi import FastAPI, HTTPException
+import time
+import asyncio
+from contextlib import asynccontextmanager, aclosing
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 from datetime import datetime, timedelta
 from ml_engine.predictor import RespiratoryAI
+try:
+    from ml_engine.refresh import refresh_model
+except ImportError:  # sans XGBoost (SMARTBREATH_ENGINE=numpy) : pas d'apprentissage incrémental
+    refresh_model = None
+from maintenance_metrics import performance_report, update_performance
+from backend.database import PoolTimeout, advisory_lock, db
+from backend.cache import LatestResults, TTLCache, etag_matches
+from backend.export import EXPORT_FORMATS, EXPORT_MAX_CONCURRENT, Export, ExportError
+from backend.maintenance import maintenance_loop
+from backend.metrics import MetricsMiddleware, Stages, metrics, profiler
+from backend.photos import PHOTO_MAX_BYTES, PhotoError, decode_base64, photo_store, photo_urls
+from backend.pubsub import PubSub, TooManySubscribers, sse_event, ws_event
+from backend.writer import WRITE_BEHIND, WriteBehindWriter
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,15 +34,134 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 ai_engine = None
-latest_results = {}
+ai_load_error = None
 
-try:
-    ai_engine = RespiratoryAI()
-    logger.info("IA SmartBreath connectée et prête (Température incluse)")
-except Exception as e:
-    logger.error(f"Erreur IA : {e}")
+def load_ai_engine():
+    """Charge l'IA (version live du registre). En cas d'échec, /health reste non prêt et le chargement est retenté."""
+    global ai_engine, ai_load_error
+    try:
+        ai_engine = RespiratoryAI()
+        ai_load_error = None
+        logger.info("IA SmartBreath connectée et prête (Température incluse)")
+    except Exception as e:
+        ai_load_error = str(e)
+        logger.error(f"Erreur IA : {e}")
+    return ai_engine
+
+load_ai_engine()
+
+# Rechargement des tendances au démarrage (dernières mesures des patients actifs)
+HISTORY_WARM_START = os.getenv("HISTORY_WARM_START", "1") == "1"
+HISTORY_WARM_START_HOURS = float(os.getenv("HISTORY_WARM_START_HOURS", "6"))
+# Création des partitions à venir et rétention de sensor_data (tâche quotidienne)
+PARTITION_MAINTENANCE = os.getenv("PARTITION_MAINTENANCE", "1") == "1"
+
+# Diffusion temps réel des analyses (WebSocket / SSE) ; "postgres" relaie entre workers
+pubsub = PubSub(os.getenv("PUBSUB_BACKEND", "memory"))
+# Intervalle des messages de maintien de connexion (s)
+STREAM_HEARTBEAT_S = float(os.getenv("STREAM_HEARTBEAT_S", "15"))
+
+# Écriture différée des mesures (WRITE_BEHIND=1) : /analyze n'attend plus l'INSERT
+writer = WriteBehindWriter() if WRITE_BEHIND else None
+
+# Apprentissage incrémental sur les nouveaux feedbacks (0 = désactivé, job externe python -m ml_engine.refresh)
+MODEL_REFRESH_INTERVAL_S = float(os.getenv("MODEL_REFRESH_INTERVAL_S", "3600"))
+# Vérification du registre des modèles : nouvelle version live/shadow chargée sans redémarrage
+MODEL_WATCH_INTERVAL_S = float(os.getenv("MODEL_WATCH_INTERVAL_S", "30"))
+# Verrou consultatif PostgreSQL : un seul worker entraîne à la fois
+MODEL_REFRESH_LOCK = 5_018_001
+# Jeton des endpoints /admin (en-tête X-Admin-Token) ; non défini = administration désactivée
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+model_refresh = {"runs": 0, "published": 0, "errors": 0, "last": None}
 
-app = FastAPI(title="SmartBreath Proactive API")
+WARM_START_QUERY = """
+    SELECT patient_id::text, spo2, bpm, EXTRACT(EPOCH FROM timestamp)::float8
+    FROM (
+        SELECT patient_id, spo2, bpm, timestamp,
+               ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY timestamp DESC) AS rn
+        FROM sensor_data
+        WHERE timestamp > NOW() - make_interval(secs => %s) AND timestamp <= NOW()
+    ) recent
+    WHERE rn <= %s
+    ORDER BY patient_id, timestamp ASC
+"""
+
+def load_trend_history():
+    """Recharge les N dernières mesures par patient pour que les tendances soient justes dès le déploiement"""
+    if ai_engine is None:
+        return 0
+    rows = db.fetchall(WARM_START_QUERY, (HISTORY_WARM_START_HOURS * 3600, ai_engine.history.window))
+    loaded = ai_engine.history.warm_start(rows)
+    logger.info(f"Historique des tendances rechargé : {loaded} mesures, {len(ai_engine.history)} patients")
+    return loaded
+
+def run_model_refresh():
+    """
+    Une passe d'apprentissage incrémental, sauf si un autre worker en exécute déjà une.
+    Connexion dédiée en autocommit : l'entraînement ne garde ni connexion du pool ni transaction.
+    """
+    with advisory_lock(MODEL_REFRESH_LOCK) as conn:
+        if conn is None:
+            return None
+        # Un seul thread XGBoost : l'ingestion garde la priorité
+        return refresh_model(conn, ai_engine.registry, nthread=1)
+
+async def model_refresh_loop():
+    """Rafraîchit périodiquement le modèle et suit les pointeurs du registre (live / shadow)"""
+    last_refresh = time.monotonic()
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_S)
+        if ai_engine is None:
+            # Chargement initial en échec : nouvel essai, hors de la boucle asyncio
+            if await asyncio.to_thread(load_ai_engine) is not None and HISTORY_WARM_START:
+                try:
+                    await db.run(load_trend_history)
+                except Exception as e:
+                    logger.error(f"Rechargement de l'historique impossible : {e}")
+            continue
+        if refresh_model and MODEL_REFRESH_INTERVAL_S > 0 and time.monotonic() - last_refresh >= MODEL_REFRESH_INTERVAL_S:
+            last_refresh = time.monotonic()
+            try:
+                result = await asyncio.to_thread(run_model_refresh)
+                if result is not None:
+                    model_refresh["runs"] += 1
+                    model_refresh["published"] += result["status"] == "published"
+                    model_refresh["last"] = result
+                    logger.info(f"Apprentissage incrémental : {result['status']} ({result.get('reason')})")
+            except Exception as e:
+                model_refresh["errors"] += 1
+                logger.error(f"Erreur apprentissage incrémental : {e}")
+        try:
+            await asyncio.to_thread(ai_engine.sync_models)
+        except Exception as e:
+            logger.error(f"Rechargement du modèle impossible, version précédente conservée : {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        await db.run(db.open)
+    except Exception as e:
+        logger.error(f"Pool BDD indisponible au démarrage : {e}")
+    if HISTORY_WARM_START:
+        try:
+            await db.run(load_trend_history)
+        except Exception as e:
+            logger.error(f"Rechargement de l'historique impossible : {e}")
+    if writer:
+        writer.start()
+    maintenance_task = asyncio.create_task(maintenance_loop()) if PARTITION_MAINTENANCE else None
+    refresh_task = asyncio.create_task(model_refresh_loop()) if MODEL_WATCH_INTERVAL_S > 0 else None
+    pubsub.start()
+    yield
+    pubsub.stop()
+    for task in (maintenance_task, refresh_task):
+        if task:
+            task.cancel()
+    if writer:
+        await asyncio.to_thread(writer.stop)
+    db.close()
+
+app = FastAPI(title="SmartBreath Proactive API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,13 +170,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD")
-}
+# Ajouté en dernier : englobe toute la requête (CORS compris)
+app.add_middleware(MetricsMiddleware)
 
 class RespiratoryMeasure(BaseModel):
     patient_id: str
@@ -49,6 +181,24 @@ class RespiratoryMeasure(BaseModel):
     bpm: int
     temperature: float  
 
+# Taille maximale d'un lot envoyé par une passerelle ESP32
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+
+# Contexte patient utile au modèle (âge, taille, tabac...) : change rarement,
+# mis en cache pour que l'ingestion ne relise pas la table patients à chaque mesure
+patient_cache = TTLCache(
+    maxsize=int(os.getenv("PATIENT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PATIENT_CACHE_TTL", "300"))
+)
+
+# Dernier résultat de chaque patient, servi par /status sans requête SQL. Alimenté par
+# /analyze et /feedback (et par le relais pub/sub pour les mesures des autres workers) ;
+# le TTL borne l'écart entre workers sans relais
+latest_results = LatestResults(
+    maxsize=int(os.getenv("LATEST_STATUS_CACHE_SIZE", "100000")),
+    ttl=float(os.getenv("LATEST_STATUS_TTL", "300"))
+)
+
 class FeedbackData(BaseModel):
     data_id: int
     actual_outcome: int 
@@ -77,56 +227,112 @@ class ProfileUpdate(BaseModel):
     photo_base64: Optional[str] = None
 
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+INSERT_MEASURE_QUERY = """
+    INSERT INTO sensor_data 
+    (patient_id, timestamp, spo2, bpm, flow_rate, muscle_strength, risk_score, status, recommendation, temperature,
+     model_version)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING data_id
+"""
 
-def save_to_db(patient_id, measure, risk_score, status, recommendation):
+def save_to_db(patient_id, measure, risk_score, status, recommendation, model_version=None, timestamp=None):
     """Insère la mesure et retourne l'ID généré pour le feedback futur"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
         temp_value = float(measure.temperature)
         
-        query = """
-            INSERT INTO sensor_data 
-            (patient_id, timestamp, spo2, bpm, flow_rate, muscle_strength, risk_score, status, recommendation, temperature)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING data_id
-        """
-        cur.execute(query, (
-            patient_id, datetime.now(), measure.spo2, measure.bpm, measure.flow_rate, 
+        row = db.fetchone(INSERT_MEASURE_QUERY, (
+            patient_id, timestamp or datetime.now(), measure.spo2, measure.bpm, measure.flow_rate, 
             measure.muscle_strength, risk_score, 
-            status, recommendation, temp_value, 
+            status, recommendation, temp_value, model_version
         ))
-        generated_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close(); conn.close()
-        return generated_id
+        return row[0]
     except Exception as e:
         logger.error(f"Erreur SQL Save : {e}")
         return None
 
+PATIENT_CONTEXT_QUERY = """
+    SELECT age, taille_cm, pathologie, nom, prenom, est_fumeur, poids_kg, email, photo_id
+    FROM patients WHERE patient_id = %s
+"""
+
 def get_patient_context(patient_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT age, taille_cm, pathologie, nom, prenom, est_fumeur, poids_kg, email, photo_base64 
-            FROM patients WHERE patient_id = %s
-        """, (patient_id,))
-        res = cur.fetchone()
-        cur.close()
-        conn.close()
+        res = db.fetchone(PATIENT_CONTEXT_QUERY, (patient_id,))
         if res:
             return {
                 "age": res[0], "height": res[1], "pathologie": res[2], 
                 "nom": res[3], "prenom": res[4], "is_smoker": bool(res[5]), 
                 "weight": res[6], "email": res[7],
-                "photo_url": res[8] 
+                **photo_urls(res[8])
             }
     except Exception as e:
         logger.error(f"Erreur contexte patient : {e}")
-    return {"nom": "Patient", "photo_url": None}
+    return {"nom": "Patient", **photo_urls(None)}
+
+MODEL_CONTEXT_QUERY = """
+    SELECT patient_id::text, age, taille_cm, pathologie, est_fumeur, poids_kg
+    FROM patients WHERE patient_id = ANY(%s::int[])
+"""
+
+def _model_context(row):
+    return {
+        "age": row[1], "height": row[2], "pathologie": row[3],
+        "is_smoker": bool(row[4]), "weight": row[5]
+    }
+
+def get_patient_contexts(patient_ids):
+    """Contexte modèle de plusieurs patients : cache d'abord, une seule requête pour les absents"""
+    contexts = {}
+    missing = []
+    for p_id in patient_ids:
+        ctx = patient_cache.get(p_id)
+        if ctx is None:
+            missing.append(p_id)
+        else:
+            contexts[p_id] = ctx
+    if not missing:
+        return contexts
+    try:
+        # patient_id est un entier : les identifiants non numériques n'existent pas en base
+        numeric_ids = [p_id for p_id in missing if p_id.isdigit()]
+        rows = db.fetchall(MODEL_CONTEXT_QUERY, (numeric_ids,)) if numeric_ids else []
+        for r in rows:
+            contexts[r[0]] = _model_context(r)
+        # Les patients inconnus sont aussi mis en cache (contexte vide) pour ne pas relancer la requête ;
+        # /register invalide l'entrée quand l'identifiant est attribué
+        for p_id in missing:
+            patient_cache.set(p_id, contexts.setdefault(p_id, {}))
+    except Exception as e:
+        logger.error(f"Erreur contexte patients : {e}")
+    return contexts
+
+def get_model_context(patient_id):
+    return get_patient_contexts([patient_id]).get(patient_id, {})
+
+def save_batch_to_db(rows):
+    """Insère toutes les mesures d'un lot en une seule instruction multi-lignes.
+    rows : tuples (patient_id, timestamp, spo2, bpm, flow_rate, muscle_strength, risk_score, status, recommendation,
+    temperature, model_version)
+    Retourne la liste des data_id dans l'ordre d'entrée."""
+    with db.cursor() as cur:
+        # Un seul aller-retour : page_size couvre tout le lot
+        result = execute_values(cur, """
+            INSERT INTO sensor_data 
+            (patient_id, timestamp, spo2, bpm, flow_rate, muscle_strength, risk_score, status, recommendation, temperature,
+             model_version)
+            VALUES %s
+            RETURNING data_id
+        """, rows, page_size=max(len(rows), 1), fetch=True)
+    return [r[0] for r in result]
+
+async def run_prediction(func, payload):
+    """
+    Prédiction sur la boucle asyncio avec l'historique en mémoire ; dans le threadpool avec
+    l'historique SQLite partagé (multi-workers), qui fait des E/S et peut attendre un verrou.
+    """
+    if ai_engine.history.blocking:
+        return await run_in_threadpool(func, payload)
+    return func(payload)
 
 def generate_mobile_response(status, recommendation, spo2):
     status_config = {
@@ -137,23 +343,81 @@ def generate_mobile_response(status, recommendation, spo2):
     }
     return status_config.get(status, {"color": "grey", "vibrate": False, "emergency": False})
 
+def status_payload(data_id, status, recommendation, spo2, bpm, risk_score, temperature, timestamp, actual_outcome=None):
+    """Dernier état d'un patient : format commun à /status et aux flux temps réel"""
+    mobile_config = generate_mobile_response(status, recommendation, spo2)
+    return {
+        "data_id": data_id,
+        "status": status,
+        "recommendation": recommendation,
+        "spo2": float(spo2),
+        "bpm": int(bpm),
+        "risk_score": float(risk_score),
+        "temperature": float(temperature),
+        "color": mobile_config["color"],
+        "emergency": mobile_config["emergency"],
+        "actual_outcome": actual_outcome,
+        "last_update": timestamp.isoformat()
+    }
+
+def _notify(messages):
+    with db.connection() as conn:
+        pubsub.relay.notify(conn, messages)
+
+def _on_status_published(patient_id, message):
+    """Mesure diffusée par un autre worker (relais PostgreSQL) : mise à jour du dernier état"""
+    latest_results.update(patient_id, json.loads(message) if isinstance(message, str) else message)
+
+if pubsub.relay is not None:
+    pubsub.add_listener(_on_status_published)
+# Profil modifié par un autre worker : son contexte en cache est périmé
+pubsub.add_invalidation_listener(patient_cache.invalidate)
+
+def _notify_invalidation(patient_id):
+    with db.connection() as conn:
+        pubsub.relay.notify_invalidation(conn, patient_id)
+
+async def invalidate_patient_elsewhere(patient_id):
+    """Fait oublier le contexte du patient aux autres workers (relais PostgreSQL) ; rien à faire sinon"""
+    if pubsub.relay is None:
+        return
+    try:
+        await db.run(_notify_invalidation, patient_id)
+    except Exception as e:
+        # Les autres workers retomberont sur le TTL du cache
+        logger.error(f"Erreur diffusion invalidation patient {patient_id} : {e}")
+
+async def publish_results(messages):
+    """Diffuse [(patient_id, payload)] aux abonnés ; une erreur de diffusion n'échoue jamais l'analyse"""
+    for patient_id, payload in messages:
+        latest_results.update(patient_id, payload)
+    if pubsub.relay is None:
+        pubsub.publish_local(messages)
+        return
+    try:
+        await db.run(_notify, messages)
+    except Exception as e:
+        logger.error(f"Erreur diffusion NOTIFY : {e}")
+        pubsub.publish_local(messages)
+
 
 @app.post("/register")
 async def register(user: UserRegister):
-    conn = get_db_connection(); cur = conn.cursor()
-    cur.execute("""
+    row = await db.run(db.fetchone, """
         INSERT INTO patients (nom, prenom, email, password, date_naissance, sexe, taille_cm, poids_kg, pathologie, est_fumeur)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING patient_id;
     """, (user.nom, user.prenom, user.email, user.password, user.date_naissance, user.sexe, user.taille_cm, user.poids_kg, user.pathologie, user.est_fumeur))
-    new_id = cur.fetchone()[0]
-    conn.commit(); cur.close(); conn.close()
-    return {"status": "success", "patient_id": str(new_id)}
+    patient_id = str(row[0])
+    # Des mesures reçues avant l'inscription ont pu mettre en cache un contexte vide pour cet identifiant
+    patient_cache.invalidate(patient_id)
+    await invalidate_patient_elsewhere(patient_id)
+    return {"status": "success", "patient_id": patient_id}
+
+LOGIN_QUERY = "SELECT patient_id, nom, password FROM patients WHERE email = %s"
 
 @app.post("/login")
 async def login(credentials: UserLogin):
-    conn = get_db_connection(); cur = conn.cursor()
-    cur.execute("SELECT patient_id, nom, password FROM patients WHERE email = %s", (credentials.email,))
-    user = cur.fetchone(); cur.close(); conn.close()
+    user = await db.run(db.fetchone, LOGIN_QUERY, (credentials.email,))
     if user and user[2] == credentials.password:
         return {"status": "success", "patient_id": str(user[0]), "nom": user[1]}
     raise HTTPException(status_code=401, detail="Identifiants incorrects")
@@ -162,17 +426,43 @@ async def login(credentials: UserLogin):
 async def analyze(measure: RespiratoryMeasure):
     global ai_engine 
     if ai_engine is None: raise HTTPException(status_code=503, detail="IA non prête")
+    stages = Stages("analyze")
     
-    ctx = get_patient_context(measure.patient_id)
+    ctx = await db.run(get_model_context, measure.patient_id)
+    stages.mark("context")
     ai_input = {**measure.dict(), **ctx, "patient_id": measure.patient_id}
-    ai_res = ai_engine.predict(ai_input)
+    ai_res = await run_prediction(ai_engine.predict, ai_input)
+    stages.mark("predict")
     
     risk_score = ai_res.get('risk_score', 0.5)
     status = ai_res.get('status', 'STABLE')
     recommendation = ai_res.get('recommendation', 'Analyse terminée')
     mobile_content = generate_mobile_response(status, recommendation, measure.spo2)
     
-    data_id = save_to_db(measure.patient_id, measure, risk_score, status, recommendation)
+    # Même horodatage en base et dans l'état diffusé : /status (cache ou base) renvoie le même ETag
+    now = datetime.now()
+    data_id = None
+    if writer:
+        try:
+            data_id = (await writer.allocate_ids(1))[0]
+        except Exception as e:
+            # Réserve de data_id épuisée et non rechargée : on retombe sur l'INSERT direct
+            logger.error(f"Erreur SQL Save (réservation data_id), écriture directe : {e}")
+        else:
+            writer.submit([(data_id, measure.patient_id, now, measure.spo2, measure.bpm, measure.flow_rate,
+                            measure.muscle_strength, risk_score, status, recommendation, float(measure.temperature),
+                            ai_res.get('model_version'))])
+    if data_id is None:
+        data_id = await db.run(save_to_db, measure.patient_id, measure, risk_score, status, recommendation,
+                               ai_res.get('model_version'), now)
+    stages.mark("save")
+    if data_id is None:
+        # Mesure non enregistrée : le capteur doit la renvoyer, pas croire qu'elle est acquise
+        raise HTTPException(status_code=503, detail="Mesure non enregistrée, réessayer")
+    await publish_results([(measure.patient_id, status_payload(
+        data_id, status, recommendation, measure.spo2, measure.bpm, risk_score, measure.temperature, now
+    ))])
+    stages.mark("publish")
     
     res_payload = {
         "data_id": data_id,
@@ -183,37 +473,135 @@ async def analyze(measure: RespiratoryMeasure):
         "temperature": measure.temperature,
         "recommendation": recommendation, 
         **mobile_content,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": now.isoformat()
     }
     return res_payload
 
+@app.post("/analyze/batch")
+async def analyze_batch(measures: List[RespiratoryMeasure]):
+    """Ingestion par lot : un appel IA vectorisé et une seule insertion SQL"""
+    global ai_engine
+    if ai_engine is None: raise HTTPException(status_code=503, detail="IA non prête")
+    if not measures:
+        return {"status": "success", "count": 0, "results": []}
+    if len(measures) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Lot trop volumineux (max {MAX_BATCH_SIZE} mesures)")
+
+    stages = Stages("analyze_batch")
+    contexts = await db.run(get_patient_contexts, {m.patient_id for m in measures})
+    stages.mark("context")
+    ai_inputs = [
+        {**m.dict(), **contexts.get(m.patient_id, {}), "patient_id": m.patient_id}
+        for m in measures
+    ]
+    ai_results = await run_prediction(ai_engine.predict_batch, ai_inputs)
+    stages.mark("predict")
+
+    now = datetime.now()
+    rows = [
+        (m.patient_id, now, m.spo2, m.bpm, m.flow_rate, m.muscle_strength,
+         r.get('risk_score', 0.5), r.get('status', 'STABLE'),
+         r.get('recommendation', 'Analyse terminée'), float(m.temperature), r.get('model_version'))
+        for m, r in zip(measures, ai_results)
+    ]
+    data_ids = None
+    if writer:
+        try:
+            data_ids = await writer.allocate_ids(len(rows))
+        except Exception as e:
+            logger.error(f"Erreur SQL Save (réservation de {len(rows)} data_id), écriture directe : {e}")
+        else:
+            writer.submit([(data_id, *row) for data_id, row in zip(data_ids, rows)])
+            db_status = "queued"
+    try:
+        if data_ids is None:
+            data_ids = await db.run(save_batch_to_db, rows)
+            db_status = "saved"
+    except Exception as e:
+        logger.error(f"Erreur SQL Save (lot de {len(rows)}) : {e}")
+        data_ids = [None] * len(rows)
+        db_status = "error"
+    stages.mark("save")
+
+    await publish_results([
+        (row[0], status_payload(data_id, row[7], row[8], row[2], row[3], row[6], row[9], now))
+        for row, data_id in zip(rows, data_ids)
+    ])
+    stages.mark("publish")
+
+    results = []
+    for m, r, data_id in zip(measures, ai_results, data_ids):
+        status = r.get('status', 'STABLE')
+        results.append({
+            "patient_id": m.patient_id,
+            "data_id": data_id,
+            "db_status": db_status,
+            "status": status,
+            "risk_score": float(r.get('risk_score', 0.5)),
+            "recommendation": r.get('recommendation', 'Analyse terminée'),
+            **generate_mobile_response(status, r.get('recommendation'), m.spo2)
+        })
+    return {
+        "status": "partial" if db_status == "error" else "success",
+        "count": len(results),
+        "timestamp": now.isoformat(),
+        "results": results
+    }
+
+FEEDBACK_QUERY = """
+    UPDATE sensor_data 
+    SET actual_outcome = %s, feedback_notes = %s, feedback_at = NOW()
+    WHERE data_id = %s
+    RETURNING patient_id::text
+"""
+
+# data_id déjà distribué par la séquence (NULL tant qu'aucun n'a été tiré)
+DATA_ID_ALLOCATED_QUERY = """
+    SELECT %s <= COALESCE(pg_sequence_last_value(pg_get_serial_sequence('sensor_data', 'data_id')::regclass), 0)
+"""
+
+def _feedback_not_written(data_id):
+    """Mesure réservée mais pas encore en base : dans la file d'un autre worker ou en débordement sur disque"""
+    return HTTPException(
+        status_code=409, headers={"Retry-After": "1"},
+        detail=f"Mesure {data_id} pas encore enregistrée (écriture différée), réessayer plus tard"
+    )
+
 @app.post("/feedback")
 async def submit_feedback(fb: FeedbackData):
     """Permet au patient de confirmer ou d'infirmer l'analyse de l'IA (Apprentissage supervisé)"""
     try:
-        conn = get_db_connection(); cur = conn.cursor()
-        cur.execute("""
-            UPDATE sensor_data 
-            SET actual_outcome = %s, feedback_notes = %s 
-            WHERE data_id = %s
-        """, (fb.actual_outcome, fb.comment, fb.data_id))
-        conn.commit(); cur.close(); conn.close()
+        row = await db.run(db.fetchone, FEEDBACK_QUERY, (fb.actual_outcome, fb.comment, fb.data_id))
+        if row is None and writer and writer.is_pending(fb.data_id):
+            # Mesure encore dans la file d'écriture différée de ce worker : on attend son écriture
+            if not await db.run(writer.wait_written, fb.data_id):
+                raise _feedback_not_written(fb.data_id)
+            row = await db.run(db.fetchone, FEEDBACK_QUERY, (fb.actual_outcome, fb.comment, fb.data_id))
+        if row is None:
+            # Identifiant réservé par un writer (autre worker, fichier de débordement) : la ligne arrivera
+            if writer and (await db.run(db.fetchone, DATA_ID_ALLOCATED_QUERY, (fb.data_id,)))[0]:
+                raise _feedback_not_written(fb.data_id)
+            raise HTTPException(status_code=404, detail=f"Mesure {fb.data_id} introuvable")
+        # Feedback sur la dernière mesure du patient : l'état servi par /status l'inclut
+        entry = latest_results.get(row[0])
+        if entry is not None and entry[0].get("data_id") == fb.data_id:
+            latest_results.update(row[0], {**entry[0], "actual_outcome": fb.actual_outcome})
         logger.info(f"Feedback reçu pour la mesure {fb.data_id} : Outcome={fb.actual_outcome}")
         return {"status": "success", "message": "Merci, SmartBreath apprend de votre expérience."}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erreur feedback : {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de l'enregistrement du feedback")
 
 @app.get("/profile/{patient_id}")
 async def get_profile(patient_id: str):
-    ctx = get_patient_context(patient_id)
+    ctx = await db.run(get_patient_context, patient_id)
     return {"status": "success", "data": ctx}
 
 @app.put("/profile/{patient_id}")
 async def update_profile(patient_id: str, profile: ProfileUpdate):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
         updates = []
         params = []
 
@@ -225,99 +613,461 @@ async def update_profile(patient_id: str, profile: ProfileUpdate):
             updates.append("pathologie = %s"); params.append(profile.pathologie)
         
         if profile.photo_base64 is not None:
-            updates.append("photo_base64 = %s")
-            params.append(profile.photo_base64)
+            # La photo va dans le stockage de photos ; la ligne patient ne garde que son empreinte
+            photo_id = None
+            if profile.photo_base64:
+                photo_id = await db.run(photo_store.put, decode_base64(profile.photo_base64))
+            updates.append("photo_id = %s")
+            params.append(photo_id)
 
         if not updates:
             return {"status": "no update needed"}
 
         params.append(patient_id)
-        query = f"UPDATE patients SET {', '.join(updates)} WHERE patient_id = %s"
+        query = f"""
+            UPDATE patients SET {', '.join(updates)} WHERE patient_id = %s
+            RETURNING patient_id::text, age, taille_cm, pathologie, est_fumeur, poids_kg
+        """
         
-        cur.execute(query, tuple(params))
-        conn.commit()
-        cur.close()
-        conn.close()
+        try:
+            row = await db.run(db.fetchone, query, tuple(params))
+        finally:
+            patient_cache.invalidate(patient_id)
+        # Write-through : le cache reflète immédiatement le profil mis à jour ; les autres workers l'oublient
+        if row:
+            patient_cache.set(patient_id, _model_context(row))
+            await invalidate_patient_elsewhere(patient_id)
         
         logger.info(f"Profil et photo mis à jour pour le patient {patient_id}")
         return {"status": "success", "message": "Profil et Photo synchronisés"}
+    except PhotoError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur update profile : {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/status/{patient_id}")
-async def get_status(patient_id: str):
-    conn = get_db_connection(); cur = conn.cursor()
-    cur.execute("""
-        SELECT status, recommendation, spo2, bpm, risk_score, temperature, timestamp, data_id 
-        FROM sensor_data 
-        WHERE patient_id = %s 
-        ORDER BY timestamp DESC LIMIT 1
-    """, (patient_id,))
-    res = cur.fetchone(); cur.close(); conn.close()
-    
+SET_PHOTO_QUERY = "UPDATE patients SET photo_id = %s WHERE patient_id = %s RETURNING patient_id"
+
+@app.put("/profile/{patient_id}/photo")
+async def upload_photo(patient_id: str, request: Request):
+    """Photo en binaire (corps brut, sans base64) : lue par morceaux, refusée dès PHOTO_MAX_BYTES dépassé"""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > PHOTO_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Photo trop volumineuse (max {PHOTO_MAX_BYTES} octets)")
+        chunks.append(chunk)
+    try:
+        photo_id = await db.run(photo_store.put, b"".join(chunks))
+    except PhotoError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    row = await db.run(db.fetchone, SET_PHOTO_QUERY, (photo_id, patient_id))
+    if not row:
+        raise HTTPException(status_code=404, detail="Patient inconnu")
+    logger.info(f"Photo mise à jour pour le patient {patient_id} ({size} octets)")
+    return {"status": "success", **photo_urls(photo_id)}
+
+@app.get("/photos/{photo_id}")
+async def get_photo(photo_id: str, size: str = "full", if_none_match: Optional[str] = Header(None)):
+    """Photo (ou miniature, size=thumb) ; contenu immuable pour un photo_id donné, mis en cache par les clients"""
+    if size not in ("full", "thumb"):
+        raise HTTPException(status_code=422, detail="size doit valoir full ou thumb")
+    try:
+        path, media_type = photo_store.path(photo_id, thumb=size == "thumb")
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Photo introuvable")
+    etag = f'"{photo_id.split(".")[0]}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+STATUS_QUERY = """
+    SELECT status, recommendation, spo2, bpm, risk_score, temperature, timestamp, data_id, actual_outcome
+    FROM sensor_data 
+    WHERE patient_id = %s 
+    ORDER BY timestamp DESC, data_id DESC LIMIT 1
+"""
+
+def fetch_status(patient_id):
+    res = db.fetchone(STATUS_QUERY, (patient_id,))
     if res:
-        status_name = res[0]
-        mobile_config = generate_mobile_response(status_name, res[1], res[2])
-        return {
-            "data_id": res[7],
-            "status": status_name,
-            "recommendation": res[1],
-            "spo2": float(res[2]),
-            "bpm": int(res[3]),
-            "risk_score": float(res[4]),
-            "temperature": float(res[5]),
-            "color": mobile_config["color"],
-            "emergency": mobile_config["emergency"],
-            "last_update": res[6].isoformat()
-        }
+        return status_payload(res[7], res[0], res[1], res[2], res[3], res[4], res[5], res[6], res[8])
     return {"status": "STABLE", "recommendation": "Aucune donnée", "spo2": 0, "bpm": 0, "risk_score": 0, "temperature": 0}
 
+async def latest_status(patient_id):
+    """(payload, etag) du dernier état : cache, relu en base en cas d'absence (démarrage, éviction, TTL)"""
+    entry = latest_results.get(patient_id)
+    if entry is None:
+        entry = latest_results.update(patient_id, await db.run(fetch_status, patient_id))
+    return entry
+
+@app.get("/status/{patient_id}")
+async def get_status(patient_id: str, if_none_match: Optional[str] = Header(None)):
+    """Dernier état du patient ; 304 sans corps si l'application a déjà cette version (If-None-Match)"""
+    payload, etag = await latest_status(patient_id)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+def _subscribe(patient_id):
+    try:
+        return pubsub.subscribe(patient_id)
+    except TooManySubscribers as e:
+        logger.error(f"Abonnement refusé pour le patient {patient_id} : {e}")
+        return None
+
+async def _stream_events(patient_id, sub, is_disconnected):
+    """Flux d'un abonné : état courant, puis chaque nouvelle mesure (et les pertes éventuelles)"""
+    snapshot, _ = await latest_status(patient_id)
+    yield "status", json.dumps(snapshot, default=str)
+    dropped = 0
+    while True:
+        data = await sub.get(timeout=STREAM_HEARTBEAT_S)
+        if data is None:
+            if await is_disconnected():
+                return
+            yield None, None
+            continue
+        if sub.dropped != dropped:
+            yield "lag", json.dumps({"dropped": sub.dropped - dropped})
+            dropped = sub.dropped
+        yield "measure", data
+
+@app.get("/stream/status/{patient_id}")
+async def stream_status(patient_id: str, request: Request):
+    """Server-Sent Events : remplace l'interrogation périodique de /status"""
+    sub = _subscribe(patient_id)
+    if sub is None:
+        raise HTTPException(status_code=503, detail="Trop d'abonnés, réessayez plus tard")
+
+    async def body():
+        try:
+            async with aclosing(_stream_events(patient_id, sub, request.is_disconnected)) as events:
+                async for event, data in events:
+                    yield sse_event(event, data) if event else ": ping\n\n"
+        finally:
+            pubsub.unsubscribe(sub)
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/ws/status/{patient_id}")
+async def ws_status(websocket: WebSocket, patient_id: str):
+    """WebSocket : mêmes messages que le flux SSE, sous la forme {"event": ..., "data": ...}"""
+    await websocket.accept()
+    sub = _subscribe(patient_id)
+    if sub is None:
+        await websocket.close(code=1013)
+        return
+
+    closed = asyncio.Event()
+
+    async def watch_close():
+        # Le client n'envoie rien : seule la déconnexion est attendue
+        try:
+            while True:
+                await websocket.receive_text()
+        except (WebSocketDisconnect, RuntimeError):
+            closed.set()
+
+    async def is_disconnected():
+        return closed.is_set()
+
+    watcher = asyncio.create_task(watch_close())
+    try:
+        async with aclosing(_stream_events(patient_id, sub, is_disconnected)) as events:
+            async for event, data in events:
+                if closed.is_set():
+                    break
+                await websocket.send_text(ws_event(event, data) if event else '{"event": "ping"}')
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        pubsub.unsubscribe(sub)
+
+# Agrégat exact sur la fenêtre glissante [NOW() - secs, NOW()] : les heures complètes sont lues
+# dans sensor_rollup_hourly, seule l'heure de bord (partielle) est relue dans sensor_data.
+# Le coût reste constant quel que soit le volume d'historique du patient.
+ROLLING_ROLLUP_QUERY = """
+    WITH agg AS (
+        SELECT n, sum_spo2, sum_risk, n_critique, n_prevention
+        FROM sensor_rollup_hourly
+        WHERE patient_id = %(patient_id)s
+          AND bucket >= date_trunc('hour', NOW() - make_interval(secs => %(secs)s)) + INTERVAL '1 hour'
+        UNION ALL
+        -- Bornes calculées à partir de NOW() (stable) : élagage des partitions dès l'exécution
+        SELECT COUNT(*), COALESCE(SUM(spo2), 0), COALESCE(SUM(risk_score), 0),
+               COUNT(*) FILTER (WHERE status = 'CRITIQUE'), COUNT(*) FILTER (WHERE status = 'PRÉVENTION')
+        FROM sensor_data
+        WHERE patient_id = %(patient_id)s
+          AND timestamp > NOW() - make_interval(secs => %(secs)s)
+          AND timestamp < date_trunc('hour', NOW() - make_interval(secs => %(secs)s)) + INTERVAL '1 hour'
+    )
+    SELECT ROUND((SUM(sum_spo2) / NULLIF(SUM(n), 0))::numeric, 1),
+           ROUND((SUM(sum_risk) / NULLIF(SUM(n), 0) * 100)::numeric, 1),
+           SUM(n_critique), SUM(n_prevention), SUM(n),
+           SUM(sum_risk) / NULLIF(SUM(n), 0)
+    FROM agg
+"""
+
 @app.get("/dashboard-summary/{patient_id}")
 async def get_dashboard_summary(patient_id: str):
-    conn = get_db_connection(); cur = conn.cursor()
-    cur.execute("""
-        SELECT ROUND(AVG(spo2)::numeric, 1), ROUND((AVG(risk_score) * 100)::numeric, 1),
-        COUNT(*) FILTER (WHERE status = 'CRITIQUE'), COUNT(*) FILTER (WHERE status = 'PRÉVENTION'), COUNT(*)
-        FROM sensor_data WHERE patient_id = %s AND timestamp > NOW() - INTERVAL '24 hours'
-    """, (patient_id,))
-    row = cur.fetchone(); cur.close(); conn.close()
+    row = await db.run(db.fetchone, ROLLING_ROLLUP_QUERY, {"patient_id": patient_id, "secs": 24 * 3600})
     return {
         "spo2_moyen": float(row[0] or 0), "risque_moyen": float(row[1] or 0),
         "nb_alertes_critiques": int(row[2] or 0), "nb_alertes_preventives": int(row[3] or 0),
         "total_mesures": int(row[4] or 0)
     }
 
+STATS_GRAPH_QUERY = """
+    SELECT TO_CHAR(bucket, 'DD/MM'), sum_risk / n * 100, sum_temp / NULLIF(n_temp, 0)
+    FROM sensor_rollup_daily
+    WHERE patient_id = %s AND bucket >= (NOW() - make_interval(days => %s))::date AND n > 0
+    ORDER BY bucket ASC
+"""
+
+STATS_TOTALS_QUERY = """
+    SELECT COALESCE(SUM(n), 0), MAX(max_spo2), MIN(min_risk)
+    FROM sensor_rollup_daily WHERE patient_id = %s
+"""
+
+def fetch_stats(patient_id, days):
+    """Les trois requêtes de /stats partagent une seule connexion du pool et ne lisent que les agrégats"""
+    with db.cursor() as cur:
+        cur.execute(ROLLING_ROLLUP_QUERY, {"patient_id": patient_id, "secs": days * 86400})
+        actuel = cur.fetchone()[5] or 0
+
+        cur.execute(STATS_GRAPH_QUERY, (patient_id, days))
+        graph_rows = cur.fetchall()
+
+        cur.execute(STATS_TOTALS_QUERY, (patient_id,))
+        totals = cur.fetchone()
+    return actuel, graph_rows, totals
+
 @app.get("/stats/{patient_id}")
 async def get_stats_dynamique(patient_id: str, periode: str = "semaine"):
     days = 7 if periode == "semaine" else 30
     if periode == "annee": days = 365
-    conn = get_db_connection(); cur = conn.cursor()
-    
-    cur.execute("SELECT AVG(risk_score) FROM sensor_data WHERE patient_id = %s AND timestamp > NOW() - make_interval(days => %s)", (patient_id, days))
-    actuel = cur.fetchone()[0] or 0
+    actuel, graph_rows, totals = await db.run(fetch_stats, patient_id, days)
 
-    cur.execute("""
-        SELECT TO_CHAR(timestamp, 'DD/MM'), AVG(risk_score) * 100, AVG(temperature)
-        FROM sensor_data WHERE patient_id = %s AND timestamp > NOW() - make_interval(days => %s)
-        GROUP BY 1 ORDER BY MIN(timestamp) ASC
-    """, (patient_id, days))
-    graph_rows = cur.fetchall()
-
-    cur.execute("SELECT COUNT(*), MAX(spo2), MIN(risk_score) FROM sensor_data WHERE patient_id = %s", (patient_id,))
-    totals = cur.fetchone()
-
-    cur.close(); conn.close()
     return {
         "risque_moyen": round(float(actuel) * 100, 1),
-        "jours_consecutifs": totals[0],
+        "jours_consecutifs": int(totals[0]),
         "graph_data": {
             "labels": [r[0] for r in graph_rows] if graph_rows else ["N/A"],
             "risk_values": [float(r[1]) for r in graph_rows] if graph_rows else [0],
-            "temp_values": [float(r[2]) for r in graph_rows] if graph_rows else [0]
+            "temp_values": [float(r[2] or 0) for r in graph_rows] if graph_rows else [0]
         }
     }
 
+def fetch_performance(days, model_version):
+    """Compte les feedbacks reçus depuis le dernier appel puis lit l'état par jour et par version"""
+    with db.connection() as conn:
+        update_performance(conn)
+        return performance_report(conn, days, model_version)
+
+@app.get("/performance")
+async def get_performance(days: int = 30, model_version: Optional[str] = None):
+    """Performance de l'IA sur les feedbacks patients : matrice de confusion, précision, rappel, AUC"""
+    if not 1 <= days <= 3650:
+        raise HTTPException(status_code=422, detail="days doit être compris entre 1 et 3650")
+    try:
+        return {"status": "success", "data": await db.run(fetch_performance, days, model_version)}
+    except Exception as e:
+        logger.error(f"Erreur calcul de performance : {e}")
+        raise HTTPException(status_code=500, detail="Erreur lors du calcul de la performance")
+
+# Un export garde une connexion du pool : leur nombre est plafonné pour ne pas affamer /analyze
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+class ExportResponse(StreamingResponse):
+    """Flux d'un export ; la connexion est rendue au pool quelle que soit l'issue (fin, erreur, déconnexion)"""
+
+    def __init__(self, export, filename):
+        media_type, ext = EXPORT_FORMATS[export.format]
+        super().__init__(self._chunks(export), media_type=media_type,
+                         headers={"Content-Disposition": f'attachment; filename="{filename}.{ext}"'})
+        self.export = export
+
+    @staticmethod
+    async def _chunks(export):
+        while (chunk := await db.run(export.next_chunk)) is not None:
+            if chunk:
+                yield chunk
+
+    async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await db.run(self.export.close)
+            export_slots.release()
+            logger.info(f"Export {self.export.format} : {self.export.rows} lignes, {self.export.bytes} octets "
+                        f"en {time.perf_counter() - start:.1f}s")
+
+async def start_export(filename, fmt, columns, start, end, patient_ids=None, pathologie=None):
+    try:
+        export = Export(db, fmt, columns, patient_ids, pathologie, start, end)
+    except ExportError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if export_slots.locked():
+        raise HTTPException(status_code=429, detail="Trop d'exports en cours, réessayez plus tard")
+    await export_slots.acquire()
+    try:
+        await db.run(export.open)
+    except PoolTimeout:
+        export_slots.release()
+        raise HTTPException(status_code=503, detail="Base de données saturée, réessayez plus tard")
+    except Exception as e:
+        export_slots.release()
+        logger.error(f"Erreur ouverture export : {e}")
+        raise HTTPException(status_code=500, detail="Erreur lors de l'export")
+    return ExportResponse(export, filename)
+
+@app.get("/export/{patient_id}")
+async def export_patient(patient_id: int, format: str = "csv", columns: Optional[str] = None,
+                         start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Historique des mesures d'un patient sur [start, end[, en flux (csv, parquet ou arrow)"""
+    return await start_export(f"patient_{patient_id}", format, columns, start, end, patient_ids=[patient_id])
+
+@app.get("/export")
+async def export_cohort(patient_ids: Optional[str] = None, pathologie: Optional[str] = None, format: str = "csv",
+                        columns: Optional[str] = None, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None):
+    """Export d'une cohorte : liste de patients (patient_ids=1,2,3) et/ou pathologie ; tous les patients sinon"""
+    try:
+        ids = [int(p) for p in patient_ids.split(",") if p.strip()] if patient_ids else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="patient_ids doit être une liste d'entiers séparés par des virgules")
+    return await start_export("cohorte", format, columns, start, end, patient_ids=ids, pathologie=pathologie)
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "ia": "ready" if ai_engine else "off"}
\ No newline at end of file
+    db_health = await db.run(db.health_check)
+    payload = {
+        "status": "healthy" if db_health["status"] == "up" else "degraded",
+        # Prêt à recevoir du trafic : un modèle est chargé (503 sinon, pour le répartiteur de charge)
+        "ready": ai_engine is not None,
+        "ia": "ready" if ai_engine else "off",
+        "ia_error": ai_load_error,
+        "model": ai_engine.model_info() if ai_engine else None,
+        "model_refresh": model_refresh,
+        "db": db_health,
+        "db_pool": db.metrics(),
+        "patient_cache": patient_cache.stats(),
+        "latest_results": latest_results.stats(),
+        "write_behind": writer.stats() if writer else None,
+        "trend_history": ai_engine.history.stats() if ai_engine else None,
+        "pubsub": pubsub.stats()
+    }
+    if ai_engine is None:
+        return JSONResponse(payload, status_code=503)
+    return payload
+
+@metrics.collector
+def collect_metrics():
+    """États déjà tenus par les composants (caches, pool, modèle, écriture différée), lus au scrape"""
+    caches = {"patient": patient_cache.stats(), "latest_status": latest_results.stats()}
+    for name, kind, key, help in (
+        ("smartbreath_cache_hits_total", "counter", "hits", "Lectures servies par le cache"),
+        ("smartbreath_cache_misses_total", "counter", "misses", "Lectures absentes du cache"),
+        ("smartbreath_cache_evictions_total", "counter", "evictions", "Entrées évincées (taille maximale)"),
+        ("smartbreath_cache_entries", "gauge", "size", "Entrées en cache"),
+    ):
+        yield name, kind, help, [({"cache": c}, s[key]) for c, s in caches.items()]
+
+    pool = db.metrics()
+    yield ("smartbreath_db_pool_connections", "gauge", "Connexions du pool par état",
+           [({"state": "in_use"}, pool["in_use"]), ({"state": "available"}, pool["available"])])
+    yield ("smartbreath_db_pool_acquired_total", "counter", "Connexions prêtées par le pool", [({}, pool["acquired"])])
+    yield ("smartbreath_db_pool_timeouts_total", "counter", "Attentes de connexion expirées", [({}, pool["timeouts"])])
+    yield ("smartbreath_db_pool_wait_seconds_max", "gauge", "Attente maximale d'une connexion",
+           [({}, pool["wait_ms_max"] / 1000)])
+
+    if ai_engine is not None:
+        info = ai_engine.model_info()
+        roles = {info["live"]["version"]: "live"}
+        if info["shadow"]:
+            roles[info["shadow"]["version"]] = "shadow"
+        latency, rows = [], []
+        for version, snapshot in info["versions"].items():
+            labels = {"version": version, "role": roles.get(version, "retired")}
+            stats = ai_engine.stats[version]
+            for q, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                if "latency_ms" in snapshot:
+                    latency.append(({**labels, "quantile": q}, snapshot["latency_ms"][key] / 1000))
+            latency.append(("_sum", labels, stats.latency_sum))
+            latency.append(("_count", labels, stats.calls))
+            rows.append((labels, stats.rows))
+        yield ("smartbreath_inference_seconds", "summary",
+               "Latence d'inférence par appel (quantiles sur les derniers appels)", latency)
+        yield "smartbreath_inference_rows_total", "counter", "Mesures scorées", rows
+        history = ai_engine.history.stats()
+        yield "smartbreath_trend_history_patients", "gauge", "Patients en mémoire de tendance", [({}, history["patients"])]
+
+    if writer:
+        w = writer.stats()
+        yield ("smartbreath_write_behind_rows_total", "counter", "Mesures de l'écriture différée par issue",
+               [({"outcome": k}, w[k]) for k in ("submitted", "written", "spilled", "replayed", "dropped", "rejected")])
+        yield "smartbreath_write_behind_queue_depth", "gauge", "Mesures en file", [({}, w["queue_depth"])]
+        yield "smartbreath_write_behind_spill_files", "gauge", "Fichiers de débordement à rejouer", [({}, w["spill_files"])]
+
+    p = pubsub.stats()
+    yield "smartbreath_pubsub_subscribers", "gauge", "Abonnés temps réel", [({}, p["subscribers"])]
+    yield "smartbreath_pubsub_dropped_total", "counter", "Messages perdus par des abonnés lents", [({}, p["dropped"])]
+    yield "smartbreath_profiler_dumps_total", "counter", "Requêtes lentes profilées", [({}, profiler.dumps)]
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métriques au format texte Prometheus (un worker par scrape : label pid)"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _require_admin(token, needs_model=True):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Administration désactivée (ADMIN_TOKEN non défini)")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Jeton d'administration invalide")
+    if needs_model and ai_engine is None:
+        raise HTTPException(status_code=503, detail="IA non prête")
+
+@app.get("/admin/models")
+async def list_models(x_admin_token: Optional[str] = Header(None)):
+    """Versions du registre (métadonnées, rôles) et statistiques des versions chargées par ce worker"""
+    _require_admin(x_admin_token)
+    return {"registry": await asyncio.to_thread(ai_engine.registry.describe), "loaded": ai_engine.model_info()}
+
+@app.post("/admin/models/{version}/load")
+async def load_model(version: str, role: str = "live", x_admin_token: Optional[str] = Header(None)):
+    """
+    Charge une version en arrière-plan (les requêtes continuent avec la version actuelle),
+    la substitue puis met à jour le pointeur du registre pour que les autres workers suivent.
+    """
+    _require_admin(x_admin_token)
+    if role not in ("live", "shadow"):
+        raise HTTPException(status_code=422, detail="role doit valoir live ou shadow")
+    try:
+        await asyncio.to_thread(ai_engine.load_version, version, role)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except Exception as e:
+        logger.error(f"Chargement du modèle {version} impossible : {e}")
+        raise HTTPException(status_code=422, detail=f"Modèle {version} invalide : {e}")
+    await asyncio.to_thread(ai_engine.registry.set_pointer, role, version)
+    return ai_engine.model_info()
+
+@app.delete("/admin/models/shadow")
+async def clear_shadow_model(x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    ai_engine.load_version(None, "shadow")
+    await asyncio.to_thread(ai_engine.registry.set_pointer, "shadow", None)
+    return ai_engine.model_info()
+
+@app.post("/admin/profiler")
+async def configure_profiler(slow_ms: Optional[float] = None, interval_ms: Optional[float] = None,
+                             x_admin_token: Optional[str] = Header(None)):
+    """Active (slow_ms > 0) ou désactive (slow_ms=0) le profilage des requêtes lentes, sans redémarrage"""
+    _require_admin(x_admin_token, needs_model=False)
+    return profiler.configure(slow_ms, interval_ms)
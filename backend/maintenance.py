@@ -0,0 +1,148 @@
+"""
+Maintenance de la table partitionnée sensor_data.
+
+    python -m backend.maintenance partitions --ahead 3     # crée les partitions des mois à venir
+    python -m backend.maintenance retention --keep-months 24 --archive-dir /var/backups/smartbreath
+
+Le backend exécute aussi ces deux tâches au démarrage puis une fois par jour
+(PARTITION_MAINTENANCE=1), dans un seul worker à la fois (verrou consultatif).
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date
+
+from backend.database import advisory_lock, db
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# 0 = conservation illimitée
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+MAINTENANCE_INTERVAL_S = 24 * 3600
+# Verrou consultatif PostgreSQL : création et archivage des partitions par un seul worker
+MAINTENANCE_LOCK = 5_010_001
+
+_PARTITION_RE = re.compile(r"^sensor_data_y(\d{4})m(\d{2})$")
+
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Crée les partitions mensuelles manquantes jusqu'à months_ahead mois après le mois courant"""
+    created = db.fetchone("SELECT sensor_data_ensure_partitions(%s, 0)", (months_ahead,))[0]
+    if created:
+        logger.info(f"{created} partition(s) sensor_data créée(s)")
+    return created
+
+
+def list_partitions():
+    """Partitions mensuelles attachées : [(nom, début du mois)] triées par date"""
+    rows = db.fetchall("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'sensor_data'::regclass
+    """)
+    parts = []
+    for (name,) in rows:
+        m = _PARTITION_RE.match(name)
+        if m:
+            parts.append((name, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(parts, key=lambda p: p[1])
+
+
+def _month_add(d, months):
+    total = d.year * 12 + d.month - 1 + months
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _archive_partition(name, start, archive_dir):
+    """Exporte une partition en CSV gzip, la détache puis la supprime (une transaction)"""
+    end = _month_add(start, 1)
+    path = None
+    with db.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {name}")
+        row_count = cur.fetchone()[0]
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            with gzip.open(path, "wb") as f:
+                cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+                f.flush()
+                os.fsync(f.fileno())
+        cur.execute(f"ALTER TABLE sensor_data DETACH PARTITION {name}")
+        if archive_dir:
+            cur.execute(f"DROP TABLE {name}")
+        else:
+            # Sans dossier d'archive, la partition reste disponible comme table autonome
+            cur.execute(f"ALTER TABLE {name} RENAME TO {name}_archived")
+        cur.execute("""
+            INSERT INTO sensor_data_archive_log (partition_name, range_start, range_end, row_count, archive_path)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (partition_name) DO UPDATE SET archived_at = NOW(), archive_path = EXCLUDED.archive_path
+        """, (name, start, end, row_count, path))
+    logger.info(f"Partition {name} archivée ({row_count} mesures) -> {path or name + '_archived'}")
+    return row_count
+
+
+def apply_retention(keep_months=RETENTION_MONTHS, archive_dir=ARCHIVE_DIR, today=None):
+    """Archive les partitions entièrement plus anciennes que keep_months mois"""
+    if keep_months <= 0:
+        return []
+    cutoff = _month_add((today or date.today()).replace(day=1), -keep_months)
+    archived = []
+    for name, start in list_partitions():
+        if _month_add(start, 1) <= cutoff:
+            _archive_partition(name, start, archive_dir)
+            archived.append(name)
+    return archived
+
+
+def run_maintenance():
+    ensure_partitions()
+    return apply_retention()
+
+
+def run_maintenance_locked():
+    """run_maintenance, sauf si un autre worker l'exécute déjà (retourne None dans ce cas)"""
+    with advisory_lock(MAINTENANCE_LOCK) as conn:
+        if conn is None:
+            return None
+        return run_maintenance()
+
+
+async def maintenance_loop(interval=MAINTENANCE_INTERVAL_S):
+    """Tâche de fond du backend : partitions à venir + rétention, une fois par jour"""
+    while True:
+        try:
+            await asyncio.to_thread(run_maintenance_locked)
+        except Exception as e:
+            logger.error(f"Erreur maintenance des partitions : {e}")
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance des partitions sensor_data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_parts = sub.add_parser("partitions", help="Crée les partitions des mois à venir")
+    p_parts.add_argument("--ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    p_ret = sub.add_parser("retention", help="Archive les partitions au-delà de la rétention")
+    p_ret.add_argument("--keep-months", type=int, default=RETENTION_MONTHS or 24)
+    p_ret.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "partitions":
+            print(f"{ensure_partitions(args.ahead)} partition(s) créée(s)")
+        elif args.command == "retention":
+            archived = apply_retention(args.keep_months, args.archive_dir)
+            print(f"{len(archived)} partition(s) archivée(s) : {', '.join(archived) or '-'}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
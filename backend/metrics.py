@@ -0,0 +1,373 @@
+"""
+Métriques du backend au format texte Prometheus (GET /metrics) et profilage des requêtes lentes.
+
+Les compteurs et histogrammes sont mis à jour sur le chemin critique (environ une
+microseconde par observation, une dizaine par /analyze) ; les états déjà tenus ailleurs (caches, pool, écriture
+différée, modèle) sont lus seulement au moment du scrape par des collecteurs. Chaque
+worker expose ses propres valeurs (label pid).
+
+METRICS=0 désactive la collecte. PROFILE_SLOW_MS > 0 active le profileur par
+échantillonnage : les piles de tous les threads sont relevées toutes les
+PROFILE_INTERVAL_MS pendant les requêtes, et celles d'une requête plus lente que le
+seuil sont écrites au format « folded » (flamegraph.pl, speedscope) dans PROFILE_DIR.
+"""
+import bisect
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+# Bornes (secondes) des histogrammes de durée : de 0,1 ms à 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+# Bornes (octets) des tailles de requête et de réponse
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Profileur des requêtes lentes (0 = désactivé, activable à chaud par POST /admin/profiler)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "profiles"))
+# Nombre de fichiers de piles conservés (les plus anciens sont supprimés)
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Counter:
+    """Compteur monotone, une valeur par combinaison de labels"""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, v in values.items():
+            yield self.name, _labels(self.labelnames, labels), v
+
+
+class Histogram:
+    """Histogramme cumulatif à bornes fixes (buckets Prometheus le="...")"""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [compte par classe (+Inf en dernier), somme]
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in series.items():
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                le = bound if bound == "+Inf" else repr(float(bound))
+                yield f"{self.name}_bucket", _labels(self.labelnames, labels, [("le", le)]), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _labels(self.labelnames, labels), cumulative
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+        # Collecteurs appelés au scrape : fonction -> [(nom, type, aide, [({label: valeur}, valeur)])] ;
+        # un échantillon (suffixe, labels, valeur) donne les séries _sum / _count d'un résumé
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        """Exposition au format texte Prometheus 0.0.4"""
+        # pid lu au rendu : les workers sont forkés après l'import du module
+        pid = f'pid="{os.getpid()}"'
+        lines = []
+
+        def sample(name, labels, value):
+            lines.append(f"{name}{{{pid}{',' + labels[1:-1] if labels else ''}}} {_number(value)}")
+
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                sample(name, labels, value)
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.error(f"Collecteur de métriques {collect.__name__} en échec : {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for item in samples:
+                    suffix, labels, value = item if len(item) == 3 else ("", *item)
+                    sample(name + suffix, _labels(labels.keys(), labels.values()), value)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HTTP_DURATION = metrics.histogram(
+    "smartbreath_http_request_duration_seconds", "Durée des requêtes HTTP", ("method", "route", "status"))
+HTTP_REQUEST_BYTES = metrics.histogram(
+    "smartbreath_http_request_bytes", "Taille du corps des requêtes", ("method", "route"), SIZE_BUCKETS)
+HTTP_RESPONSE_BYTES = metrics.histogram(
+    "smartbreath_http_response_bytes", "Taille du corps des réponses", ("method", "route"), SIZE_BUCKETS)
+STAGE_DURATION = metrics.histogram(
+    "smartbreath_stage_duration_seconds", "Durée des étapes d'un endpoint (contexte, prédiction, écriture...)",
+    ("endpoint", "stage"))
+DB_QUERY_DURATION = metrics.histogram(
+    "smartbreath_db_query_duration_seconds", "Durée des requêtes SQL (par instruction)", ("statement",))
+DB_QUERY_ERRORS = metrics.counter(
+    "smartbreath_db_query_errors_total", "Requêtes SQL en erreur", ("statement",))
+
+
+class Stages:
+    """
+    Chronométrage des étapes successives d'un appel : mark("predict") enregistre le temps
+    écoulé depuis la marque précédente (ou la création).
+    """
+    __slots__ = ("endpoint", "_last")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        if metrics.enabled:
+            now = time.perf_counter()
+            STAGE_DURATION.observe(now - self._last, self.endpoint, stage)
+            self._last = now
+
+
+def statement_of(query):
+    """Nature d'une requête SQL (premier mot-clé) : label à faible cardinalité"""
+    if isinstance(query, bytes):
+        query = query[:32].decode("ascii", "replace")
+    if not isinstance(query, str):
+        return "composed"
+    head = query.lstrip()[:16].split(None, 1)
+    return head[0].upper() if head and head[0].isalpha() else "other"
+
+
+def observe_query(query, start, failed=False):
+    statement = statement_of(query)
+    DB_QUERY_DURATION.observe(time.perf_counter() - start, statement)
+    if failed:
+        DB_QUERY_ERRORS.inc(statement)
+
+
+class SlowRequestProfiler:
+    """
+    Profileur par échantillonnage : tant qu'au moins une requête est en cours, un thread
+    relève les piles de tous les threads (boucle asyncio et threadpool). À la fin d'une
+    requête plus lente que le seuil, les échantillons de sa fenêtre sont agrégés en piles
+    « folded » (une ligne « frame;frame;... nombre » par pile). Avec plusieurs requêtes
+    simultanées, la fenêtre contient aussi le travail des autres.
+    """
+
+    def __init__(self, slow_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, out_dir=PROFILE_DIR,
+                 keep=PROFILE_KEEP, max_samples=50000):
+        self.slow_s = slow_ms / 1000
+        self.interval_s = interval_ms / 1000
+        self.out_dir = out_dir
+        self.keep = keep
+        self._samples = collections.deque(maxlen=max_samples)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.dumps = 0
+        self.samples_taken = 0
+
+    @property
+    def enabled(self):
+        return self.slow_s > 0
+
+    def configure(self, slow_ms=None, interval_ms=None):
+        if slow_ms is not None:
+            self.slow_s = max(slow_ms, 0) / 1000
+        if interval_ms is not None:
+            self.interval_s = max(interval_ms, 0.5) / 1000
+        if self.enabled:
+            self._ensure_thread()
+        logger.info(f"Profileur des requêtes lentes : {'seuil ' + str(self.slow_s * 1000) + ' ms' if self.enabled else 'désactivé'}")
+        return self.stats()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def begin(self):
+        if not self.enabled:
+            return None
+        self._ensure_thread()
+        with self._lock:
+            self._active += 1
+            self._wake.set()
+        return time.perf_counter()
+
+    def end(self, started, label):
+        """Fin de requête ; retourne le chemin du fichier de piles si la requête était lente"""
+        if started is None:
+            return None
+        finished = time.perf_counter()
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self._wake.clear()
+        if not self.enabled or finished - started < self.slow_s:
+            return None
+        stacks = collections.Counter(stack for t, stack in list(self._samples) if started <= t <= finished)
+        if not stacks:
+            return None
+        return self._dump(stacks, label, finished - started)
+
+    def _run(self):
+        own = threading.get_ident()
+        while self.enabled:
+            if not self._wake.wait(timeout=1):
+                continue
+            now = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples.append((now, ";".join(reversed(stack))))
+            self.samples_taken += 1
+            time.sleep(self.interval_s)
+
+    def _dump(self, stacks, label, duration_s):
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe = "".join(c if c.isalnum() else "_" for c in label).strip("_")[:60]
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{duration_s * 1000:.0f}ms-{safe}.folded")
+        with open(path, "w") as f:
+            for stack, n in stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        self.dumps += 1
+        self._prune()
+        logger.info(f"Requête lente {label} ({duration_s * 1000:.0f} ms) : piles dans {path}")
+        return path
+
+    def _prune(self):
+        files = sorted(f for f in os.listdir(self.out_dir) if f.endswith(".folded"))
+        for name in files[:max(len(files) - self.keep, 0)]:
+            try:
+                os.unlink(os.path.join(self.out_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_s * 1000,
+            "interval_ms": self.interval_s * 1000,
+            "dir": self.out_dir,
+            "samples": self.samples_taken,
+            "dumps": self.dumps,
+        }
+
+
+profiler = SlowRequestProfiler()
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI : durée, statut et tailles (corps reçu / envoyé) de chaque requête HTTP,
+    par route déclarée (/status/{patient_id}, pas une série par patient). Démarre aussi le
+    profileur des requêtes lentes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (metrics.enabled or profiler.enabled):
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        token = profiler.begin()
+        sizes = {"in": 0, "out": 0, "status": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["in"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                sizes["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            if metrics.enabled:
+                HTTP_DURATION.observe(time.perf_counter() - start, method, path, str(sizes["status"]))
+                HTTP_REQUEST_BYTES.observe(sizes["in"], method, path)
+                HTTP_RESPONSE_BYTES.observe(sizes["out"], method, path)
+            if token is not None:
+                profiler.end(token, f"{method} {path}")
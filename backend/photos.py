@@ -0,0 +1,243 @@
+"""
+Photos de profil, hors de la table patients.
+
+Chaque photo est stockée une seule fois sur disque sous son empreinte SHA-256
+(PHOTO_STORE_DIR/ab/abcdef...jpg) ; la ligne patient ne garde que photo_id. Une
+miniature JPEG est produite à l'enregistrement si Pillow est installé. Le contenu d'un
+photo_id ne change jamais : GET /photos/{photo_id} est mis en cache sans limite par
+les clients.
+
+    python -m backend.photos migrate    # déplace les photo_base64 existantes dans le stockage
+    python -m backend.photos gc         # supprime les photos qui ne sont plus référencées
+"""
+import argparse
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # miniatures désactivées, la photo d'origine est servie
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PHOTO_STORE_DIR = os.getenv("PHOTO_STORE_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "photos"))
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(5 * 1024 * 1024)))
+THUMBNAIL_SIZE = int(os.getenv("PHOTO_THUMBNAIL_SIZE", "256"))
+# Une photo non référencée plus récente que ce délai peut appartenir à une mise à jour en cours
+GC_MIN_AGE_S = 24 * 3600
+
+# Signature (octets de tête) -> (extension, type MIME)
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ("jpg", "image/jpeg")),
+    (b"\x89PNG\r\n\x1a\n", ("png", "image/png")),
+    (b"GIF87a", ("gif", "image/gif")),
+    (b"GIF89a", ("gif", "image/gif")),
+]
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+_PHOTO_ID_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png|gif|webp)$")
+
+
+class PhotoError(ValueError):
+    """Contenu refusé : pas une image reconnue, ou trop volumineux."""
+
+
+def sniff(head):
+    """(extension, type MIME) d'après les premiers octets de l'image"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    raise PhotoError("Format d'image non reconnu (JPEG, PNG, GIF ou WebP attendu)")
+
+
+def decode_base64(value):
+    """Photo envoyée en base64 par l'application mobile (préfixe data:image/...;base64, accepté)"""
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
+    if len(value) * 3 // 4 > PHOTO_MAX_BYTES:
+        raise PhotoError(f"Photo trop volumineuse (max {PHOTO_MAX_BYTES} octets)")
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise PhotoError("Photo base64 invalide")
+
+
+def photo_urls(photo_id):
+    if not photo_id:
+        return {"photo_url": None, "thumbnail_url": None}
+    return {"photo_url": f"/photos/{photo_id}", "thumbnail_url": f"/photos/{photo_id}?size=thumb"}
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class PhotoStore:
+    def __init__(self, root=PHOTO_STORE_DIR, max_bytes=PHOTO_MAX_BYTES, thumbnail_size=THUMBNAIL_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+
+    def _dir(self, digest):
+        return os.path.join(self.root, digest[:2])
+
+    def path(self, photo_id, thumb=False):
+        """Fichier à servir ; la photo d'origine si la miniature n'existe pas. KeyError si inconnue."""
+        m = _PHOTO_ID_RE.match(photo_id)
+        if not m:
+            raise KeyError(photo_id)
+        original = os.path.join(self._dir(m.group(1)), photo_id)
+        if thumb:
+            thumbnail = os.path.join(self._dir(m.group(1)), f"{m.group(1)}.thumb.jpg")
+            if os.path.isfile(thumbnail):
+                return thumbnail, "image/jpeg"
+        if not os.path.isfile(original):
+            raise KeyError(photo_id)
+        return original, CONTENT_TYPES[m.group(2)]
+
+    def put(self, data):
+        """Enregistre une image (idempotent : même contenu, même photo_id). Retourne le photo_id."""
+        if len(data) > self.max_bytes:
+            raise PhotoError(f"Photo trop volumineuse (max {self.max_bytes} octets)")
+        ext, _ = sniff(data[:12])
+        digest = hashlib.sha256(data).hexdigest()
+        photo_id = f"{digest}.{ext}"
+        directory = self._dir(digest)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, photo_id)
+        try:
+            # Photo déjà présente (ré-envoi, autre patient) : rajeunie pour que le GC, qui ne supprime
+            # que les fichiers plus anciens que GC_MIN_AGE_S, ne la retire pas avant l'UPDATE qui la référence
+            os.utime(path)
+        except FileNotFoundError:
+            _write_atomic(path, data)
+            self._make_thumbnail(data, os.path.join(directory, f"{digest}.thumb.jpg"))
+        return photo_id
+
+    def _make_thumbnail(self, data, path):
+        if Image is None:
+            return
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                out = io.BytesIO()
+                img.convert("RGB").save(out, "JPEG", quality=85, optimize=True)
+            _write_atomic(path, out.getvalue())
+        except Exception as e:
+            logger.error(f"Miniature impossible pour {os.path.basename(path)} : {e}")
+
+    def photo_ids(self):
+        if not os.path.isdir(self.root):
+            return
+        for sub in os.listdir(self.root):
+            directory = os.path.join(self.root, sub)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if _PHOTO_ID_RE.match(name):
+                        yield name
+
+    def delete(self, photo_id):
+        m = _PHOTO_ID_RE.match(photo_id)
+        if not m:
+            raise KeyError(photo_id)
+        for name in (photo_id, f"{m.group(1)}.thumb.jpg"):
+            try:
+                os.unlink(os.path.join(self._dir(m.group(1)), name))
+            except FileNotFoundError:
+                pass
+
+
+photo_store = PhotoStore()
+
+MIGRATE_QUERY = """
+    SELECT patient_id, photo_base64 FROM patients
+    WHERE photo_base64 IS NOT NULL AND patient_id > %s
+    ORDER BY patient_id LIMIT %s
+"""
+SET_PHOTO_QUERY = "UPDATE patients SET photo_id = %s, photo_base64 = NULL WHERE patient_id = %s"
+
+
+def migrate_inline_photos(conn, store=photo_store, batch=100):
+    """
+    Déplace les photos base64 de la table patients dans le stockage. Les photos illisibles
+    restent en place (à corriger à la main). Retourne (migrées, illisibles).
+    """
+    migrated = invalid = last_id = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(MIGRATE_QUERY, (last_id, batch))
+            rows = cur.fetchall()
+            if not rows:
+                return migrated, invalid
+            for patient_id, value in rows:
+                last_id = patient_id
+                try:
+                    photo_id = store.put(decode_base64(value))
+                except PhotoError as e:
+                    logger.error(f"Photo du patient {patient_id} non migrée : {e}")
+                    invalid += 1
+                    continue
+                cur.execute(SET_PHOTO_QUERY, (photo_id, patient_id))
+                migrated += 1
+        conn.commit()
+
+
+def collect_garbage(conn, store=photo_store, min_age_s=GC_MIN_AGE_S):
+    """Supprime les photos qu'aucun patient ne référence (plus anciennes que min_age_s)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT photo_id FROM patients WHERE photo_id IS NOT NULL")
+        referenced = {r[0] for r in cur.fetchall()}
+    deleted = 0
+    for photo_id in list(store.photo_ids()):
+        path, _ = store.path(photo_id)
+        if photo_id not in referenced and time.time() - os.path.getmtime(path) > min_age_s:
+            store.delete(photo_id)
+            deleted += 1
+    return deleted
+
+
+def main():
+    import psycopg2
+    from backend.database import DB_CONFIG
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Stockage des photos de profil SmartBreath")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("migrate", help="Déplace les photo_base64 de la table patients dans le stockage")
+    p_gc = sub.add_parser("gc", help="Supprime les photos non référencées")
+    p_gc.add_argument("--min-age-hours", type=float, default=GC_MIN_AGE_S / 3600)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.command == "migrate":
+            migrated, invalid = migrate_inline_photos(conn)
+            print(f"{migrated} photo(s) migrée(s) vers {photo_store.root}, {invalid} illisible(s) laissée(s) en base")
+        else:
+            print(f"{collect_garbage(conn, min_age_s=args.min_age_hours * 3600)} photo(s) supprimée(s)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
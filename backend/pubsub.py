@@ -0,0 +1,277 @@
+"""
+Diffusion temps réel des résultats d'analyse (WebSocket / SSE).
+
+/analyze publie chaque mesure scorée sur le canal du patient ; les clients abonnés
+(application mobile, tableau de bord) la reçoivent sans interroger /status en boucle.
+
+Chaque abonné dispose d'une file bornée : un client lent ne ralentit ni /analyze ni
+les autres abonnés, ses messages les plus anciens sont écartés (seul le dernier état
+compte pour l'affichage) et le nombre de messages perdus lui est signalé.
+
+Avec plusieurs workers (backend.serve), un abonné est connecté à un seul processus :
+PUBSUB_BACKEND=postgres relaie les publications entre workers via LISTEN/NOTIFY.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+
+import psycopg2
+
+from backend.database import DB_CONFIG
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_BACKENDS = ("memory", "postgres")
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "32"))
+PUBSUB_MAX_SUBSCRIBERS = int(os.getenv("PUBSUB_MAX_SUBSCRIBERS", "10000"))
+NOTIFY_CHANNEL = "smartbreath_status"
+# Invalidation des caches par patient (contexte modèle) entre workers
+INVALIDATE_CHANNEL = "smartbreath_invalidate"
+# Taille maximale d'un message NOTIFY (limite PostgreSQL : 8000 octets)
+NOTIFY_MAX_BYTES = 7900
+
+
+class TooManySubscribers(Exception):
+    """Nombre maximal d'abonnés atteint pour ce worker."""
+
+
+class Subscription:
+    """File bornée d'un abonné. Les messages sont déjà encodés en JSON (partagés entre abonnés)."""
+
+    def __init__(self, topic, maxsize):
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.delivered = 0
+
+    def push(self, data):
+        if self.queue.full():
+            # Politique "drop oldest" : le plus ancien message non lu est écarté
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def get(self, timeout=None):
+        """Prochain message, ou None si rien n'arrive avant `timeout` secondes"""
+        try:
+            data = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.delivered += 1
+        return data
+
+
+class Broker:
+    """
+    Fan-out en mémoire, par patient. Toutes les méthodes sont appelées depuis la
+    boucle asyncio du worker : aucune synchronisation n'est nécessaire.
+    """
+
+    def __init__(self, queue_size=PUBSUB_QUEUE_SIZE, max_subscribers=PUBSUB_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._topics = {}
+        # Appelés pour chaque publication, même sans abonné (ex. cache du dernier état)
+        self.listeners = []
+        self._count = 0
+        self.published = 0
+        self.fanned_out = 0
+        self.dropped = 0
+
+    def subscribe(self, topic):
+        if self._count >= self.max_subscribers:
+            raise TooManySubscribers(f"{self._count} abonnés (max {self.max_subscribers})")
+        sub = Subscription(topic, self.queue_size)
+        self._topics.setdefault(topic, set()).add(sub)
+        self._count += 1
+        return sub
+
+    def unsubscribe(self, sub):
+        subs = self._topics.get(sub.topic)
+        if subs is None or sub not in subs:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._topics[sub.topic]
+        self._count -= 1
+        self.dropped += sub.dropped
+
+    def publish(self, topic, message):
+        """Diffuse un message (dict, ou JSON déjà encodé) aux abonnés du topic. Retourne le nombre d'abonnés servis."""
+        self.published += 1
+        for listener in self.listeners:
+            try:
+                listener(topic, message)
+            except Exception as e:
+                logger.error(f"Erreur d'un écouteur pub/sub (topic {topic}) : {e}")
+        subs = self._topics.get(topic)
+        if not subs:
+            return 0
+        # Encodé une seule fois, quel que soit le nombre d'abonnés
+        data = message if isinstance(message, str) else json.dumps(message)
+        for sub in subs:
+            sub.push(data)
+        self.fanned_out += len(subs)
+        return len(subs)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "subscribers": self._count,
+            "topics": len(self._topics),
+            "published": self.published,
+            "fanned_out": self.fanned_out,
+            "dropped": self.dropped + sum(s.dropped for subs in self._topics.values() for s in subs),
+        }
+
+
+class PostgresRelay:
+    """
+    Relais entre workers : les publications passent par NOTIFY, chaque worker écoute
+    le canal (LISTEN) sur une connexion dédiée et redistribue à ses propres abonnés.
+    """
+
+    def __init__(self, broker, channel=NOTIFY_CHANNEL, config=None, invalidate_channel=INVALIDATE_CHANNEL):
+        self.broker = broker
+        self.channel = channel
+        self.invalidate_channel = invalidate_channel
+        self.config = config or DB_CONFIG
+        # listener(key) pour chaque invalidation émise par un autre worker
+        self.invalidation_listeners = []
+        self.received = 0
+        self.invalidations = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+
+    def start(self, loop):
+        self._loop = loop
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="pubsub-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def notify(self, conn, messages):
+        """Publie [(topic, message)] via la connexion `conn` (transaction de l'appelant)"""
+        payloads = []
+        for topic, message in messages:
+            payload = f"{topic}\n{json.dumps(message)}"
+            if len(payload.encode()) > NOTIFY_MAX_BYTES:
+                logger.error(f"Message pub/sub trop volumineux pour NOTIFY (topic {topic}), ignoré")
+                continue
+            payloads.append(payload)
+        if payloads:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, p) FROM unnest(%s::text[]) p", (self.channel, payloads))
+
+    def notify_invalidation(self, conn, key):
+        """Demande aux autres workers d'oublier `key` ; émis au commit de la transaction de `conn`"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (self.invalidate_channel, f"{os.getpid()}\n{key}"))
+
+    def _dispatch(self, payload):
+        topic, _, data = payload.partition("\n")
+        self.broker.publish(topic, data)
+
+    def _invalidate(self, payload):
+        pid, _, key = payload.partition("\n")
+        if pid == str(os.getpid()):
+            # Le worker émetteur a déjà mis son cache à jour
+            return
+        self.invalidations += 1
+        for listener in self.invalidation_listeners:
+            try:
+                listener(key)
+            except Exception as e:
+                logger.error(f"Invalidation pub/sub en échec ({key}) : {e}")
+
+    def _listen(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.config)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                    cur.execute(f"LISTEN {self.invalidate_channel}")
+                logger.info(f"Relais pub/sub à l'écoute du canal {self.channel}")
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        if notify.channel == self.invalidate_channel:
+                            self._loop.call_soon_threadsafe(self._invalidate, notify.payload)
+                            continue
+                        self.received += 1
+                        self._loop.call_soon_threadsafe(self._dispatch, notify.payload)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Relais pub/sub interrompu : {e}")
+                self._stop.wait(2)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self):
+        return {**self.broker.stats(), "backend": "postgres", "relayed": self.received,
+                "invalidations": self.invalidations, "relay_errors": self.errors}
+
+
+class PubSub:
+    """Point d'entrée du backend : broker local, éventuellement relayé entre workers"""
+
+    def __init__(self, backend="memory", queue_size=PUBSUB_QUEUE_SIZE, max_subscribers=PUBSUB_MAX_SUBSCRIBERS):
+        if backend not in PUBSUB_BACKENDS:
+            raise ValueError(f"Backend pub/sub inconnu : {backend} (attendu : {', '.join(PUBSUB_BACKENDS)})")
+        self.broker = Broker(queue_size, max_subscribers)
+        self.relay = PostgresRelay(self.broker) if backend == "postgres" else None
+
+    def start(self):
+        if self.relay:
+            self.relay.start(asyncio.get_running_loop())
+
+    def stop(self):
+        if self.relay:
+            self.relay.stop()
+
+    def subscribe(self, topic):
+        return self.broker.subscribe(topic)
+
+    def unsubscribe(self, sub):
+        self.broker.unsubscribe(sub)
+
+    def add_listener(self, listener):
+        """listener(topic, message) pour chaque publication reçue par ce worker (message : dict ou JSON)"""
+        self.broker.listeners.append(listener)
+
+    def add_invalidation_listener(self, listener):
+        """listener(key) quand un autre worker invalide `key` (sans relais : un seul worker, rien à faire)"""
+        if self.relay:
+            self.relay.invalidation_listeners.append(listener)
+
+    def publish_local(self, messages):
+        for topic, message in messages:
+            self.broker.publish(topic, message)
+
+    def stats(self):
+        return self.relay.stats() if self.relay else self.broker.stats()
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def ws_event(event, data):
+    # data est déjà du JSON : pas de ré-encodage par abonné
+    return f'{{"event": "{event}", "data": {data}}}'
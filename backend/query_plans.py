@@ -0,0 +1,135 @@
+"""
+Vérification des plans d'exécution des requêtes du backend.
+
+    python -m backend.query_plans
+
+Chaque requête est passée à EXPLAIN (sans l'exécuter) avec enable_seqscan désactivé :
+si le planificateur choisit malgré tout un Seq Scan sur une table volumineuse, aucun
+index ne peut servir la requête. Pour les requêtes bornées dans le temps, le nombre de
+partitions de sensor_data parcourues est aussi contrôlé (élagage des partitions).
+"""
+import json
+import re
+import sys
+from datetime import datetime, timedelta
+
+import backend.main as api
+import maintenance_metrics
+from backend import dashboard_queries as dash
+from backend.database import db
+from backend.export import EXPORT_COLUMNS, build_query
+from backend.maintenance import PARTITION_MONTHS_AHEAD
+from ml_engine import refresh
+
+# Tables pour lesquelles un Seq Scan signale un index manquant
+INDEXED_TABLES = ("patients", "sensor_data", "sensor_rollup_hourly", "sensor_rollup_daily")
+
+# Balayages voulus : la vue service parcourt tous les patients (une ligne chacun)
+FULL_SCANS_ALLOWED = {"dashboard : vue service": ("patients",)}
+# Borne basse seule (delta du dashboard) : mois courant, mois créés à l'avance et partition par défaut
+OPEN_ENDED_PARTITIONS = PARTITION_MONTHS_AHEAD + 2
+
+SAMPLE_PATIENT = "1"
+SAMPLE_ROW = (SAMPLE_PATIENT, datetime.now(), 95.0, 72, 4.0, 70.0, 0.1, "STABLE", "ok", 36.6, "legacy")
+SAMPLE_SINCE = datetime.now() - timedelta(minutes=5)
+SAMPLE_WATERMARK = {"at": datetime.now() - timedelta(days=1), "id": 0}
+EXPORT_QUERY, EXPORT_PARAMS = build_query(
+    tuple(EXPORT_COLUMNS), patient_ids=[int(SAMPLE_PATIENT)], start=datetime.now() - timedelta(days=30), end=datetime.now()
+)
+
+
+def _psycopg_params(query):
+    """Paramètres SQLAlchemy text() (:p_id) -> psycopg2 (%(p_id)s) ; les casts :: sont conservés"""
+    return re.sub(r"(?<!:):(\w+)", r"%(\1)s", query)
+
+
+# (nom, requête, paramètres, partitions de sensor_data max. — None : pas de borne temporelle)
+CHECKS = [
+    ("insert mesure (/analyze)", api.INSERT_MEASURE_QUERY, SAMPLE_ROW, None),
+    ("contexte patient (/profile)", api.PATIENT_CONTEXT_QUERY, (SAMPLE_PATIENT,), None),
+    ("contexte modèle (/analyze)", api.MODEL_CONTEXT_QUERY, ([int(SAMPLE_PATIENT)],), None),
+    ("login", api.LOGIN_QUERY, ("patient@example.com",), None),
+    ("feedback", api.FEEDBACK_QUERY, (1, "note", 1), None),
+    ("statut (/status)", api.STATUS_QUERY, (SAMPLE_PATIENT,), None),
+    ("résumé 24h (/dashboard-summary)", api.ROLLING_ROLLUP_QUERY,
+     {"patient_id": SAMPLE_PATIENT, "secs": 24 * 3600}, 3),
+    ("risque moyen (/stats semaine)", api.ROLLING_ROLLUP_QUERY,
+     {"patient_id": SAMPLE_PATIENT, "secs": 7 * 86400}, 3),
+    ("graphique (/stats)", api.STATS_GRAPH_QUERY, (SAMPLE_PATIENT, 30), None),
+    ("totaux (/stats)", api.STATS_TOTALS_QUERY, (SAMPLE_PATIENT,), None),
+    ("warm start des tendances", api.WARM_START_QUERY, (6 * 3600, 5), 3),
+    ("dashboard : tampon initial", _psycopg_params(dash.LIVE_INITIAL_QUERY),
+     {"p_id": SAMPLE_PATIENT, "n": 60}, None),
+    ("dashboard : delta", _psycopg_params(dash.LIVE_DELTA_QUERY),
+     {"p_id": SAMPLE_PATIENT, "since": SAMPLE_SINCE, "seen": [1, 2], "n": 60}, OPEN_ENDED_PARTITIONS),
+    ("dashboard : feedback affiché", _psycopg_params(dash.LIVE_FEEDBACK_QUERY),
+     {"p_id": SAMPLE_PATIENT, "oldest": SAMPLE_SINCE, "ids": [1, 2]}, OPEN_ENDED_PARTITIONS),
+    ("dashboard : historique 24h", _psycopg_params(dash.HISTORY_RAW_QUERY),
+     {"p_id": SAMPLE_PATIENT, "step": "54 seconds", "span": "86400 seconds"}, 3),
+    ("dashboard : historique 30j", _psycopg_params(dash.HISTORY_ROLLUP_QUERY),
+     {"p_id": SAMPLE_PATIENT, "span": "2592000 seconds"}, None),
+    ("dashboard : vue service", _psycopg_params(dash.WARD_QUERY), {"window": "86400 seconds"}, 3),
+    ("export patient 30j (/export)", EXPORT_QUERY, EXPORT_PARAMS, 3),
+    ("feedbacks à apprendre (refresh)", refresh.NEW_FEEDBACK_QUERY,
+     {"window": 5, "settle": refresh.FEEDBACK_SETTLE_S, "limit": 1000, **SAMPLE_WATERMARK}, None),
+    ("feedbacks à évaluer (performance)", maintenance_metrics.NEW_FEEDBACK_QUERY,
+     {"legacy": "legacy", "positive": maintenance_metrics.POSITIVE_STATUSES,
+      "settle": maintenance_metrics.FEEDBACK_SETTLE_S, "limit": 1000, **SAMPLE_WATERMARK}, None),
+]
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def _base_table(relation):
+    if relation.startswith("sensor_data_"):
+        return "sensor_data"
+    return relation
+
+
+def check_plan(cur, name, query, params, max_partitions):
+    if not isinstance(query, str):
+        # Requête composée (psycopg2.sql), ex. export
+        query = query.as_string(cur)
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = list(_walk(plan[0]["Plan"]))
+
+    problems = []
+    allowed = FULL_SCANS_ALLOWED.get(name, ())
+    for node in nodes:
+        relation = node.get("Relation Name")
+        if (node["Node Type"] == "Seq Scan" and relation and _base_table(relation) in INDEXED_TABLES
+                and _base_table(relation) not in allowed):
+            problems.append(f"Seq Scan sur {relation}")
+
+    partitions = {n["Relation Name"] for n in nodes
+                  if n.get("Relation Name", "").startswith("sensor_data_")}
+    if max_partitions is not None and len(partitions) > max_partitions:
+        problems.append(f"{len(partitions)} partitions parcourues (max {max_partitions})")
+
+    status = "OK " if not problems else "KO "
+    print(f"{status} {name:<36} partitions={len(partitions):<3} {'; '.join(problems)}")
+    return not problems
+
+
+def main():
+    ok = True
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for name, query, params, max_partitions in CHECKS:
+            ok &= check_plan(cur, name, query, params, max_partitions)
+        # EXPLAIN n'exécute rien, mais on ne garde aucune trace de la session
+        conn.rollback()
+    db.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
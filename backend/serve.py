@@ -0,0 +1,139 @@
+"""
+Démarrage multi-processus du backend SmartBreath (pré-fork).
+
+    python -m backend.serve --workers 4 --port 8000
+
+Le modèle est chargé une seule fois dans le processus maître (import de backend.main)
+puis partagé en copy-on-write par les workers forkés. Chaque worker ouvre son propre
+pool PostgreSQL (lifespan). Avec plusieurs workers, les tendances patients sont
+stockées dans un fichier SQLite commun (HISTORY_BACKEND=sqlite) rechargé une seule
+fois par le maître avant le fork, et les flux temps réel sont relayés entre workers
+par PostgreSQL (PUBSUB_BACKEND=postgres).
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import tempfile
+
+logger = logging.getLogger("smartbreath.serve")
+
+
+def _bind(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _configure_shared_state(workers):
+    if workers > 1:
+        os.environ.setdefault("HISTORY_BACKEND", "sqlite")
+        os.environ.setdefault(
+            "HISTORY_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "smartbreath_trends.sqlite3")
+        )
+        # Un abonné temps réel n'est connecté qu'à un worker : relais via LISTEN/NOTIFY
+        os.environ.setdefault("PUBSUB_BACKEND", "postgres")
+        if os.environ["PUBSUB_BACKEND"] != "postgres":
+            # Sans relais, PUT /profile n'invalide que le worker qui l'a reçu : TTL court
+            os.environ.setdefault("PATIENT_CACHE_TTL", "30")
+        # Un seul thread OpenMP par worker : évite la sur-souscription CPU et les
+        # blocages d'OpenMP après fork
+        os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+
+def _warm_start_once(main_module):
+    """Rechargement des tendances par le maître, puis désactivation dans les workers"""
+    if not main_module.HISTORY_WARM_START:
+        return
+    try:
+        main_module.db.open()
+        main_module.load_trend_history()
+    except Exception as e:
+        logger.error(f"Rechargement de l'historique impossible : {e}")
+    finally:
+        # Aucune connexion ne doit être héritée par les workers
+        main_module.db.close()
+    main_module.HISTORY_WARM_START = False
+
+
+def _run_worker(app, sock, args):
+    import uvicorn
+    config = uvicorn.Config(app, log_level=args.log_level, access_log=args.access_log)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend SmartBreath multi-processus")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    _configure_shared_state(args.workers)
+
+    # Import après configuration de l'environnement : charge le modèle une seule fois
+    import backend.main as main_module
+    app = main_module.app
+
+    sock = _bind(args.host, args.port)
+    if args.workers <= 1:
+        _run_worker(app, sock, args)
+        return
+
+    if main_module.ai_engine is not None and main_module.ai_engine.history.stats().get("backend") == "sqlite":
+        _warm_start_once(main_module)
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                _run_worker(app, sock, args)
+            finally:
+                os._exit(0)
+        children[pid] = True
+        return pid
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(args.workers):
+        spawn()
+    logger.info(f"{args.workers} workers démarrés sur {args.host}:{args.port} (pid maître {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.pop(pid, None)
+        if not stopping:
+            logger.error(f"Worker {pid} arrêté (statut {status}), redémarrage")
+            spawn()
+    sock.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
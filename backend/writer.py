@@ -0,0 +1,332 @@
+"""
+Écriture différée des mesures scorées (WRITE_BEHIND=1).
+
+/analyze répond dès que le risque est calculé : la ligne est placée dans une file
+bornée en mémoire, vidée par un thread d'écriture en COPY groupés (toutes les
+WRITE_BEHIND_BATCH lignes ou WRITE_BEHIND_INTERVAL_MS millisecondes). Les data_id
+sont réservés par blocs dans la séquence de sensor_data : l'identifiant renvoyé au
+client est définitif et /feedback fonctionne dès que la ligne est écrite.
+
+Durabilité : quand la file déborde, quand la base est indisponible et à l'arrêt, les
+lignes sont écrites dans un fichier de débordement (WRITE_BEHIND_SPILL_DIR, fsync)
+rejoué ensuite sans doublon. Un arrêt brutal du processus perd au plus le contenu de
+la file (WRITE_BEHIND_QUEUE lignes).
+"""
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import psycopg2
+
+from backend.database import db
+from backend.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_DURATION = metrics.histogram(
+    "smartbreath_write_behind_flush_seconds", "Durée d'écriture d'un lot par l'écriture différée (COPY)")
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_QUEUE = int(os.getenv("WRITE_BEHIND_QUEUE", "50000"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "1000"))
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "200"))
+# data_id réservés par aller-retour à la séquence (réserve rechargée à mi-hauteur)
+WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000"))
+WRITE_BEHIND_SPILL_DIR = os.getenv("WRITE_BEHIND_SPILL_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "spill"))
+# File pleine : "spill" (fichier de débordement) ou "drop" (mesure perdue, comptée)
+WRITE_BEHIND_OVERFLOW = os.getenv("WRITE_BEHIND_OVERFLOW", "spill")
+# Délai accordé à la vidange de la file à l'arrêt, le reste part en débordement
+WRITE_BEHIND_SHUTDOWN_S = float(os.getenv("WRITE_BEHIND_SHUTDOWN_S", "10"))
+SPILL_REPLAY_INTERVAL_S = 30
+LATENCY_WINDOW = 1000
+
+COLUMNS = ("data_id", "patient_id", "timestamp", "spo2", "bpm", "flow_rate", "muscle_strength",
+           "risk_score", "status", "recommendation", "temperature", "model_version")
+ID_BLOCK_QUERY = "SELECT nextval(pg_get_serial_sequence('sensor_data', 'data_id')) FROM generate_series(1, %s)"
+COPY_QUERY = f"COPY sensor_data ({', '.join(COLUMNS)}) FROM STDIN"
+# Rejeu (fichier de débordement, lot en échec) : une ligne déjà écrite est ignorée
+STAGE_QUERY = "CREATE TEMP TABLE sensor_data_stage (LIKE sensor_data INCLUDING DEFAULTS) ON COMMIT DROP"
+COPY_STAGE_QUERY = f"COPY sensor_data_stage ({', '.join(COLUMNS)}) FROM STDIN"
+MERGE_STAGE_QUERY = f"""
+    INSERT INTO sensor_data ({', '.join(COLUMNS)})
+    SELECT {', '.join(COLUMNS)} FROM sensor_data_stage
+    ON CONFLICT DO NOTHING
+"""
+INSERT_ROW_QUERY = f"""
+    INSERT INTO sensor_data ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))})
+    ON CONFLICT DO NOTHING
+"""
+
+
+def _copy_value(v):
+    """Valeur au format texte de COPY (NULL = \\N, séparateurs échappés)"""
+    if v is None:
+        return "\\N"
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_buffer(rows):
+    return io.StringIO("".join("\t".join(map(_copy_value, row)) + "\n" for row in rows))
+
+
+class WriteBehindWriter:
+    """File d'écriture bornée et thread de vidange. submit() est non bloquant (hors débordement)."""
+
+    def __init__(self, queue_rows=WRITE_BEHIND_QUEUE, batch_rows=WRITE_BEHIND_BATCH,
+                 interval_ms=WRITE_BEHIND_INTERVAL_MS, id_block=WRITE_BEHIND_ID_BLOCK,
+                 spill_dir=WRITE_BEHIND_SPILL_DIR, overflow=WRITE_BEHIND_OVERFLOW):
+        if overflow not in ("spill", "drop"):
+            raise ValueError(f"WRITE_BEHIND_OVERFLOW inconnu : {overflow} (attendu : spill, drop)")
+        self.queue_rows = queue_rows
+        self.batch_rows = batch_rows
+        self.interval = interval_ms / 1000
+        self.id_block = id_block
+        self.spill_dir = spill_dir
+        self.overflow = overflow
+
+        self._queue = deque()
+        self._pending = set()
+        self._ids = deque()
+        self._cond = threading.Condition()
+        self._ids_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+        self._last_replay = 0.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {
+            "submitted": 0, "written": 0, "flushes": 0, "flush_errors": 0, "rejected": 0,
+            "overflows": 0, "dropped": 0, "spilled": 0, "replayed": 0, "max_depth": 0,
+        }
+
+    # --- Réservation des data_id ---
+
+    def _refill_ids(self, n=None):
+        ids = [r[0] for r in db.fetchall(ID_BLOCK_QUERY, (max(n or 0, self.id_block),))]
+        with self._ids_lock:
+            self._ids.extend(ids)
+
+    async def allocate_ids(self, n):
+        """n data_id définitifs ; un aller-retour à la base seulement si la réserve est épuisée"""
+        while True:
+            with self._ids_lock:
+                if len(self._ids) >= n:
+                    return [self._ids.popleft() for _ in range(n)]
+            await db.run(self._refill_ids, n)
+
+    # --- File ---
+
+    def submit(self, rows):
+        """rows : tuples dans l'ordre de COLUMNS. Retourne False si la file a débordé."""
+        with self._cond:
+            if len(self._queue) + len(rows) <= self.queue_rows:
+                self._queue.extend(rows)
+                self._pending.update(r[0] for r in rows)
+                self._stats["submitted"] += len(rows)
+                self._stats["max_depth"] = max(self._stats["max_depth"], len(self._queue))
+                if len(self._queue) >= self.batch_rows:
+                    self._cond.notify()
+                return True
+            self._stats["overflows"] += 1
+        if self.overflow == "spill":
+            self.spill(rows)
+        else:
+            self._stats["dropped"] += len(rows)
+            logger.error(f"File d'écriture pleine : {len(rows)} mesure(s) perdue(s)")
+        return False
+
+    def is_pending(self, data_id):
+        return data_id in self._pending
+
+    def wait_written(self, data_id, timeout=None):
+        """Attend que la ligne ait quitté la file (écrite, rejetée ou en débordement). Appel bloquant."""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.interval * 5 + 1)
+        with self._cond:
+            while data_id in self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # --- Écriture ---
+
+    def _copy(self, rows, replay=False):
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                if replay:
+                    cur.execute(STAGE_QUERY)
+                    cur.copy_expert(COPY_STAGE_QUERY, _copy_buffer(rows))
+                    cur.execute(MERGE_STAGE_QUERY)
+                else:
+                    cur.copy_expert(COPY_QUERY, _copy_buffer(rows))
+
+    def _insert_rows(self, rows):
+        """Ligne à ligne : une mesure invalide (patient inconnu...) est rejetée sans bloquer les autres"""
+        rejected = 0
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                for row in rows:
+                    cur.execute("SAVEPOINT row")
+                    try:
+                        cur.execute(INSERT_ROW_QUERY, row)
+                        cur.execute("RELEASE SAVEPOINT row")
+                    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT row")
+                        rejected += 1
+                        logger.error(f"Mesure {row[0]} (patient {row[1]}) rejetée : {e}")
+        self._stats["rejected"] += rejected
+        return len(rows) - rejected
+
+    def write(self, rows, replay=False):
+        """Écrit un lot ; lève l'exception si la base est indisponible"""
+        try:
+            self._copy(rows, replay)
+            return len(rows)
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            return self._insert_rows(rows)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self._stats["written"] += self.write(batch)
+        except Exception as e:
+            self._stats["flush_errors"] += 1
+            logger.error(f"Écriture différée en échec ({len(batch)} mesures), débordement sur disque : {e}")
+            self.spill(batch)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._latencies.append(elapsed)
+            if metrics.enabled:
+                FLUSH_DURATION.observe(elapsed)
+            self._stats["flushes"] += 1
+            with self._cond:
+                self._pending.difference_update(r[0] for r in batch)
+                self._cond.notify_all()
+
+    # --- Débordement sur disque ---
+
+    def spill(self, rows):
+        """Écrit les lignes dans un nouveau fichier de débordement (fsync du fichier et du répertoire)"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        name = f"spill-{os.getpid()}-{time.time_ns()}.jsonl"
+        tmp = os.path.join(self.spill_dir, f".{name}")
+        with open(tmp, "w") as f:
+            for row in rows:
+                f.write(json.dumps([v.isoformat() if hasattr(v, "isoformat") else v for v in row],
+                                   default=lambda v: v.item() if isinstance(v, np.generic) else str(v)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.spill_dir, name))
+        fd = os.open(self.spill_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._stats["spilled"] += len(rows)
+        logger.warning(f"{len(rows)} mesure(s) écrite(s) dans {name}")
+
+    def spill_files(self):
+        if not os.path.isdir(self.spill_dir):
+            return []
+        return sorted(f for f in os.listdir(self.spill_dir) if f.startswith("spill-") and f.endswith(".jsonl"))
+
+    def replay_spill(self):
+        """Rejoue les fichiers de débordement (plusieurs workers peuvent rejouer le même : aucun doublon)"""
+        replayed = 0
+        for name in self.spill_files():
+            path = os.path.join(self.spill_dir, name)
+            try:
+                with open(path) as f:
+                    rows = [tuple(json.loads(line)) for line in f if line.strip()]
+            except FileNotFoundError:
+                continue
+            self.write(rows, replay=True)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            replayed += len(rows)
+            logger.info(f"{len(rows)} mesure(s) rejouée(s) depuis {name}")
+        self._stats["replayed"] += replayed
+        return replayed
+
+    # --- Thread d'écriture ---
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info(f"Écriture différée active : lots de {self.batch_rows} lignes ou {self.interval * 1000:.0f} ms, "
+                    f"file de {self.queue_rows} lignes")
+
+    def stop(self, timeout=WRITE_BEHIND_SHUTDOWN_S):
+        """Vide la file (dans la limite de `timeout`), le reste part en débordement"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            remaining = list(self._queue)
+            self._queue.clear()
+        if remaining:
+            self.spill(remaining)
+        self._thread = None
+
+    def _maintain(self):
+        with self._ids_lock:
+            low = len(self._ids) < self.id_block // 2
+        if low:
+            self._refill_ids()
+        if time.monotonic() - self._last_replay >= SPILL_REPLAY_INTERVAL_S:
+            self._last_replay = time.monotonic()
+            self.replay_spill()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while len(self._queue) < self.batch_rows and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_rows))]
+                done = self._stopping and not self._queue
+            if batch:
+                self._flush(batch)
+            if done:
+                return
+            if not self._stopping:
+                try:
+                    self._maintain()
+                except Exception as e:
+                    logger.error(f"Maintenance de l'écriture différée en échec : {e}")
+
+    def stats(self):
+        lat = np.array(self._latencies) * 1000 if self._latencies else None
+        with self._ids_lock:
+            reserved = len(self._ids)
+        return {
+            **self._stats,
+            "queue_depth": len(self._queue),
+            "queue_max": self.queue_rows,
+            "pending": len(self._pending),
+            "reserved_ids": reserved,
+            "spill_files": len(self.spill_files()),
+            "flush_ms": None if lat is None else {
+                "p50": round(float(np.percentile(lat, 50)), 2),
+                "p95": round(float(np.percentile(lat, 95)), 2),
+                "max": round(float(lat.max()), 2),
+            },
+            "rows_per_flush": round(self._stats["written"] / self._stats["flushes"], 1) if self._stats["flushes"] else 0,
+        }
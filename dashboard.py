@@ -8,6 +8,10 @@ from streamlit_autorefresh import st_autorefresh
 from sqlalchemy import create_engine, text
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from backend.dashboard_queries import (
+    HISTORY_RAW_QUERY, HISTORY_ROLLUP_QUERY, LIVE_DELTA_QUERY, LIVE_FEEDBACK_QUERY, LIVE_INITIAL_QUERY, WARD_QUERY,
+)
+from backend.downsample import downsample_series
 
 # Configuration et Chargement
 load_dotenv()
@@ -30,50 +34,237 @@ def get_engine():
         st.error(f"Erreur de configuration DB : {e}")
         return None
 
+# Fenêtre affichée par patient (graphique + historique)
+BUFFER_SIZE = 60
+# Tolérance sur l'horodatage pour le fetch incrémental (mesures insérées légèrement en retard).
+# Le delta est indexé sur l'horodatage, pas sur data_id : avec l'écriture différée, chaque
+# worker réserve ses propres blocs de data_id, qui ne suivent donc pas l'ordre d'insertion
+DELTA_MARGIN_S = 60
+# Fréquence maximale de vérification des changements de la table patients
+PATIENTS_VERSION_TTL_S = 10
+
+# Vue historique : budget de points par courbe, quelle que soit la période affichée
+HISTORY_POINTS = 400
+# Jusqu'à 24 h, agrégation des mesures brutes (date_bin) ; au-delà, agrégats horaires
+HISTORY_RANGES = {
+    "6 heures": pd.Timedelta(hours=6),
+    "24 heures": pd.Timedelta(hours=24),
+    "7 jours": pd.Timedelta(days=7),
+    "30 jours": pd.Timedelta(days=30),
+}
+RAW_HISTORY_MAX = pd.Timedelta(hours=24)
+HISTORY_CACHE_TTL_S = 30
+
+# Vue service : patients ayant au moins une mesure sur cette fenêtre, une requête partagée par toutes les sessions
+WARD_WINDOW = pd.Timedelta(hours=24)
+WARD_CACHE_TTL_S = 2
+STATUS_COLORS = {"CRITIQUE": "#ff4b4b", "PRÉVENTION": "#ffa500", "SURVEILLANCE": "#f5d000", "STABLE": "#21c354"}
+
+LIVE_COLUMNS = [
+    'data_id', 'patient_id', 'spo2', 'bpm', 'temperature', 'flow_rate', 'muscle_strength',
+    'risk_score', 'status', 'recommendation', 'actual_outcome', 'feedback_notes', 'timestamp'
+]
+
+def _meter():
+    """Compteurs de la base pour le rafraîchissement en cours (remis à zéro à chaque exécution du script)"""
+    return st.session_state.setdefault("db_meter", {"queries": 0, "rows": 0, "bytes": 0, "total_rows": 0, "total_bytes": 0, "runs": 0})
+
+def _record(rows):
+    """Comptabilise une requête : lignes et octets reçus (taille texte des valeurs)"""
+    size = sum(len(str(v)) for row in rows for v in row if v is not None)
+    meter = _meter()
+    meter["queries"] += 1
+    meter["rows"] += len(rows)
+    meter["bytes"] += size
+    meter["total_rows"] += len(rows)
+    meter["total_bytes"] += size
+    return rows
+
+def _run_query(conn, query, params=None):
+    return _record(conn.execute(query, params or {}).fetchall())
+
+@st.cache_data(ttl=PATIENTS_VERSION_TTL_S, show_spinner=False)
+def get_patients_version():
+    """Compteur de modifications de la table patients : invalide les caches ci-dessous"""
+    engine = get_engine()
+    with engine.connect() as conn:
+        row = _run_query(conn, text("""
+            SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables WHERE relname = 'patients'
+        """))
+    return row[0][0] if row else 0
+
+@st.cache_data(show_spinner=False)
+def get_patient_list(version):
+    engine = get_engine()
+    with engine.connect() as conn:
+        rows = _run_query(conn, text("SELECT patient_id::text as patient_id, nom, prenom, email FROM patients ORDER BY nom ASC"))
+    return pd.DataFrame(rows, columns=['patient_id', 'nom', 'prenom', 'email'])
+
+@st.cache_data(show_spinner=False)
+def _load_patient_details(p_id, version):
+    engine = get_engine()
+    # Colonnes explicites : pas de photo ni de mot de passe rapatriés à chaque rafraîchissement
+    query = text("""
+        SELECT patient_id, nom, prenom, email, age, sexe, taille_cm, poids_kg, pathologie, est_fumeur, photo_id
+        FROM patients WHERE patient_id = CAST(:p_id AS INTEGER)
+    """)
+    with engine.connect() as conn:
+        result = conn.execute(query, {"p_id": str(p_id)})
+        columns = list(result.keys())
+        rows = _record(result.fetchall())
+    return pd.Series(rows[0], index=columns) if rows else None
+
 def get_patient_details(p_id):
     engine = get_engine()
     if engine:
         try:
-            query = text("SELECT * FROM patients WHERE patient_id::text = :p_id")
-            with engine.connect() as conn:
-                df = pd.read_sql(query, conn, params={"p_id": str(p_id)})
-                if not df.empty:
-                    return df.iloc[0]
+            return _load_patient_details(str(p_id), get_patients_version())
         except Exception as e:
             st.error(f"Erreur détails patient : {e}")
     return None
 
+def _empty_buffer():
+    return {"df": pd.DataFrame(columns=LIVE_COLUMNS), "last_ts": None}
+
+def _delta_params(p_id, buf):
+    """Fenêtre du fetch incrémental : depuis la dernière mesure vue moins la marge, sans les data_id déjà affichés"""
+    since = buf["last_ts"] - pd.Timedelta(seconds=DELTA_MARGIN_S)
+    df = buf["df"]
+    seen = df.loc[df['timestamp'] >= since, 'data_id']
+    return {"p_id": str(p_id), "since": since, "seen": [int(i) for i in seen], "n": BUFFER_SIZE}
+
 def get_live_data(p_id):
+    """
+    Tampon circulaire par session et par patient : seules les mesures plus récentes que la
+    dernière vue sont lues, plus le feedback arrivé entre-temps sur les mesures affichées.
+    """
     engine = get_engine()
     if not engine: return pd.DataFrame()
-    
+
+    buffers = st.session_state.setdefault("live_buffers", {})
+    buf = buffers.setdefault(p_id, _empty_buffer())
+
     try:
-        # MISE À JOUR : On récupère actual_outcome (feedback) et feedback_notes
-        query = text("""
-            SELECT 
-                patient_id::text as patient_id,
-                spo2, bpm, temperature, flow_rate, muscle_strength, 
-                risk_score, status, recommendation,
-                actual_outcome, feedback_notes,
-                timestamp AT TIME ZONE 'UTC' as timestamp
-            FROM sensor_data 
-            WHERE patient_id::text = :p_id 
-            ORDER BY timestamp DESC 
-            LIMIT 60
-        """)
-        
         with engine.connect() as conn:
-            df = pd.read_sql(query, conn, params={"p_id": str(p_id)})
-        
-        if df.empty: return pd.DataFrame()
-        
-        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True).dt.tz_localize(None)
-        df = df.sort_values('timestamp').reset_index(drop=True)
+            if buf["last_ts"] is None:
+                rows = _run_query(conn, text(LIVE_INITIAL_QUERY), {"p_id": str(p_id), "n": BUFFER_SIZE})
+            else:
+                rows = _run_query(conn, text(LIVE_DELTA_QUERY), _delta_params(p_id, buf))
+
+            df = buf["df"]
+            # Feedback reçu depuis le dernier rafraîchissement sur les mesures déjà affichées
+            pending = df.loc[df['actual_outcome'].isna(), 'data_id']
+            if not pending.empty:
+                updates = _run_query(conn, text(LIVE_FEEDBACK_QUERY), {
+                    "p_id": str(p_id), "oldest": df['timestamp'].iloc[0], "ids": [int(i) for i in pending]
+                })
+                if updates:
+                    fb = pd.DataFrame(updates, columns=['data_id', 'actual_outcome', 'feedback_notes']).set_index('data_id')
+                    idx = df['data_id'].isin(fb.index)
+                    df.loc[idx, 'actual_outcome'] = df.loc[idx, 'data_id'].map(fb['actual_outcome'])
+                    df.loc[idx, 'feedback_notes'] = df.loc[idx, 'data_id'].map(fb['feedback_notes'])
+
+        if rows:
+            new = pd.DataFrame(rows[::-1], columns=LIVE_COLUMNS)
+            new['timestamp'] = pd.to_datetime(new['timestamp'], utc=True).dt.tz_localize(None)
+            df = new if df.empty else pd.concat([df, new], ignore_index=True)
+            # Une mesure en retard peut arriver avant d'autres déjà affichées
+            df = df.sort_values(['timestamp', 'data_id'], kind='stable').tail(BUFFER_SIZE).reset_index(drop=True)
+            buf["last_ts"] = df['timestamp'].iloc[-1]
+        buf["df"] = df
         return df
     except Exception as e:
         st.error(f"Erreur SQL : {e}")
+        buffers[p_id] = _empty_buffer()
         return pd.DataFrame()
 
+@st.cache_data(ttl=HISTORY_CACHE_TTL_S, show_spinner=False)
+def get_history(p_id, range_label):
+    """
+    Série agrégée (moyenne, min, max de SpO2 et BPM par intervalle) sur la période demandée.
+    Le nombre de lignes lues est borné : ~4 x HISTORY_POINTS intervalles en brut, 1 par heure au-delà.
+    """
+    span = HISTORY_RANGES[range_label]
+    engine = get_engine()
+    with engine.connect() as conn:
+        if span <= RAW_HISTORY_MAX:
+            step = max(int(span.total_seconds() // (4 * HISTORY_POINTS)), 1)
+            rows = _run_query(conn, text(HISTORY_RAW_QUERY), {
+                "p_id": str(p_id), "step": f"{step} seconds", "span": f"{int(span.total_seconds())} seconds"
+            })
+        else:
+            rows = _run_query(conn, text(HISTORY_ROLLUP_QUERY), {"p_id": str(p_id), "span": f"{int(span.total_seconds())} seconds"})
+    df = pd.DataFrame(rows, columns=['t', 'spo2', 'spo2_min', 'spo2_max', 'bpm', 'bpm_min', 'bpm_max'])
+    df['t'] = pd.to_datetime(df['t'])
+    return df.astype({c: float for c in df.columns if c != 't'})
+
+def plot_history(hist):
+    """Courbes moyennes réduites par LTTB + enveloppes min/max : au plus HISTORY_POINTS points par tracé"""
+    x = mdates.date2num(hist['t'])
+    fig, ax1 = plt.subplots(figsize=(12, 4))
+    fig.patch.set_facecolor('#0E1117')
+    ax1.set_facecolor('#1e2129')
+    ax2 = ax1.twinx()
+    for ax, col, color, label in ((ax1, 'spo2', '#00d4ff', 'SpO2 (%)'), (ax2, 'bpm', '#ff4b4b', 'BPM')):
+        lx, ly, ex, emin, emax = downsample_series(x, hist[col], hist[f'{col}_min'], hist[f'{col}_max'], HISTORY_POINTS)
+        ax.fill_between(ex, emin, emax, color=color, alpha=0.2, linewidth=0, step='post')
+        ax.plot(lx, ly, color=color, label=label, linewidth=1.5)
+        ax.set_ylabel(label, color=color)
+    ax1.xaxis_date()
+    ax1.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m %H:%M'))
+    fig.autofmt_xdate()
+    return fig
+
+@st.cache_data(ttl=WARD_CACHE_TTL_S, show_spinner=False)
+def get_ward_overview():
+    """Dernière mesure de chaque patient suivi, en une seule requête (un accès d'index par patient)"""
+    engine = get_engine()
+    with engine.connect() as conn:
+        rows = _run_query(conn, text(WARD_QUERY), {"window": f"{int(WARD_WINDOW.total_seconds())} seconds"})
+    return pd.DataFrame(rows, columns=['patient_id', 'nom', 'prenom', 'pathologie', 'status', 'risk_score',
+                                       'spo2', 'bpm', 'temperature', 'actual_outcome', 'timestamp'])
+
+def render_ward():
+    st.title("Vue service : tous les patients suivis")
+    try:
+        ward = get_ward_overview()
+    except Exception as e:
+        st.error(f"Erreur vue service : {e}")
+        return
+    if ward.empty:
+        st.info(f"Aucune mesure reçue depuis {WARD_WINDOW}.")
+        return
+
+    ward['timestamp'] = pd.to_datetime(ward['timestamp'])
+    age_s = (datetime.now() - ward['timestamp']).dt.total_seconds()
+    # Même seuil que l'indicateur de connexion de la vue patient
+    connected = age_s <= 30
+    critique = (ward['status'].str.upper() == "CRITIQUE") | (ward['spo2'] < 90)
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Patients suivis", len(ward))
+    c2.metric("Critiques", int(critique.sum()))
+    c3.metric("Prévention", int((ward['status'] == "PRÉVENTION").sum()))
+    c4.metric("Déconnectés", int((~connected).sum()))
+
+    grid = pd.DataFrame({
+        "Patient": ward['nom'] + " " + ward['prenom'],
+        "Statut": ward['status'],
+        "Risque (%)": (ward['risk_score'].astype(float) * 100).round(0),
+        "SpO2": ward['spo2'].astype(float).round(1),
+        "BPM": ward['bpm'],
+        "Temp.": ward['temperature'],
+        "Connexion": connected.map({True: "🟢", False: "🔴"}),
+        "Dernière mesure": ward['timestamp'].dt.strftime('%d/%m %H:%M:%S'),
+        "Pathologie": ward['pathologie'],
+        "ID": ward['patient_id'],
+    })
+    styled = grid.style.map(
+        lambda v: f"background-color: {STATUS_COLORS.get(v, 'transparent')}; color: black", subset=["Statut"]
+    )
+    # Tri par défaut : critiques d'abord (fait par la requête) ; clic sur une colonne pour trier autrement
+    st.dataframe(styled, width='stretch', hide_index=True, height=min(40 + 35 * len(grid), 900))
+
 def check_connection_status(last_timestamp):
     if pd.isna(last_timestamp):
         return "🔴 AUCUNE DONNÉE", "Pas de données reçues"
@@ -84,29 +275,43 @@ def check_connection_status(last_timestamp):
 
 # --- SIDEBAR ---
 st.sidebar.title("SmartBreath AI - Médical")
+view = st.sidebar.radio("Vue :", ["Patient", "Service (tous les patients)"], key="view")
 engine = get_engine()
 
 if not engine:
     st.error("Impossible de se connecter à la base de données")
     st.stop()
 
-try:
-    query_pats = text("SELECT patient_id::text as patient_id, nom, prenom, email FROM patients ORDER BY nom ASC")
-    with engine.connect() as conn:
-        df_pats = pd.read_sql(query_pats, conn)
-    
-    patient_dict = dict(zip(
-        df_pats['nom'] + " " + df_pats['prenom'] + " (" + df_pats['email'] + ")", 
-        df_pats['patient_id']
-    ))
-    selected_name = st.sidebar.selectbox("Choisir un patient :", list(patient_dict.keys()))
-    selected_id = patient_dict[selected_name]
-except Exception as e:
-    st.sidebar.error(f"Erreur : {e}")
-    selected_id = None
+meter = _meter()
+meter.update(queries=0, rows=0, bytes=0)
+meter["runs"] += 1
+
+selected_id = None
+if view == "Patient":
+    try:
+        df_pats = get_patient_list(get_patients_version())
+        
+        patient_dict = dict(zip(
+            df_pats['nom'] + " " + df_pats['prenom'] + " (" + df_pats['email'] + ")", 
+            df_pats['patient_id']
+        ))
+        selected_name = st.sidebar.selectbox("Choisir un patient :", list(patient_dict.keys()))
+        selected_id = patient_dict[selected_name]
+    except Exception as e:
+        st.sidebar.error(f"Erreur : {e}")
+        selected_id = None
+
+if st.sidebar.button("Recharger la liste des patients"):
+    get_patients_version.clear()
+    get_patient_list.clear()
+    _load_patient_details.clear()
+    st.rerun()
 
 # --- AFFICHAGE PRINCIPAL ---
-if selected_id:
+if view != "Patient":
+    render_ward()
+
+elif selected_id:
     patient_info = get_patient_details(selected_id)
     user_data = get_live_data(selected_id)
 
@@ -161,6 +366,24 @@ if selected_id:
             st.pyplot(fig)
             plt.close(fig)
 
+        # --- HISTORIQUE LONGUE DURÉE ---
+        if st.toggle("Historique longue durée (SpO2 / BPM)", key="history_view"):
+            range_label = st.radio("Période :", list(HISTORY_RANGES), index=2, horizontal=True, key="history_range")
+            try:
+                hist = get_history(selected_id, range_label)
+            except Exception as e:
+                st.error(f"Erreur historique : {e}")
+                hist = pd.DataFrame()
+            if len(hist) > 1:
+                plt.style.use('dark_background')
+                fig = plot_history(hist)
+                st.pyplot(fig)
+                plt.close(fig)
+                st.caption(f"{len(hist)} intervalles agrégés côté serveur, affichés sur {HISTORY_POINTS} points max. "
+                           "Zone colorée : minimum / maximum de chaque intervalle.")
+            else:
+                st.info("Pas assez de mesures sur cette période.")
+
         # --- ANALYSE IA & FEEDBACK PATIENT ---
         st.write("---")
         col_ia, col_p = st.columns(2)
@@ -202,4 +425,11 @@ if selected_id:
             st.dataframe(df_hist[cols], width='stretch')
 
 else:
-    st.info("Sélectionnez un patient pour démarrer le monitoring.")
\ No newline at end of file
+    st.info("Sélectionnez un patient pour démarrer le monitoring.")
+
+# Coût base de données du rafraîchissement (les lectures servies par les caches ne comptent pas)
+st.sidebar.caption(
+    f"Base de données : {meter['queries']} requête(s), {meter['rows']} ligne(s), ~{meter['bytes']} octets "
+    f"ce rafraîchissement — {meter['total_rows']} lignes, ~{meter['total_bytes'] // 1024} Ko "
+    f"sur {meter['runs']} rafraîchissements"
+)
\ No newline at end of file
@@ -0,0 +1,137 @@
+-- Agrégats horaires et journaliers par patient de sensor_data.
+-- Maintenus à l'ingestion par un trigger par instruction (table de transition) :
+-- un INSERT multi-lignes ou un COPY ne coûte qu'un upsert par (patient, période).
+-- /stats et /dashboard-summary lisent ces tables au lieu de parcourir tout l'historique.
+
+BEGIN;
+
+-- Pas d'écriture pendant le backfill : aucune mesure ne peut être comptée deux fois ou oubliée
+LOCK TABLE sensor_data IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS sensor_rollup_hourly (
+    patient_id      INTEGER NOT NULL,
+    bucket          TIMESTAMP NOT NULL,
+    n               BIGINT NOT NULL DEFAULT 0,
+    n_temp          BIGINT NOT NULL DEFAULT 0,
+    sum_spo2        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_risk        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_temp        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    min_spo2        DOUBLE PRECISION,
+    max_spo2        DOUBLE PRECISION,
+    min_risk        DOUBLE PRECISION,
+    max_risk        DOUBLE PRECISION,
+    n_critique      BIGINT NOT NULL DEFAULT 0,
+    n_prevention    BIGINT NOT NULL DEFAULT 0,
+    n_surveillance  BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (patient_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS sensor_rollup_daily (
+    patient_id      INTEGER NOT NULL,
+    bucket          DATE NOT NULL,
+    n               BIGINT NOT NULL DEFAULT 0,
+    n_temp          BIGINT NOT NULL DEFAULT 0,
+    sum_spo2        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_risk        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sum_temp        DOUBLE PRECISION NOT NULL DEFAULT 0,
+    min_spo2        DOUBLE PRECISION,
+    max_spo2        DOUBLE PRECISION,
+    min_risk        DOUBLE PRECISION,
+    max_risk        DOUBLE PRECISION,
+    n_critique      BIGINT NOT NULL DEFAULT 0,
+    n_prevention    BIGINT NOT NULL DEFAULT 0,
+    n_surveillance  BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (patient_id, bucket)
+);
+
+CREATE OR REPLACE FUNCTION sensor_rollup_ingest() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO sensor_rollup_hourly AS r
+        (patient_id, bucket, n, n_temp, sum_spo2, sum_risk, sum_temp, min_spo2, max_spo2,
+         min_risk, max_risk, n_critique, n_prevention, n_surveillance)
+    SELECT patient_id, date_trunc('hour', timestamp),
+           COUNT(*), COUNT(temperature),
+           COALESCE(SUM(spo2), 0), COALESCE(SUM(risk_score), 0), COALESCE(SUM(temperature), 0),
+           MIN(spo2), MAX(spo2), MIN(risk_score), MAX(risk_score),
+           COUNT(*) FILTER (WHERE status = 'CRITIQUE'),
+           COUNT(*) FILTER (WHERE status = 'PRÉVENTION'),
+           COUNT(*) FILTER (WHERE status = 'SURVEILLANCE')
+    FROM new_rows
+    GROUP BY 1, 2
+    ON CONFLICT (patient_id, bucket) DO UPDATE SET
+        n = r.n + EXCLUDED.n,
+        n_temp = r.n_temp + EXCLUDED.n_temp,
+        sum_spo2 = r.sum_spo2 + EXCLUDED.sum_spo2,
+        sum_risk = r.sum_risk + EXCLUDED.sum_risk,
+        sum_temp = r.sum_temp + EXCLUDED.sum_temp,
+        min_spo2 = LEAST(r.min_spo2, EXCLUDED.min_spo2),
+        max_spo2 = GREATEST(r.max_spo2, EXCLUDED.max_spo2),
+        min_risk = LEAST(r.min_risk, EXCLUDED.min_risk),
+        max_risk = GREATEST(r.max_risk, EXCLUDED.max_risk),
+        n_critique = r.n_critique + EXCLUDED.n_critique,
+        n_prevention = r.n_prevention + EXCLUDED.n_prevention,
+        n_surveillance = r.n_surveillance + EXCLUDED.n_surveillance;
+
+    INSERT INTO sensor_rollup_daily AS r
+        (patient_id, bucket, n, n_temp, sum_spo2, sum_risk, sum_temp, min_spo2, max_spo2,
+         min_risk, max_risk, n_critique, n_prevention, n_surveillance)
+    SELECT patient_id, timestamp::date,
+           COUNT(*), COUNT(temperature),
+           COALESCE(SUM(spo2), 0), COALESCE(SUM(risk_score), 0), COALESCE(SUM(temperature), 0),
+           MIN(spo2), MAX(spo2), MIN(risk_score), MAX(risk_score),
+           COUNT(*) FILTER (WHERE status = 'CRITIQUE'),
+           COUNT(*) FILTER (WHERE status = 'PRÉVENTION'),
+           COUNT(*) FILTER (WHERE status = 'SURVEILLANCE')
+    FROM new_rows
+    GROUP BY 1, 2
+    ON CONFLICT (patient_id, bucket) DO UPDATE SET
+        n = r.n + EXCLUDED.n,
+        n_temp = r.n_temp + EXCLUDED.n_temp,
+        sum_spo2 = r.sum_spo2 + EXCLUDED.sum_spo2,
+        sum_risk = r.sum_risk + EXCLUDED.sum_risk,
+        sum_temp = r.sum_temp + EXCLUDED.sum_temp,
+        min_spo2 = LEAST(r.min_spo2, EXCLUDED.min_spo2),
+        max_spo2 = GREATEST(r.max_spo2, EXCLUDED.max_spo2),
+        min_risk = LEAST(r.min_risk, EXCLUDED.min_risk),
+        max_risk = GREATEST(r.max_risk, EXCLUDED.max_risk),
+        n_critique = r.n_critique + EXCLUDED.n_critique,
+        n_prevention = r.n_prevention + EXCLUDED.n_prevention,
+        n_surveillance = r.n_surveillance + EXCLUDED.n_surveillance;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill de l'historique existant
+TRUNCATE sensor_rollup_hourly, sensor_rollup_daily;
+
+INSERT INTO sensor_rollup_hourly
+    (patient_id, bucket, n, n_temp, sum_spo2, sum_risk, sum_temp, min_spo2, max_spo2,
+     min_risk, max_risk, n_critique, n_prevention, n_surveillance)
+SELECT patient_id, date_trunc('hour', timestamp),
+       COUNT(*), COUNT(temperature),
+       COALESCE(SUM(spo2), 0), COALESCE(SUM(risk_score), 0), COALESCE(SUM(temperature), 0),
+       MIN(spo2), MAX(spo2), MIN(risk_score), MAX(risk_score),
+       COUNT(*) FILTER (WHERE status = 'CRITIQUE'),
+       COUNT(*) FILTER (WHERE status = 'PRÉVENTION'),
+       COUNT(*) FILTER (WHERE status = 'SURVEILLANCE')
+FROM sensor_data
+GROUP BY 1, 2;
+
+INSERT INTO sensor_rollup_daily
+    (patient_id, bucket, n, n_temp, sum_spo2, sum_risk, sum_temp, min_spo2, max_spo2,
+     min_risk, max_risk, n_critique, n_prevention, n_surveillance)
+SELECT patient_id, bucket::date,
+       SUM(n), SUM(n_temp), SUM(sum_spo2), SUM(sum_risk), SUM(sum_temp),
+       MIN(min_spo2), MAX(max_spo2), MIN(min_risk), MAX(max_risk),
+       SUM(n_critique), SUM(n_prevention), SUM(n_surveillance)
+FROM sensor_rollup_hourly
+GROUP BY 1, 2;
+
+DROP TRIGGER IF EXISTS sensor_data_rollup ON sensor_data;
+CREATE TRIGGER sensor_data_rollup
+    AFTER INSERT ON sensor_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sensor_rollup_ingest();
+
+COMMIT;
@@ -0,0 +1,49 @@
+-- Conversion d'une table sensor_data existante (non partitionnée) vers le schéma partitionné
+-- par mois de data/schema.sql. À exécuter application arrêtée, depuis le dossier data/ :
+--     psql -d esante_respiratoire -f migrations/002_partition_sensor_data.sql
+-- L'ancienne table est conservée sous le nom sensor_data_legacy (à supprimer après vérification).
+
+BEGIN;
+LOCK TABLE sensor_data IN ACCESS EXCLUSIVE MODE;
+DROP TRIGGER IF EXISTS sensor_data_rollup ON sensor_data;
+ALTER TABLE sensor_data RENAME TO sensor_data_legacy;
+ALTER INDEX IF EXISTS sensor_data_pkey RENAME TO sensor_data_legacy_pkey;
+-- Libère le nom de la séquence pour la nouvelle table (BIGSERIAL)
+ALTER SEQUENCE IF EXISTS sensor_data_data_id_seq RENAME TO sensor_data_legacy_data_id_seq;
+COMMIT;
+
+-- Nouvelle table partitionnée, index, partitions à venir, agrégats et trigger
+\ir ../schema.sql
+
+BEGIN;
+
+-- Partitions mensuelles couvrant tout l'historique existant
+DO $$
+DECLARE
+    months_back INTEGER;
+BEGIN
+    SELECT COALESCE(
+        (EXTRACT(YEAR FROM age(date_trunc('month', NOW()), date_trunc('month', MIN(timestamp)))) * 12
+         + EXTRACT(MONTH FROM age(date_trunc('month', NOW()), date_trunc('month', MIN(timestamp)))))::int,
+        0)
+    INTO months_back
+    FROM sensor_data_legacy;
+    PERFORM sensor_data_ensure_partitions(3, months_back);
+END;
+$$;
+
+-- Copie en conservant les data_id (les feedbacks en attente restent valides) ;
+-- le trigger d'ingestion reconstruit les agrégats au passage
+INSERT INTO sensor_data
+    (data_id, patient_id, timestamp, spo2, bpm, flow_rate, muscle_strength, temperature,
+     risk_score, status, recommendation, actual_outcome, feedback_notes)
+SELECT data_id, patient_id, timestamp, spo2, bpm, flow_rate, muscle_strength, temperature,
+       risk_score, status, recommendation, actual_outcome, feedback_notes
+FROM sensor_data_legacy
+ORDER BY timestamp;
+
+SELECT setval('sensor_data_data_id_seq', GREATEST((SELECT MAX(data_id) FROM sensor_data), 1));
+
+ANALYZE sensor_data;
+
+COMMIT;
@@ -0,0 +1,111 @@
+-- Fréquence cardiaque dans les agrégats horaires et journaliers (vue historique du dashboard).
+-- Ajoute les colonnes, remplace la fonction du trigger et recalcule les valeurs existantes.
+
+BEGIN;
+
+LOCK TABLE sensor_data IN SHARE ROW EXCLUSIVE MODE;
+
+ALTER TABLE sensor_rollup_hourly
+    ADD COLUMN IF NOT EXISTS n_bpm BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS sum_bpm DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS min_bpm INTEGER,
+    ADD COLUMN IF NOT EXISTS max_bpm INTEGER;
+
+ALTER TABLE sensor_rollup_daily
+    ADD COLUMN IF NOT EXISTS n_bpm BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS sum_bpm DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS min_bpm INTEGER,
+    ADD COLUMN IF NOT EXISTS max_bpm INTEGER;
+
+CREATE OR REPLACE FUNCTION sensor_rollup_ingest() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO sensor_rollup_hourly AS r
+        (patient_id, bucket, n, n_temp, sum_spo2, sum_risk, sum_temp, min_spo2, max_spo2,
+         min_risk, max_risk, n_critique, n_prevention, n_surveillance,
+         n_bpm, sum_bpm, min_bpm, max_bpm)
+    SELECT patient_id, date_trunc('hour', timestamp),
+           COUNT(*), COUNT(temperature),
+           COALESCE(SUM(spo2), 0), COALESCE(SUM(risk_score), 0), COALESCE(SUM(temperature), 0),
+           MIN(spo2), MAX(spo2), MIN(risk_score), MAX(risk_score),
+           COUNT(*) FILTER (WHERE status = 'CRITIQUE'),
+           COUNT(*) FILTER (WHERE status = 'PRÉVENTION'),
+           COUNT(*) FILTER (WHERE status = 'SURVEILLANCE'),
+           COUNT(bpm), COALESCE(SUM(bpm), 0), MIN(bpm), MAX(bpm)
+    FROM new_rows
+    GROUP BY 1, 2
+    ON CONFLICT (patient_id, bucket) DO UPDATE SET
+        n = r.n + EXCLUDED.n,
+        n_temp = r.n_temp + EXCLUDED.n_temp,
+        sum_spo2 = r.sum_spo2 + EXCLUDED.sum_spo2,
+        sum_risk = r.sum_risk + EXCLUDED.sum_risk,
+        sum_temp = r.sum_temp + EXCLUDED.sum_temp,
+        min_spo2 = LEAST(r.min_spo2, EXCLUDED.min_spo2),
+        max_spo2 = GREATEST(r.max_spo2, EXCLUDED.max_spo2),
+        min_risk = LEAST(r.min_risk, EXCLUDED.min_risk),
+        max_risk = GREATEST(r.max_risk, EXCLUDED.max_risk),
+        n_critique = r.n_critique + EXCLUDED.n_critique,
+        n_prevention = r.n_prevention + EXCLUDED.n_prevention,
+        n_surveillance = r.n_surveillance + EXCLUDED.n_surveillance,
+        n_bpm = r.n_bpm + EXCLUDED.n_bpm,
+        sum_bpm = r.sum_bpm + EXCLUDED.sum_bpm,
+        min_bpm = LEAST(r.min_bpm, EXCLUDED.min_bpm),
+        max_bpm = GREATEST(r.max_bpm, EXCLUDED.max_bpm);
+
+    INSERT INTO sensor_rollup_daily AS r
+        (patient_id, bucket, n, n_temp, sum_spo2, sum_risk, sum_temp, min_spo2, max_spo2,
+         min_risk, max_risk, n_critique, n_prevention, n_surveillance,
+         n_bpm, sum_bpm, min_bpm, max_bpm)
+    SELECT patient_id, timestamp::date,
+           COUNT(*), COUNT(temperature),
+           COALESCE(SUM(spo2), 0), COALESCE(SUM(risk_score), 0), COALESCE(SUM(temperature), 0),
+           MIN(spo2), MAX(spo2), MIN(risk_score), MAX(risk_score),
+           COUNT(*) FILTER (WHERE status = 'CRITIQUE'),
+           COUNT(*) FILTER (WHERE status = 'PRÉVENTION'),
+           COUNT(*) FILTER (WHERE status = 'SURVEILLANCE'),
+           COUNT(bpm), COALESCE(SUM(bpm), 0), MIN(bpm), MAX(bpm)
+    FROM new_rows
+    GROUP BY 1, 2
+    ON CONFLICT (patient_id, bucket) DO UPDATE SET
+        n = r.n + EXCLUDED.n,
+        n_temp = r.n_temp + EXCLUDED.n_temp,
+        sum_spo2 = r.sum_spo2 + EXCLUDED.sum_spo2,
+        sum_risk = r.sum_risk + EXCLUDED.sum_risk,
+        sum_temp = r.sum_temp + EXCLUDED.sum_temp,
+        min_spo2 = LEAST(r.min_spo2, EXCLUDED.min_spo2),
+        max_spo2 = GREATEST(r.max_spo2, EXCLUDED.max_spo2),
+        min_risk = LEAST(r.min_risk, EXCLUDED.min_risk),
+        max_risk = GREATEST(r.max_risk, EXCLUDED.max_risk),
+        n_critique = r.n_critique + EXCLUDED.n_critique,
+        n_prevention = r.n_prevention + EXCLUDED.n_prevention,
+        n_surveillance = r.n_surveillance + EXCLUDED.n_surveillance,
+        n_bpm = r.n_bpm + EXCLUDED.n_bpm,
+        sum_bpm = r.sum_bpm + EXCLUDED.sum_bpm,
+        min_bpm = LEAST(r.min_bpm, EXCLUDED.min_bpm),
+        max_bpm = GREATEST(r.max_bpm, EXCLUDED.max_bpm);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill (valeurs recalculées, la migration peut être rejouée)
+UPDATE sensor_rollup_hourly r
+SET n_bpm = s.n_bpm, sum_bpm = s.sum_bpm, min_bpm = s.min_bpm, max_bpm = s.max_bpm
+FROM (
+    SELECT patient_id, date_trunc('hour', timestamp) AS bucket,
+           COUNT(bpm) AS n_bpm, COALESCE(SUM(bpm), 0) AS sum_bpm, MIN(bpm) AS min_bpm, MAX(bpm) AS max_bpm
+    FROM sensor_data
+    GROUP BY 1, 2
+) s
+WHERE r.patient_id = s.patient_id AND r.bucket = s.bucket;
+
+UPDATE sensor_rollup_daily r
+SET n_bpm = s.n_bpm, sum_bpm = s.sum_bpm, min_bpm = s.min_bpm, max_bpm = s.max_bpm
+FROM (
+    SELECT patient_id, bucket::date AS bucket,
+           SUM(n_bpm) AS n_bpm, SUM(sum_bpm) AS sum_bpm, MIN(min_bpm) AS min_bpm, MAX(max_bpm) AS max_bpm
+    FROM sensor_rollup_hourly
+    GROUP BY 1, 2
+) s
+WHERE r.patient_id = s.patient_id AND r.bucket = s.bucket;
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- Horodatage du feedback patient : l'apprentissage incrémental (ml_engine/refresh.py)
+-- ne relit que les feedbacks reçus depuis le dernier entraînement.
+
+BEGIN;
+
+ALTER TABLE sensor_data ADD COLUMN IF NOT EXISTS feedback_at TIMESTAMP;
+
+-- Feedbacks antérieurs : horodatage de la mesure faute de mieux
+UPDATE sensor_data SET feedback_at = timestamp
+WHERE actual_outcome IS NOT NULL AND feedback_at IS NULL;
+
+-- Filigrane (feedback_at, data_id) de l'apprentissage incrémental
+CREATE INDEX IF NOT EXISTS sensor_data_feedback_at ON sensor_data (feedback_at, data_id)
+    WHERE feedback_at IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,8 @@
+-- Version du modèle (registre ml_engine/models/registry) ayant produit chaque score :
+-- métriques de performance par version (maintenance_metrics.py).
+
+BEGIN;
+
+ALTER TABLE sensor_data ADD COLUMN IF NOT EXISTS model_version TEXT;
+
+COMMIT;
@@ -0,0 +1,36 @@
+-- Évaluation incrémentale de l'IA (maintenance_metrics.py) : matrice de confusion et
+-- histogrammes de risk_score par jour de mesure et par version de modèle, mis à jour
+-- avec les seuls feedbacks reçus depuis le dernier passage (filigrane).
+-- Pas de backfill : le premier passage traite tout l'historique par lots.
+
+BEGIN;
+
+-- Résultat réel tel qu'il a été compté : un feedback corrigé est retiré puis recompté
+ALTER TABLE sensor_data ADD COLUMN IF NOT EXISTS evaluated_outcome SMALLINT;
+
+CREATE TABLE IF NOT EXISTS model_performance_daily (
+    day             DATE NOT NULL,
+    model_version   TEXT NOT NULL,
+    n               BIGINT NOT NULL DEFAULT 0,
+    tp              BIGINT NOT NULL DEFAULT 0,
+    fp              BIGINT NOT NULL DEFAULT 0,
+    tn              BIGINT NOT NULL DEFAULT 0,
+    fn              BIGINT NOT NULL DEFAULT 0,
+    -- Distribution de risk_score (classes de largeur égale sur [0, 1]) des crises réelles / des stabilités
+    pos_hist        BIGINT[] NOT NULL,
+    neg_hist        BIGINT[] NOT NULL,
+    updated_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (day, model_version)
+);
+
+-- Dernier feedback (feedback_at, data_id) compté ; une seule ligne
+CREATE TABLE IF NOT EXISTS model_performance_watermark (
+    id              BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    feedback_at     TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    data_id         BIGINT NOT NULL DEFAULT 0,
+    updated_at      TIMESTAMP
+);
+
+INSERT INTO model_performance_watermark DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Photos de profil hors de la ligne patient (backend/photos.py) : seule l'empreinte du
+-- fichier (photo_id) est gardée. Les photos base64 existantes sont déplacées ensuite par :
+--     python -m backend.photos migrate
+-- photo_base64 n'est plus lue ni écrite par le backend.
+
+BEGIN;
+
+ALTER TABLE patients ADD COLUMN IF NOT EXISTS photo_id TEXT;
+
+COMMIT;
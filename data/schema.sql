@@ -0,0 +1,110 @@
+-- Schéma SmartBreath (installation neuve) :  psql -d esante_respiratoire -f data/schema.sql
+-- Pour une base existante, appliquer les scripts de data/migrations/ dans l'ordre.
+
+BEGIN;
+
+-- ---------------------------------------------------------------------------
+-- Patients
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id      SERIAL PRIMARY KEY,
+    nom             VARCHAR(100) NOT NULL,
+    prenom          VARCHAR(100) NOT NULL,
+    email           VARCHAR(255) NOT NULL UNIQUE,
+    password        VARCHAR(255) NOT NULL,
+    date_naissance  DATE,
+    age             INTEGER,
+    sexe            VARCHAR(1) DEFAULT 'M',
+    taille_cm       INTEGER,
+    poids_kg        DOUBLE PRECISION,
+    pathologie      VARCHAR(100) DEFAULT 'Non spécifié',
+    est_fumeur      BOOLEAN DEFAULT FALSE,
+    photo_base64    TEXT,
+    created_at      TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- ---------------------------------------------------------------------------
+-- Mesures capteurs : partitionnées par mois sur timestamp
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS sensor_data (
+    data_id          BIGSERIAL,
+    patient_id       INTEGER NOT NULL REFERENCES patients (patient_id),
+    timestamp        TIMESTAMP NOT NULL DEFAULT NOW(),
+    spo2             DOUBLE PRECISION,
+    bpm              INTEGER,
+    flow_rate        DOUBLE PRECISION,
+    muscle_strength  DOUBLE PRECISION,
+    temperature      DOUBLE PRECISION,
+    risk_score       DOUBLE PRECISION,
+    status           VARCHAR(20),
+    recommendation   TEXT,
+    actual_outcome   SMALLINT,
+    feedback_notes   TEXT,
+    -- La clé de partitionnement doit faire partie de la clé primaire
+    PRIMARY KEY (data_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Filet de sécurité pour les horodatages hors des partitions mensuelles
+CREATE TABLE IF NOT EXISTS sensor_data_default PARTITION OF sensor_data DEFAULT;
+
+-- Toutes les requêtes filtrent par patient puis par plage de temps, triées par timestamp DESC
+CREATE INDEX IF NOT EXISTS sensor_data_patient_ts ON sensor_data (patient_id, timestamp DESC);
+-- Balayages par plage de temps tous patients confondus (warm start, rétention, export de cohorte)
+CREATE INDEX IF NOT EXISTS sensor_data_ts_brin ON sensor_data USING brin (timestamp);
+-- Lignes avec feedback uniquement (entraînement, maintenance_metrics.py) : index partiel couvrant
+CREATE INDEX IF NOT EXISTS sensor_data_feedback ON sensor_data (patient_id, timestamp)
+    INCLUDE (status, actual_outcome, risk_score)
+    WHERE actual_outcome IS NOT NULL;
+
+-- Création des partitions mensuelles [mois courant - months_back, mois courant + months_ahead]
+CREATE OR REPLACE FUNCTION sensor_data_ensure_partitions(months_ahead INTEGER DEFAULT 3, months_back INTEGER DEFAULT 0)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN -months_back..months_ahead LOOP
+        month_start := (date_trunc('month', NOW()) + make_interval(months => i))::date;
+        part_name := format('sensor_data_y%sm%s', to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+        IF to_regclass(part_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF sensor_data FOR VALUES FROM (%L) TO (%L)',
+                part_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT sensor_data_ensure_partitions(3, 0);
+
+-- Archivage : journal des partitions détachées par le job de rétention
+CREATE TABLE IF NOT EXISTS sensor_data_archive_log (
+    partition_name  TEXT PRIMARY KEY,
+    range_start     DATE NOT NULL,
+    range_end       DATE NOT NULL,
+    row_count       BIGINT NOT NULL,
+    archive_path    TEXT,
+    archived_at     TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+COMMIT;
+
+-- Agrégats horaires / journaliers et trigger d'ingestion
+\ir migrations/001_sensor_rollups.sql
+\ir migrations/003_rollup_bpm.sql
+
+-- Horodatage des feedbacks (apprentissage incrémental)
+\ir migrations/004_feedback_at.sql
+
+-- Version du modèle ayant produit chaque score
+\ir migrations/005_model_version.sql
+
+-- Performance de l'IA par jour et par version (évaluation incrémentale des feedbacks)
+\ir migrations/006_model_performance.sql
+
+-- Photos de profil stockées hors de la table patients
+\ir migrations/007_patient_photos.sql
@@ -0,0 +1,248 @@
+"""
+Générateur de charge SmartBreath : des milliers de PhysiologicalSimulator en parallèle (asyncio).
+
+    python load_generator.py --patients 2000 --rate 500 --duration 60
+    python load_generator.py --patients 5000 --batch 50 --interval 1.5 --duration 120
+    python load_generator.py --patients 1000 --scenarios rapide=1,lente=1,severe=1,stable=3 --json rapport.json
+
+Boucle ouverte : chaque patient émet une mesure toutes les `interval` secondes quel que soit
+le temps de réponse du serveur (comme de vrais capteurs). Les latences sont mesurées depuis
+l'instant d'envoi prévu : une saturation du serveur (ou du générateur) apparaît dans les
+percentiles au lieu d'être masquée par un débit réduit.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+
+from mock_sensor import PhysiologicalSimulator
+
+load_dotenv()
+
+BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
+SCENARIO_KEYS = ["rapide", "lente", "severe", "stable"]
+
+
+class EndpointStats:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.service_times = []
+        self.ok = 0
+        self.errors = Counter()
+
+    def record(self, scheduled, sent, error=None):
+        now = time.perf_counter()
+        if error:
+            self.errors[error] += 1
+            return
+        self.ok += 1
+        self.latencies.append(now - scheduled)
+        self.service_times.append(now - sent)
+
+    def summary(self, elapsed):
+        total = self.ok + sum(self.errors.values())
+        row = {
+            "endpoint": self.name, "requests": total, "ok": self.ok,
+            "error_rate": (total - self.ok) / total if total else 0.0,
+            "throughput_rps": self.ok / elapsed if elapsed else 0.0,
+            "errors": dict(self.errors),
+        }
+        for key, values in (("latency_ms", self.latencies), ("service_ms", self.service_times)):
+            if values:
+                p = np.percentile(np.array(values) * 1000, [50, 95, 99])
+                row[key] = {"p50": round(p[0], 2), "p95": round(p[1], 2), "p99": round(p[2], 2),
+                            "max": round(max(values) * 1000, 2)}
+        return row
+
+
+def parse_scenarios(spec):
+    """'rapide=1,stable=3' -> poids dans l'ordre de PhysiologicalSimulator.scenarios"""
+    if not spec:
+        return None
+    weights = dict.fromkeys(SCENARIO_KEYS, 0.0)
+    for part in spec.split(","):
+        key, _, value = part.partition("=")
+        if key.strip() not in weights:
+            raise argparse.ArgumentTypeError(f"Scénario inconnu : {key} (attendu : {', '.join(SCENARIO_KEYS)})")
+        weights[key.strip()] = float(value or 1)
+    return [weights[k] for k in SCENARIO_KEYS]
+
+
+def parse_patient_ids(spec, n):
+    """'1-500' ou '3,7,12' ; par défaut 1..n"""
+    if not spec:
+        return [str(i) for i in range(1, n + 1)]
+    if "-" in spec:
+        lo, hi = spec.split("-")
+        return [str(i) for i in range(int(lo), int(hi) + 1)]
+    return [p.strip() for p in spec.split(",")]
+
+
+def make_simulators(patient_ids, scenario_weights, rng):
+    sims = []
+    for pid in patient_ids:
+        info = {"id": pid, "age": rng.randint(25, 85), "est_fumeur": rng.random() < 0.25}
+        sim = PhysiologicalSimulator(info, scenario_weights)
+        # Patients désynchronisés : tous ne sont pas dans la même phase du cycle
+        sim.step = rng.randrange(100)
+        sims.append(sim)
+    return sims
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.rng = random.Random(args.seed)
+        self.stats = {"analyze": EndpointStats("/analyze" if args.batch <= 1 else "/analyze/batch"),
+                      "feedback": EndpointStats("/feedback")}
+        self.inflight = asyncio.Semaphore(args.max_inflight)
+        self.measures_sent = 0
+        self.behind = 0
+        self.tasks = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _post(self, client, stats, path, payload, scheduled):
+        async with self.inflight:
+            sent = time.perf_counter()
+            try:
+                resp = await client.post(self.base_url + path, json=payload)
+            except httpx.HTTPError as e:
+                stats.record(scheduled, sent, type(e).__name__)
+                return None
+            if resp.status_code != 200:
+                stats.record(scheduled, sent, f"HTTP {resp.status_code}")
+                return None
+            stats.record(scheduled, sent)
+            return resp.json()
+
+    async def _feedback(self, client, data_id, risk):
+        # Même règle que mock_sensor.py : le patient confirme la plupart des alertes fortes
+        if data_id is None or risk <= 0.6 or self.rng.random() >= self.args.feedback_prob:
+            return
+        payload = {"data_id": data_id, "actual_outcome": 1,
+                   "comment": "Simulation: Patient confirme la gêne respiratoire."}
+        await self._post(client, self.stats["feedback"], "/feedback", payload, time.perf_counter())
+
+    async def _send(self, client, sims, scheduled):
+        measures = []
+        for sim in sims:
+            m = sim.generate_measure()
+            m.pop("phase")
+            sim.next_step()
+            measures.append(m)
+        self.measures_sent += len(measures)
+
+        if self.args.batch <= 1:
+            data = await self._post(client, self.stats["analyze"], "/analyze", measures[0], scheduled)
+            if data:
+                await self._feedback(client, data.get("data_id"), data.get("risk_score", 0))
+            return
+        data = await self._post(client, self.stats["analyze"], "/analyze/batch", measures, scheduled)
+        if data:
+            await asyncio.gather(*(self._feedback(client, r.get("data_id"), r.get("risk_score", 0))
+                                   for r in data.get("results", [])))
+
+    async def _source(self, client, sims, interval, deadline):
+        """Un capteur (ou une passerelle de `batch` capteurs) : une émission par intervalle"""
+        next_at = time.perf_counter() + self.rng.uniform(0, interval)
+        while next_at < deadline:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -interval:
+                self.behind += 1
+            self._spawn(self._send(client, sims, next_at))
+            next_at += interval
+
+    async def _report(self, start, deadline):
+        last = 0
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.args.report_every)
+            s = self.stats["analyze"]
+            done = s.ok + sum(s.errors.values())
+            elapsed = time.perf_counter() - start
+            print(f"[{elapsed:6.1f}s] {(done - last) / self.args.report_every:8.1f} req/s | "
+                  f"en vol {len(self.tasks):5d} | erreurs {sum(s.errors.values())}")
+            last = done
+
+    async def run(self):
+        args = self.args
+        patient_ids = parse_patient_ids(args.patient_ids, args.patients)
+        sims = make_simulators(patient_ids, args.scenarios, self.rng)
+        groups = [sims[i:i + max(args.batch, 1)] for i in range(0, len(sims), max(args.batch, 1))]
+        # --rate : débit global visé en mesures/s ; sinon une mesure par patient toutes les --interval s
+        interval = len(sims) / args.rate if args.rate else args.interval
+
+        print(f"{len(sims)} patients simulés | {len(groups)} émetteurs | intervalle {interval:.3f}s | "
+              f"débit visé {len(sims) / interval:.0f} mesures/s | durée {args.duration}s -> {self.base_url}")
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+            start = time.perf_counter()
+            deadline = start + args.duration
+            sources = [asyncio.create_task(self._source(client, g, interval, deadline)) for g in groups]
+            reporter = asyncio.create_task(self._report(start, deadline))
+            await asyncio.gather(*sources)
+            reporter.cancel()
+            # Les requêtes encore en vol terminent (ou expirent) avant le bilan
+            if self.tasks:
+                await asyncio.wait(list(self.tasks), timeout=args.timeout + 5)
+            elapsed = time.perf_counter() - start
+        return self.report(elapsed, interval, len(sims))
+
+    def report(self, elapsed, interval, n_patients):
+        rows = [self.stats[k].summary(elapsed) for k in ("analyze", "feedback")]
+        print(f"\nDurée {elapsed:.1f}s | {self.measures_sent} mesures envoyées "
+              f"({self.measures_sent / elapsed:.0f}/s, visé {n_patients / interval:.0f}/s) | "
+              f"émissions en retard : {self.behind}")
+        print(f"{'endpoint':<16}{'requêtes':>10}{'ok/s':>10}{'erreurs':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for r in rows:
+            lat = r.get("latency_ms", {})
+            print(f"{r['endpoint']:<16}{r['requests']:>10}{r['throughput_rps']:>10.1f}{r['error_rate']:>9.2%}"
+                  f"{lat.get('p50', 0):>10.1f}{lat.get('p95', 0):>10.1f}{lat.get('p99', 0):>10.1f}{lat.get('max', 0):>10.1f}")
+            if r["errors"]:
+                print(f"{'':<16}détail des erreurs : {r['errors']}")
+        return {"duration_s": elapsed, "measures_sent": self.measures_sent, "patients": n_patients,
+                "target_measures_per_s": n_patients / interval, "late_emissions": self.behind, "endpoints": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de charge SmartBreath (/analyze, /feedback)")
+    parser.add_argument("--url", default=BASE_URL, help="URL de base du backend")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--patient-ids", help="Identifiants existants en base : '1-500' ou '3,7,12' (défaut 1..--patients)")
+    parser.add_argument("--interval", type=float, default=1.5, help="Secondes entre deux mesures d'un patient")
+    parser.add_argument("--rate", type=float, help="Débit global visé en mesures/s (remplace --interval)")
+    parser.add_argument("--batch", type=int, default=1, help="Mesures par requête /analyze/batch (1 = /analyze)")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--scenarios", type=parse_scenarios, help="Pondération des scénarios : rapide=1,lente=1,severe=1,stable=3")
+    parser.add_argument("--feedback-prob", type=float, default=0.85)
+    parser.add_argument("--connections", type=int, default=200, help="Connexions HTTP simultanées")
+    parser.add_argument("--max-inflight", type=int, default=5000, help="Requêtes en attente maximum côté client")
+    parser.add_argument("--timeout", type=float, default=20)
+    parser.add_argument("--report-every", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Écrit le bilan dans ce fichier")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    result = asyncio.run(LoadGenerator(args).run())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
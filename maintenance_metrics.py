@@ -1,76 +1,255 @@
-import psycopg2
-import pandas as pd
+"""
+Performance de l'IA SmartBreath mesurée sur les feedbacks patients (actual_outcome).
+
+    python maintenance_metrics.py                  # met à jour puis affiche le rapport (30 derniers jours)
+    python maintenance_metrics.py --days 7 --version 20261017-033239-ed229b93
+
+L'état (matrice de confusion et histogrammes de risk_score) est conservé par jour de
+mesure et par version de modèle dans model_performance_daily. Chaque passage ne lit
+que les feedbacks reçus depuis le précédent (filigrane feedback_at, data_id) ; un
+feedback corrigé est retiré de son ancien décompte puis recompté. Le backend expose
+le rapport sur GET /performance.
+"""
+import argparse
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, classification_report, accuracy_score
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+from ml_engine.registry import LEGACY_VERSION
+
 load_dotenv()
 
-def get_performance_stats():
-    """Analyse la précision de l'IA en comparant status et actual_outcome"""
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
+# Classes de risk_score sur [0, 1] : AUC et précision/rappel à tout seuil multiple de 1 / PERFORMANCE_BINS
+PERFORMANCE_BINS = 100
+# Seuils du rapport : bornes des niveaux de risque de l'IA (ml_engine.predictor.RISK_BANDS)
+REPORT_THRESHOLDS = (0.35, 0.60, 0.80)
+# IA positive si le status est PRÉVENTION ou CRITIQUE
+POSITIVE_STATUSES = ("PRÉVENTION", "CRITIQUE")
+EVALUATION_BATCH = int(os.getenv("PERFORMANCE_BATCH", "50000"))
+# Un feedback horodaté (NOW() de sa transaction) peut être validé un peu après : marge avant de le compter
+FEEDBACK_SETTLE_S = 5
+
+# NOWAIT : un seul évaluateur à la fois, les autres lisent l'état existant
+WATERMARK_QUERY = "SELECT feedback_at, data_id FROM model_performance_watermark FOR UPDATE NOWAIT"
+NEW_FEEDBACK_QUERY = """
+    SELECT data_id, timestamp, feedback_at, timestamp::date AS day,
+           COALESCE(model_version, %(legacy)s) AS model_version,
+           COALESCE(status IN %(positive)s, FALSE) AS predicted, risk_score,
+           actual_outcome > 0 AS actual, evaluated_outcome > 0 AS counted
+    FROM sensor_data
+    WHERE feedback_at IS NOT NULL AND actual_outcome IS NOT NULL
+      AND (feedback_at, data_id) > (%(at)s, %(id)s)
+      AND feedback_at < NOW() - make_interval(secs => %(settle)s)
+    ORDER BY feedback_at, data_id
+    LIMIT %(limit)s
+"""
+UPSERT_PERFORMANCE_QUERY = """
+    INSERT INTO model_performance_daily AS r (day, model_version, n, tp, fp, tn, fn, pos_hist, neg_hist)
+    VALUES %s
+    ON CONFLICT (day, model_version) DO UPDATE SET
+        n = r.n + EXCLUDED.n,
+        tp = r.tp + EXCLUDED.tp,
+        fp = r.fp + EXCLUDED.fp,
+        tn = r.tn + EXCLUDED.tn,
+        fn = r.fn + EXCLUDED.fn,
+        pos_hist = ARRAY(SELECT a + b FROM unnest(r.pos_hist, EXCLUDED.pos_hist) WITH ORDINALITY AS h(a, b, i) ORDER BY i),
+        neg_hist = ARRAY(SELECT a + b FROM unnest(r.neg_hist, EXCLUDED.neg_hist) WITH ORDINALITY AS h(a, b, i) ORDER BY i),
+        updated_at = NOW()
+"""
+MARK_EVALUATED_QUERY = """
+    UPDATE sensor_data s SET evaluated_outcome = v.outcome
+    FROM (VALUES %s) AS v(data_id, timestamp, outcome)
+    WHERE s.data_id = v.data_id AND s.timestamp = v.timestamp
+"""
+SET_WATERMARK_QUERY = "UPDATE model_performance_watermark SET feedback_at = %s, data_id = %s, updated_at = NOW()"
+PERFORMANCE_QUERY = """
+    SELECT day, model_version, n, tp, fp, tn, fn, pos_hist, neg_hist
+    FROM model_performance_daily
+    WHERE day >= %(since)s AND (%(version)s::text IS NULL OR model_version = %(version)s)
+    ORDER BY model_version, day
+"""
+
+
+def _connect():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD")
+    )
+
+
+def aggregate_feedback(df, bins=PERFORMANCE_BINS):
+    """
+    Contributions d'un lot de feedbacks par (jour, version) : +1 avec le résultat réel,
+    -1 avec le résultat déjà compté pour un feedback corrigé.
+    """
+    counted = df[df["counted"].notna()]
+    contrib = pd.concat([
+        df.assign(actual=df["actual"].astype(bool), sign=1),
+        counted.assign(actual=counted["counted"].astype(bool), sign=-1),
+    ], ignore_index=True)
+
+    groups = contrib.groupby(["day", "model_version"], sort=True)
+    keys, group = list(groups.groups), groups.ngroup().to_numpy()
+    sign = contrib["sign"].to_numpy(np.int64)
+    actual = contrib["actual"].to_numpy(bool)
+    predicted = contrib["predicted"].to_numpy(bool)
+
+    def count(mask):
+        return np.bincount(group[mask], weights=sign[mask], minlength=len(keys)).astype(np.int64)
+
+    risk = pd.to_numeric(contrib["risk_score"]).to_numpy(np.float64)
+    scored = ~np.isnan(risk)
+    bin_idx = np.clip((np.nan_to_num(risk) * bins).astype(np.int64), 0, bins - 1)
+    hists = {}
+    for name, mask in (("pos_hist", actual & scored), ("neg_hist", ~actual & scored)):
+        hist = np.zeros((len(keys), bins), dtype=np.int64)
+        np.add.at(hist, (group[mask], bin_idx[mask]), sign[mask])
+        hists[name] = hist
+
+    return [
+        (day, version, int(n), int(tp), int(fp), int(tn), int(fn), pos.tolist(), neg.tolist())
+        for (day, version), n, tp, fp, tn, fn, pos, neg in zip(
+            keys, count(np.ones(len(actual), dtype=bool)), count(actual & predicted), count(~actual & predicted),
+            count(~actual & ~predicted), count(actual & ~predicted), hists["pos_hist"], hists["neg_hist"],
         )
-        
-        # On récupère uniquement les données où le patient a donné un feedback
-        query = """
-            SELECT status, actual_outcome 
-            FROM sensor_data 
-            WHERE actual_outcome IS NOT NULL
-        """
-        df = pd.read_sql(query, conn)
-        conn.close()
+    ]
 
-        if df.empty:
-            print(" Aucune donnée de feedback disponible pour le calcul.")
-            return
-
-        # Transformation en binaire pour comparaison
-        # IA positive si Status est PREVENTION ou CRITIQUE
-        df['pred_binary'] = df['status'].apply(lambda x: 1 if x in ['PRÉVENTION', 'CRITIQUE'] else 0)
-        df['actual_binary'] = df['actual_outcome'].astype(int)
-
-        # Calcul des métriques
-        acc = accuracy_score(df['actual_binary'], df['pred_binary'])
-        cm = confusion_matrix(df['actual_binary'], df['pred_binary'])
-        
-        # --- AFFICHAGE DES RÉSULTATS ---
-        print("\n" + "="*40)
-        print(f"RAPPORT DE PERFORMANCE IA - {pd.Timestamp.now().strftime('%Y-%m-%d')}")
-        print("="*40)
-        print(f" Taux de précision global : {acc*100:.2f}%")
-        print(f" Total feedbacks analysés : {len(df)}")
-        print("-" * 40)
-        
-        # Détails de la Matrice de Confusion
-        tn, fp, fn, tp = cm.ravel()
-        print(f" Vrais Positifs (Crises détectées) : {tp}")
-        print(f" Faux Positifs (Fausses alertes)   : {fp}")
-        print(f"Vrais Négatifs (Stabilité confirmée): {tn}")
-        print(f" Faux Négatifs (Crises manquées)   : {fn}")
+
+def update_performance(conn, batch=EVALUATION_BATCH):
+    """
+    Compte les feedbacks reçus depuis le dernier passage, par lots (un lot = une transaction).
+    Retourne le nombre de feedbacks traités, ou None si un autre évaluateur est en cours.
+    """
+    processed = 0
+    while True:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(WATERMARK_QUERY)
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+                return processed or None
+            at, data_id = cur.fetchone()
+            cur.execute(NEW_FEEDBACK_QUERY, {
+                "legacy": LEGACY_VERSION, "positive": POSITIVE_STATUSES, "at": at, "id": data_id,
+                "settle": FEEDBACK_SETTLE_S, "limit": batch,
+            })
+            df = pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+            if df.empty:
+                conn.commit()
+                return processed
+            execute_values(cur, UPSERT_PERFORMANCE_QUERY, aggregate_feedback(df))
+            execute_values(cur, MARK_EVALUATED_QUERY, list(zip(
+                df["data_id"].astype(int), df["timestamp"].dt.to_pydatetime(), df["actual"].astype(int),
+            )))
+            last = df.iloc[-1]
+            cur.execute(SET_WATERMARK_QUERY, (last["feedback_at"].to_pydatetime(), int(last["data_id"])))
+        conn.commit()
+        processed += len(df)
+        if len(df) < batch:
+            return processed
+
+
+def _ratio(num, den):
+    return round(num / den, 4) if den else None
+
+
+def histogram_auc(pos_hist, neg_hist):
+    """AUC ROC à partir des histogrammes de risk_score (ex-aequo d'une même classe comptés pour moitié)"""
+    pos, neg = np.asarray(pos_hist, dtype=np.float64), np.asarray(neg_hist, dtype=np.float64)
+    n_pos, n_neg = pos.sum(), neg.sum()
+    if n_pos == 0 or n_neg == 0:
+        return None
+    pos_above = n_pos - np.cumsum(pos)
+    return round(float((neg * (pos_above + 0.5 * pos)).sum() / (n_pos * n_neg)), 4)
+
+
+def summarize(n, tp, fp, tn, fn, pos_hist, neg_hist, thresholds=REPORT_THRESHOLDS):
+    """Métriques d'un état (matrice de confusion du status + histogrammes de risk_score)"""
+    pos, neg = np.asarray(pos_hist, dtype=np.int64), np.asarray(neg_hist, dtype=np.int64)
+    bins = len(pos)
+    by_threshold = []
+    for t in thresholds:
+        k = int(round(t * bins))
+        t_tp, t_fp = int(pos[k:].sum()), int(neg[k:].sum())
+        by_threshold.append({
+            "threshold": t, "precision": _ratio(t_tp, t_tp + t_fp), "recall": _ratio(t_tp, int(pos.sum())),
+        })
+    return {
+        "feedbacks": int(n),
+        "confusion": {"tp": int(tp), "fp": int(fp), "tn": int(tn), "fn": int(fn)},
+        "accuracy": _ratio(tp + tn, n),
+        "precision": _ratio(tp, tp + fp),
+        "recall": _ratio(tp, tp + fn),
+        "specificity": _ratio(tn, tn + fp),
+        "auc": histogram_auc(pos, neg),
+        "by_threshold": by_threshold,
+    }
+
+
+def performance_report(conn, days=30, version=None):
+    """Rapport par version de modèle (période entière et jour par jour) sur les `days` derniers jours"""
+    since = date.today() - timedelta(days=days - 1)
+    with conn.cursor() as cur:
+        cur.execute(PERFORMANCE_QUERY, {"since": since, "version": version})
+        rows = cur.fetchall()
+
+    versions = {}
+    for day, model_version, n, tp, fp, tn, fn, pos_hist, neg_hist in rows:
+        state = versions.setdefault(model_version, {"counts": np.zeros(5, dtype=np.int64), "hists": None, "daily": []})
+        state["counts"] += (n, tp, fp, tn, fn)
+        hists = np.array([pos_hist, neg_hist], dtype=np.int64)
+        state["hists"] = hists if state["hists"] is None else state["hists"] + hists
+        state["daily"].append({"day": day.isoformat(), **summarize(n, tp, fp, tn, fn, pos_hist, neg_hist)})
+
+    return {
+        "since": since.isoformat(),
+        "versions": {
+            v: {**summarize(*s["counts"], *s["hists"]), "daily": s["daily"]} for v, s in versions.items()
+        },
+    }
+
+
+def print_report(report):
+    print("\n" + "=" * 40)
+    print(f"RAPPORT DE PERFORMANCE IA - depuis le {report['since']}")
+    print("=" * 40)
+    if not report["versions"]:
+        print(" Aucune donnée de feedback disponible pour le calcul.")
+    for version, stats in report["versions"].items():
+        c = stats["confusion"]
+        print(f" Modèle {version} : {stats['feedbacks']} feedbacks analysés")
+        print(f"   Taux de précision global : {stats['accuracy']} | précision {stats['precision']} | "
+              f"rappel {stats['recall']} | AUC {stats['auc']}")
+        print(f"   Vrais Positifs (Crises détectées) : {c['tp']}")
+        print(f"   Faux Positifs (Fausses alertes)   : {c['fp']}")
+        print(f"   Vrais Négatifs (Stabilité confirmée): {c['tn']}")
+        print(f"   Faux Négatifs (Crises manquées)   : {c['fn']}")
+        for t in stats["by_threshold"]:
+            print(f"   Seuil risque {t['threshold']:.2f} : précision {t['precision']} | rappel {t['recall']}")
         print("-" * 40)
 
-        # --- GÉNÉRATION D'UN GRAPHIQUE ---
-        plt.figure(figsize=(8, 6))
-        sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', 
-                    xticklabels=['Prédit Stable', 'Prédit Crise'],
-                    yticklabels=['Réel Stable', 'Réel Crise'])
-        plt.title('Matrice de Confusion : Prédit vs Réel')
-        plt.ylabel('Réalité (Patient)')
-        plt.xlabel('Prédiction (IA)')
-        
-        # Sauvegarde du rapport visuel
-        plt.savefig('ia_performance_report.png')
-        print(" Graphique 'ia_performance_report.png' généré.")
-
-    except Exception as e:
-        print(f" Erreur lors de la maintenance : {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance de l'IA SmartBreath sur les feedbacks patients")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--version", help="Version de modèle (défaut : toutes)")
+    args = parser.parse_args()
+
+    conn = _connect()
+    try:
+        processed = update_performance(conn)
+        print(f" {processed or 0} nouveaux feedbacks pris en compte.")
+        print_report(performance_report(conn, args.days, args.version))
+    finally:
+        conn.close()
+
 
 if __name__ == "__main__":
-    get_performance_stats()
\ No newline at end of file
+    main()
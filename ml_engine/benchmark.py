@@ -0,0 +1,292 @@
+"""
+Micro-benchmarks du moteur IA SmartBreath.
+
+    python -m ml_engine.benchmark predict     # latence d'une prédiction unitaire
+    python -m ml_engine.benchmark engine      # parité et débit XGBoost vs moteur NumPy
+    python -m ml_engine.benchmark parity      # parité seule des versions live/shadow (code de sortie 1 si écart)
+    python -m ml_engine.benchmark features    # parité entraînement/service des tendances
+    python -m ml_engine.benchmark simulation  # débit et mémoire du simulateur de population
+"""
+import argparse
+import random
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from ml_engine.predictor import RespiratoryAI
+from ml_engine.registry import ModelRegistry
+from ml_engine.tree_engine import CompiledForest
+from ml_engine.features import (
+    TREND_COLUMNS, compute_trend_features, iter_trend_features, new_trend_history, stream_trend_features,
+)
+from ml_engine.simulation import PHASES, PopulationSimulator
+
+
+def random_measures(n, n_patients=50, seed=42):
+    rng = random.Random(seed)
+    return [{
+        'patient_id': str(rng.randrange(n_patients)),
+        'spo2': round(rng.uniform(84, 99), 1),
+        'bpm': rng.randint(55, 130),
+        'temperature': round(rng.uniform(36.2, 39.5), 1),
+        'muscle_strength': round(rng.uniform(55, 80), 1),
+        'flow_rate': round(rng.uniform(3.0, 4.5), 2),
+        'age': rng.randint(18, 85),
+        'height': rng.randint(150, 195),
+        'is_smoker': rng.random() < 0.3,
+    } for _ in range(n)]
+
+
+def legacy_predict_proba(ai, data, spo2_trend, bpm_trend, spo2_vol):
+    """Ancien chemin de predict() : DataFrame d'une ligne + DMatrix"""
+    feat_cols = [
+        'spo2', 'bpm', 'temperature', 'muscle_strength', 'flow_rate', 'age',
+        'height', 'pathologie_enc', 'is_smoker', 'spo2_trend', 'bpm_trend', 'spo2_volatility'
+    ]
+    feat_values = pd.DataFrame([dict(zip(feat_cols, ai._feature_row(data, spo2_trend, bpm_trend, spo2_vol)))])
+    dmatrix = xgb.DMatrix(feat_values[feat_cols])
+    return float(ai.model.predict(dmatrix)[0])
+
+
+def _timed(func, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+
+def bench_predict(n=2000, repeat=3):
+    ai = RespiratoryAI(engine="xgboost")
+    items = random_measures(n)
+    trends = (-1.5, 4.0, 0.8)
+
+    # Vérification : les deux chemins donnent la même probabilité
+    row = ai._row_buffer()
+    for data in items[:200]:
+        row[0, ai._column_positions] = ai._feature_row(data, *trends)
+        fast = float(ai._predict_matrix(row)[0])
+        assert abs(fast - legacy_predict_proba(ai, data, *trends)) < 1e-6
+
+    legacy_us = _timed(lambda d: legacy_predict_proba(ai, d, *trends), items, repeat)
+    fast_us = _timed(ai.predict, items, repeat)
+
+    print(f"predict() legacy (DataFrame + DMatrix) : {legacy_us:8.1f} µs/prédiction")
+    print(f"predict() actuel (float32 + inplace)   : {fast_us:8.1f} µs/prédiction")
+    print(f"Gain : x{legacy_us / fast_us:.1f}")
+
+
+def random_feature_matrix(n, seed=0):
+    """Matrice de features plausible (ordre FEATURE_COLUMNS), avec quelques valeurs manquantes"""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.uniform(80, 100, n), rng.uniform(50, 140, n), rng.uniform(35.8, 40, n),
+        rng.uniform(50, 85, n), rng.uniform(2.5, 5, n), rng.integers(18, 90, n),
+        rng.integers(145, 200, n), rng.integers(0, 3, n), rng.integers(0, 2, n),
+        rng.normal(0, 3, n), rng.normal(0, 8, n), rng.exponential(1.0, n),
+    ]).astype(np.float32)
+    X[rng.random(X.shape) < 0.01] = np.nan
+    return X
+
+
+# Écart maximal toléré entre le moteur compilé et XGBoost (probabilités)
+PARITY_TOLERANCE = 1e-5
+
+
+def engine_parity(model_path, X):
+    """Écart max entre CompiledForest et XGBoost inplace_predict (valeurs manquantes incluses)"""
+    booster = xgb.Booster(model_file=model_path)
+    return float(np.abs(CompiledForest.from_file(model_path).predict(X) - booster.inplace_predict(X)).max())
+
+
+def check_parity(registry=None, rows=20000):
+    """Parité des versions live et shadow du registre ; False si l'une diverge"""
+    registry = registry or ModelRegistry()
+    X = random_feature_matrix(rows)
+    ok = True
+    for role in ("live", "shadow"):
+        version, path = registry.resolve(role)
+        if version is None:
+            continue
+        diff = engine_parity(path, X)
+        status = "OK" if diff < PARITY_TOLERANCE else "KO"
+        ok &= status == "OK"
+        print(f"{status}  {role:<7}{version:<28}écart max {diff:.2e} sur {rows} lignes")
+    return ok
+
+
+def bench_engine(sizes=(1, 10, 100, 1000, 10000), repeat=5):
+    """
+    Débit des moteurs par taille de lot. Le moteur NumPy évite de charger XGBoost et gagne sur les
+    lots de 1 à 10 lignes, mais reste plus lent qu'inplace_predict à partir de ~100 lignes.
+    """
+    ai = RespiratoryAI(engine="xgboost")
+    booster = ai.model
+    forest = CompiledForest.from_file(ai.model_path)
+    print(f"Moteur compilé : {forest.num_trees} arbres, {forest.num_nodes} noeuds, profondeur {forest.max_depth}")
+
+    # Parité avec XGBoost (y compris valeurs manquantes -> branche par défaut)
+    X = random_feature_matrix(20000)
+    diff = engine_parity(ai.model_path, X)
+    print(f"Parité : écart max {diff:.2e} sur {len(X)} lignes")
+    if diff >= PARITY_TOLERANCE:
+        raise SystemExit(f"Le moteur compilé diverge de XGBoost (écart {diff:.2e} >= {PARITY_TOLERANCE:.0e})")
+
+    engines = {
+        "xgboost DMatrix": lambda M: booster.predict(xgb.DMatrix(M, feature_names=ai.feature_names)),
+        "xgboost inplace": booster.inplace_predict,
+        "numpy compilé": forest.predict,
+    }
+    print(f"{'lot':>6} | " + " | ".join(f"{name:>18}" for name in engines))
+    for size in sizes:
+        M = X[:size]
+        cells = []
+        for func in engines.values():
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func(M)
+                best = min(best, time.perf_counter() - start)
+            cells.append(f"{size / best:12.0f} l/s")
+        print(f"{size:>6} | " + " | ".join(f"{c:>18}" for c in cells))
+
+
+def random_sensor_frame(n, n_patients=200, seed=0):
+    """Flux de mesures entrelacées entre patients, trié par horodatage"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'patient_id': rng.integers(0, n_patients, n).astype(str),
+        'timestamp': pd.Timestamp('2026-01-01') + pd.to_timedelta(np.arange(n) * 1.5, unit='s'),
+        'spo2': np.round(rng.uniform(84, 99, n), 1),
+        'bpm': rng.integers(55, 130, n),
+    })
+
+
+def bench_features(n=100000):
+    """
+    Parité entraînement/service : les tendances calculées par la version groupée
+    (entraînement) doivent être identiques à celles vues en ligne par RespiratoryAI.
+    """
+    df = random_sensor_frame(n)
+
+    start = time.perf_counter()
+    batch = compute_trend_features(df)[TREND_COLUMNS].to_numpy()
+    batch_s = time.perf_counter() - start
+
+    # Flux traité en 7 morceaux avec les mêmes accumulateurs, comme l'entraînement par chunks
+    start = time.perf_counter()
+    history = new_trend_history(idle_ttl=float("inf"))
+    streamed = []
+    step = -(-n // 7)
+    for start_row in range(0, n, step):
+        chunk = df.iloc[start_row:start_row + step]
+        streamed.append(stream_trend_features(chunk['patient_id'].tolist(), chunk['spo2'], chunk['bpm'], history))
+    streamed = np.vstack(streamed)
+    stream_s = time.perf_counter() - start
+
+    # Curseur serveur trié par patient (entraînement) : morceaux de 7001 lignes avec report
+    ordered = df.sort_values(['patient_id', 'timestamp'], kind='stable')
+    chunked = pd.concat(list(iter_trend_features(ordered.iloc[i:i + 7001] for i in range(0, n, 7001))))
+    chunked = chunked.set_index(ordered.index)[TREND_COLUMNS].sort_index().to_numpy()
+
+    # Chemin de service réel
+    ai = RespiratoryAI()
+    served = np.array([
+        ai._update_trends({'patient_id': p, 'spo2': s, 'bpm': b})
+        for p, s, b in zip(df['patient_id'], df['spo2'], df['bpm'])
+    ], dtype=np.float64)
+
+    diff_stream = np.abs(streamed - batch).max()
+    diff_serve = np.abs(served - batch).max()
+    diff_chunked = np.abs(chunked - batch).max()
+    print(f"Parité streaming/groupé : écart max {diff_stream:.2e}")
+    print(f"Parité morceaux/groupé  : écart max {diff_chunked:.2e}")
+    print(f"Parité service/groupé   : écart max {diff_serve:.2e}")
+    assert max(diff_stream, diff_serve, diff_chunked) < 1e-6, "Les tendances d'entraînement et de service divergent"
+    print(f"Groupé (pandas)   : {n / batch_s:10.0f} lignes/s")
+    print(f"Streaming (O(1))  : {n / stream_s:10.0f} lignes/s")
+
+
+def bench_simulation(n_patients=100000, n_steps=200, chunk_rows=1_000_000, n_parity=300):
+    """
+    Simulateur de population : parité avec mock_sensor (tendances et constantes par phase),
+    puis débit et pic mémoire pour n_patients x n_steps lignes générées par chunks.
+    """
+    from mock_sensor import PhysiologicalSimulator
+
+    # Tendances émises = définition de ml_engine.features
+    sim = PopulationSimulator(200, seed=1)
+    frame = pd.concat(list(sim.chunks(n_steps=40, chunk_rows=1500)), ignore_index=True)
+    diff = np.abs(compute_trend_features(frame)[TREND_COLUMNS].to_numpy() - frame[TREND_COLUMNS].to_numpy()).max()
+    print(f"Parité tendances / compute_trend_features : écart max {diff:.2e}")
+    assert diff < 1e-4, "Les tendances du simulateur divergent de ml_engine.features"
+
+    # Même physiologie que le simulateur unitaire : moyennes par phase comparables
+    random.seed(1)
+    scalar = []
+    for i in range(n_parity):
+        s = PhysiologicalSimulator({"id": str(i), "age": random.randint(20, 85), "est_fumeur": random.random() < 0.3})
+        s.step = random.randrange(100)
+        for _ in range(n_steps):
+            m = s.generate_measure()
+            scalar.append((PHASES.index(m["phase"]), m["spo2"], m["bpm"]))
+            s.next_step()
+    scalar = pd.DataFrame(scalar, columns=["phase", "spo2", "bpm"]).groupby("phase").mean()
+    vector = pd.concat(list(PopulationSimulator(n_parity, seed=1).chunks(n_steps)))
+    vector = vector.groupby("phase")[["spo2", "bpm"]].mean()
+    print(f"{'phase':<14}{'SpO2 unitaire':>14}{'SpO2 vecto':>12}{'BPM unitaire':>14}{'BPM vecto':>11}")
+    for code in scalar.index:
+        print(f"{PHASES[code]:<14}{scalar.loc[code, 'spo2']:>14.2f}{vector.loc[code, 'spo2']:>12.2f}"
+              f"{scalar.loc[code, 'bpm']:>14.1f}{vector.loc[code, 'bpm']:>11.1f}")
+
+    # Débit et mémoire : seuls le chunk courant et l'état des patients sont en mémoire
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    sim = PopulationSimulator(n_patients, seed=0)
+    rows = positives = 0
+    start = time.perf_counter()
+    for chunk in sim.chunks(n_steps, chunk_rows):
+        rows += len(chunk)
+        positives += int(chunk["target"].sum())
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{rows} lignes ({n_patients} patients x {n_steps} mesures) en {elapsed:.1f}s : "
+          f"{rows / elapsed:,.0f} lignes/s | positifs {positives / rows:.1%}")
+    print(f"Pic RSS : {rss_after:.0f} Mo (avant génération {rss_before:.0f} Mo, chunks de {chunk_rows} lignes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks du moteur IA SmartBreath")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_predict = sub.add_parser("predict", help="Latence d'une prédiction unitaire")
+    p_predict.add_argument("-n", type=int, default=2000)
+    p_predict.add_argument("--repeat", type=int, default=3)
+    p_engine = sub.add_parser("engine", help="Parité et débit des moteurs d'inférence")
+    p_engine.add_argument("--repeat", type=int, default=5)
+    sub.add_parser("parity", help="Parité du moteur NumPy pour les versions live/shadow (sortie 1 si écart)")
+    p_features = sub.add_parser("features", help="Parité entraînement/service des tendances")
+    p_features.add_argument("-n", type=int, default=100000)
+    p_sim = sub.add_parser("simulation", help="Débit, mémoire et parité du simulateur de population")
+    p_sim.add_argument("--patients", type=int, default=100000)
+    p_sim.add_argument("--steps", type=int, default=200)
+    p_sim.add_argument("--chunk-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if args.command == "predict":
+        bench_predict(args.n, args.repeat)
+    elif args.command == "engine":
+        bench_engine(repeat=args.repeat)
+    elif args.command == "parity":
+        raise SystemExit(0 if check_parity() else 1)
+    elif args.command == "features":
+        bench_features(args.n)
+    elif args.command == "simulation":
+        bench_simulation(args.patients, args.steps, args.chunk_rows)
+
+
+if __name__ == "__main__":
+    main()
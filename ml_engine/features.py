@@ -0,0 +1,104 @@
+"""
+Feature engineering partagé entre le service (RespiratoryAI) et l'entraînement.
+
+Définition unique des caractéristiques dynamiques, calculées par patient sur la
+fenêtre des TREND_WINDOW dernières mesures (mesure courante incluse) :
+    spo2_trend      = SpO2 la plus récente - SpO2 la plus ancienne de la fenêtre
+    bpm_trend       = idem pour le BPM
+    spo2_volatility = écart-type (population, ddof=0) de la SpO2 sur la fenêtre
+"""
+import numpy as np
+import pandas as pd
+
+from ml_engine.history import create_trend_history
+
+# Ordre des colonnes attendu par le modèle
+FEATURE_COLUMNS = [
+    'spo2', 'bpm', 'temperature', 'muscle_strength', 'flow_rate', 'age',
+    'height', 'pathologie_enc', 'is_smoker', 'spo2_trend', 'bpm_trend', 'spo2_volatility'
+]
+TREND_COLUMNS = ['spo2_trend', 'bpm_trend', 'spo2_volatility']
+TREND_WINDOW = 5
+
+
+def new_trend_history(capacity=100000, idle_ttl=6 * 3600, backend="memory", path=None):
+    """Accumulateurs glissants par patient (Welford), utilisés au service comme à l'entraînement"""
+    return create_trend_history(backend, path=path, capacity=capacity, window=TREND_WINDOW, idle_ttl=idle_ttl)
+
+
+def stream_trend_features(patient_ids, spo2, bpm, history=None):
+    """
+    Version streaming : fait passer les mesures (triées par horodatage) dans les
+    accumulateurs par patient, exactement comme RespiratoryAI.predict le fait en ligne.
+    `history` peut être conservé d'un appel à l'autre pour traiter un flux par morceaux.
+    Retourne un tableau (n, 3) [spo2_trend, bpm_trend, spo2_volatility].
+    """
+    if history is None:
+        history = new_trend_history(capacity=max(len(set(patient_ids)), 1), idle_ttl=float("inf"))
+    out = np.empty((len(patient_ids), 3), dtype=np.float64)
+    for i, (p_id, s, b) in enumerate(zip(patient_ids, spo2, bpm)):
+        out[i] = history.update(p_id, float(s), float(b), now=0.0)
+    return out
+
+
+def compute_trend_features(df, group_col='patient_id', order_col='timestamp', window=TREND_WINDOW):
+    """
+    Version vectorisée groupée (backfill, entraînement) : ajoute les colonnes de tendance
+    à `df`. Les lignes sont ordonnées par patient puis par `order_col` si présente ;
+    l'ordre d'origine de `df` est conservé dans le résultat.
+    """
+    if df.empty:
+        return df.assign(**{c: pd.Series(dtype=float) for c in TREND_COLUMNS})
+
+    sort_cols = [group_col, order_col] if order_col in df.columns else [group_col]
+    ordered = df.sort_values(sort_cols, kind='stable')
+    g = ordered.groupby(group_col, sort=False)
+
+    out = {}
+    for col, name in (('spo2', 'spo2_trend'), ('bpm', 'bpm_trend')):
+        values = ordered[col].astype(float)
+        # Mesure la plus ancienne de la fenêtre : window-1 lignes plus tôt, ou la première du patient
+        oldest = g[col].shift(window - 1).astype(float).fillna(g[col].transform('first').astype(float))
+        out[name] = values - oldest
+
+    out['spo2_volatility'] = (
+        ordered['spo2'].astype(float)
+        .groupby(ordered[group_col], sort=False)
+        .rolling(window, min_periods=1).std(ddof=0)
+        .reset_index(level=0, drop=True)
+        .fillna(0.0)
+    )
+
+    result = df.copy()
+    for name, series in out.items():
+        result[name] = series.reindex(df.index)
+    return result
+
+
+def iter_trend_features(chunks, group_col='patient_id', order_col='timestamp', window=TREND_WINDOW):
+    """
+    Version par morceaux de compute_trend_features, pour un flux trié par patient puis par
+    `order_col` (curseur serveur) : les window-1 dernières mesures du dernier patient d'un
+    morceau sont reportées sur le suivant, le résultat est identique au calcul groupé.
+    """
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        frame = chunk.reset_index(drop=True) if carry is None else pd.concat([carry, chunk], ignore_index=True)
+        n_carry = 0 if carry is None else len(carry)
+        result = compute_trend_features(frame, group_col, order_col, window)
+        carry = frame[frame[group_col] == frame[group_col].iloc[-1]].tail(window - 1)
+        yield result.iloc[n_carry:].reset_index(drop=True)
+
+
+def window_trend_features(spo2_windows, bpm_windows):
+    """
+    Tendances à partir de fenêtres déjà extraites (au plus TREND_WINDOW mesures, de la plus
+    ancienne à la courante), par exemple par une requête LATERAL. Retourne un tableau (n, 3).
+    """
+    out = np.empty((len(spo2_windows), 3), dtype=np.float64)
+    for i, (spo2, bpm) in enumerate(zip(spo2_windows, bpm_windows)):
+        spo2 = np.asarray(spo2, dtype=np.float64)
+        out[i] = (spo2[-1] - spo2[0], float(bpm[-1]) - float(bpm[0]), spo2.std())
+    return out
@@ -0,0 +1,386 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Colonnes du tampon circulaire de chaque patient
+SPO2, BPM = 0, 1
+# Attente maximale du verrou SQLite partagé par les workers : au-delà, la mesure est scorée
+# sans tendance plutôt que de bloquer la requête
+SQLITE_BUSY_TIMEOUT_S = float(os.getenv("HISTORY_SQLITE_BUSY_MS", "200")) / 1000
+
+
+def push_window(win, n, head, mean, m2, spo2, bpm):
+    """
+    Ajoute une mesure au tampon circulaire `win` (tableau (fenêtre, 2), modifié sur place)
+    et met à jour les accumulateurs de Welford de la SpO2. Retourne (n, head, mean, m2).
+    """
+    window = win.shape[0]
+    if n == window:
+        # Retrait de la valeur qui sort de la fenêtre (Welford inversé)
+        old = win[head, SPO2]
+        n -= 1
+        new_mean = mean + (mean - old) / n
+        m2 -= (old - mean) * (old - new_mean)
+        mean = new_mean
+
+    win[head, SPO2] = spo2
+    win[head, BPM] = bpm
+    n += 1
+    delta = spo2 - mean
+    mean += delta / n
+    m2 += delta * (spo2 - mean)
+
+    head = (head + 1) % window
+    if head == 0:
+        # Une fois par tour de fenêtre, recalcul exact pour éviter la dérive numérique
+        # (coût O(fenêtre) amorti en O(1) par mesure)
+        values = win[:n, SPO2]
+        mean = values.mean()
+        m2 = float(((values - mean) ** 2).sum())
+    return n, head, mean, max(m2, 0.0)
+
+
+def window_trends(win, n, head, m2):
+    """(spo2_trend, bpm_trend, spo2_volatility) d'un tampon circulaire"""
+    if n < 2:
+        return 0, 0, 0
+    window = win.shape[0]
+    newest = (head - 1) % window
+    oldest = (head - n) % window
+    spo2_trend = float(win[newest, SPO2] - win[oldest, SPO2])
+    bpm_trend = float(win[newest, BPM] - win[oldest, BPM])
+    spo2_vol = float(np.sqrt(m2 / n))
+    return spo2_trend, bpm_trend, spo2_vol
+
+
+class TrendHistory:
+    """
+    Historique court (fenêtre glissante) des mesures de chaque patient, utilisé pour
+    les tendances. Les fenêtres sont stockées dans un unique tableau NumPy de taille
+    fixe (un slot par patient) : la mémoire reste constante quel que soit le nombre
+    de patients vus. Les patients inactifs depuis `idle_ttl` secondes libèrent leur
+    slot ; si le tableau est plein, le slot le moins récemment utilisé est recyclé.
+
+    La volatilité de la SpO2 est maintenue en O(1) par mesure (Welford glissant :
+    ajout de la nouvelle valeur, retrait de celle qui sort de la fenêtre).
+    """
+    # Mises à jour purement en mémoire : appelables depuis la boucle asyncio
+    blocking = False
+
+    def __init__(self, capacity=100000, window=5, idle_ttl=6 * 3600):
+        if window < 2:
+            raise ValueError("La fenêtre de tendance doit contenir au moins 2 mesures")
+        self.capacity = capacity
+        self.window = window
+        self.idle_ttl = idle_ttl
+
+        self.values = np.zeros((capacity, window, 2), dtype=np.float64)
+        self.count = np.zeros(capacity, dtype=np.int16)
+        # Position de la prochaine écriture dans le tampon circulaire
+        self.head = np.zeros(capacity, dtype=np.int16)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+        # Accumulateurs de Welford de la SpO2 sur la fenêtre (moyenne, somme des carrés des écarts)
+        self.spo2_mean = np.zeros(capacity, dtype=np.float64)
+        self.spo2_m2 = np.zeros(capacity, dtype=np.float64)
+
+        self._slots = {}
+        self._slot_ids = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, patient_id):
+        return str(patient_id) in self._slots
+
+    def _release(self, slot):
+        del self._slots[self._slot_ids[slot]]
+        self._slot_ids[slot] = None
+        self.count[slot] = 0
+        self.head[slot] = 0
+        self.last_seen[slot] = 0.0
+        self.spo2_mean[slot] = 0.0
+        self.spo2_m2[slot] = 0.0
+        self._free.append(slot)
+        self.evictions += 1
+
+    def _evict(self, now):
+        """Libère les slots inactifs ; à défaut, le(s) slot(s) le(s) plus ancien(s)."""
+        used = self.count > 0
+        idle = np.flatnonzero(used & (self.last_seen < now - self.idle_ttl))
+        if idle.size == 0:
+            # Tableau plein de patients actifs : on recycle ~1% des slots les plus anciens
+            # d'un coup pour amortir le balayage
+            n = max(1, self.capacity // 100)
+            idle = np.argpartition(np.where(used, self.last_seen, np.inf), n - 1)[:n]
+        for slot in idle:
+            self._release(int(slot))
+
+    def evict_idle(self, now=None):
+        """Balayage périodique : libère les patients inactifs depuis plus de idle_ttl"""
+        now = time.time() if now is None else now
+        with self._lock:
+            idle = np.flatnonzero((self.count > 0) & (self.last_seen < now - self.idle_ttl))
+            for slot in idle:
+                self._release(int(slot))
+            return int(idle.size)
+
+    def _slot_for(self, p_id, now):
+        slot = self._slots.get(p_id)
+        if slot is None:
+            if not self._free:
+                self._evict(now)
+            slot = self._free.pop()
+            self._slots[p_id] = slot
+            self._slot_ids[slot] = p_id
+        return slot
+
+    def _push(self, slot, spo2, bpm, now):
+        n, head, mean, m2 = push_window(
+            self.values[slot], int(self.count[slot]), int(self.head[slot]),
+            self.spo2_mean[slot], self.spo2_m2[slot], spo2, bpm
+        )
+        self.count[slot] = n
+        self.head[slot] = head
+        self.spo2_mean[slot] = mean
+        self.spo2_m2[slot] = m2
+        self.last_seen[slot] = now
+
+    def _trends(self, slot):
+        return window_trends(self.values[slot], int(self.count[slot]), int(self.head[slot]), self.spo2_m2[slot])
+
+    def update(self, patient_id, spo2, bpm, now=None):
+        """Ajoute une mesure et retourne (spo2_trend, bpm_trend, spo2_volatility)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            slot = self._slot_for(str(patient_id), now)
+            self._push(slot, spo2, bpm, now)
+            return self._trends(slot)
+
+    def window_of(self, patient_id):
+        """Fenêtre du patient (plus ancienne -> plus récente), tableau (n, 2) [spo2, bpm]"""
+        with self._lock:
+            slot = self._slots.get(str(patient_id))
+            if slot is None:
+                return np.empty((0, 2), dtype=np.float64)
+            n = int(self.count[slot])
+            order = (self.head[slot] - n + np.arange(n)) % self.window
+            return self.values[slot, order].copy()
+
+    def warm_start(self, rows):
+        """
+        Recharge l'historique à partir des dernières mesures en base.
+        rows : itérable de (patient_id, spo2, bpm[, timestamp epoch]) trié du plus ancien au plus récent.
+        """
+        loaded = 0
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                ts = row[3] if len(row) > 3 and row[3] is not None else now
+                slot = self._slot_for(str(row[0]), now)
+                self._push(slot, row[1], row[2], ts)
+                loaded += 1
+        return loaded
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "patients": len(self._slots),
+            "capacity": self.capacity,
+            "window": self.window,
+            "evictions": self.evictions,
+            "memory_bytes": int(sum(a.nbytes for a in (
+                self.values, self.count, self.head, self.last_seen, self.spo2_mean, self.spo2_m2
+            ))),
+        }
+
+
+class SQLiteTrendHistory:
+    """
+    Même interface que TrendHistory, mais l'état est partagé entre processus via un
+    fichier SQLite (mode WAL) : tous les workers uvicorn voient les mêmes tendances.
+    Chaque processus ouvre sa propre connexion (compatible fork).
+    """
+
+    # Un balayage d'éviction toutes les N mises à jour (par processus)
+    SWEEP_EVERY = 1000
+    # E/S disque et verrou partagé : à appeler hors de la boucle asyncio
+    blocking = True
+
+    def __init__(self, path, capacity=100000, window=5, idle_ttl=6 * 3600, busy_timeout=SQLITE_BUSY_TIMEOUT_S):
+        if window < 2:
+            raise ValueError("La fenêtre de tendance doit contenir au moins 2 mesures")
+        self.path = path
+        self.capacity = capacity
+        self.window = window
+        self.idle_ttl = idle_ttl
+        self.busy_timeout = busy_timeout
+        self.evictions = 0
+        # Mesures scorées sans tendance faute d'avoir obtenu le verrou à temps
+        self.busy_skips = 0
+        self._local = threading.local()
+        self._pid = None
+        self._updates = 0
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trend_window (
+                    patient_id TEXT PRIMARY KEY,
+                    n INTEGER NOT NULL,
+                    head INTEGER NOT NULL,
+                    spo2_mean REAL NOT NULL,
+                    spo2_m2 REAL NOT NULL,
+                    vals BLOB NOT NULL,
+                    last_seen REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS trend_window_last_seen ON trend_window (last_seen)")
+
+    def _connect(self):
+        # Connexions par thread et par processus : jamais partagées au travers d'un fork
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM trend_window").fetchone()[0]
+
+    def __contains__(self, patient_id):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM trend_window WHERE patient_id = ?", (str(patient_id),)
+            ).fetchone() is not None
+
+    def _push(self, conn, p_id, spo2, bpm, now):
+        row = conn.execute(
+            "SELECT n, head, spo2_mean, spo2_m2, vals FROM trend_window WHERE patient_id = ?", (p_id,)
+        ).fetchone()
+        if row is None:
+            n, head, mean, m2 = 0, 0, 0.0, 0.0
+            win = np.zeros((self.window, 2), dtype=np.float64)
+        else:
+            n, head, mean, m2 = row[0], row[1], row[2], row[3]
+            win = np.frombuffer(row[4], dtype=np.float64).reshape(self.window, 2).copy()
+        n, head, mean, m2 = push_window(win, n, head, mean, m2, spo2, bpm)
+        conn.execute(
+            "INSERT OR REPLACE INTO trend_window VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (p_id, n, head, float(mean), float(m2), win.tobytes(), now)
+        )
+        return window_trends(win, n, head, m2)
+
+    def _sweep(self, conn, now):
+        cur = conn.execute("DELETE FROM trend_window WHERE last_seen < ?", (now - self.idle_ttl,))
+        evicted = cur.rowcount
+        cur = conn.execute("""
+            DELETE FROM trend_window WHERE patient_id IN (
+                SELECT patient_id FROM trend_window ORDER BY last_seen ASC
+                LIMIT MAX((SELECT COUNT(*) FROM trend_window) - ?, 0)
+            )
+        """, (self.capacity,))
+        evicted += cur.rowcount
+        self.evictions += evicted
+        return evicted
+
+    def evict_idle(self, now=None):
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            return self._sweep(conn, now)
+
+    def update(self, patient_id, spo2, bpm, now=None):
+        """Ajoute une mesure et retourne (spo2_trend, bpm_trend, spo2_volatility)"""
+        now = time.time() if now is None else now
+        try:
+            with self._connect() as conn:
+                trends = self._push(conn, str(patient_id), spo2, bpm, now)
+                self._updates += 1
+                if self._updates % self.SWEEP_EVERY == 0:
+                    self._sweep(conn, now)
+                return trends
+        except sqlite3.OperationalError as e:
+            # Verrou tenu par un autre worker (database is locked) : tendance neutre, mesure non ajoutée
+            self.busy_skips += 1
+            if self.busy_skips == 1 or self.busy_skips % 1000 == 0:
+                logger.warning(f"Historique SQLite indisponible ({e}) : {self.busy_skips} mesure(s) scorée(s) sans tendance")
+            return 0, 0, 0
+
+    def window_of(self, patient_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT n, head, vals FROM trend_window WHERE patient_id = ?", (str(patient_id),)
+            ).fetchone()
+        if row is None:
+            return np.empty((0, 2), dtype=np.float64)
+        n, head = row[0], row[1]
+        win = np.frombuffer(row[2], dtype=np.float64).reshape(self.window, 2)
+        return win[(head - n + np.arange(n)) % self.window].copy()
+
+    def warm_start(self, rows):
+        loaded = 0
+        now = time.time()
+        with self._connect() as conn:
+            for row in rows:
+                ts = row[3] if len(row) > 3 and row[3] is not None else now
+                self._push(conn, str(row[0]), row[1], row[2], ts)
+                loaded += 1
+        return loaded
+
+    def stats(self):
+        try:
+            patients = len(self)
+        except sqlite3.OperationalError:
+            patients = None
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "patients": patients,
+            "capacity": self.capacity,
+            "window": self.window,
+            "evictions": self.evictions,
+            "busy_skips": self.busy_skips,
+        }
+
+
+class _Transaction:
+    """Transaction SQLite exclusive en écriture (BEGIN IMMEDIATE) : sérialise les workers"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.conn.execute("ROLLBACK")
+            return
+        try:
+            self.conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            # Ne jamais laisser la connexion du thread dans une transaction ouverte
+            self.conn.execute("ROLLBACK")
+            raise
+
+
+def create_trend_history(backend="memory", path=None, **kwargs):
+    """Fabrique du stockage des tendances : "memory" (par processus) ou "sqlite" (partagé)"""
+    if backend == "memory":
+        return TrendHistory(**kwargs)
+    if backend == "sqlite":
+        return SQLiteTrendHistory(path or "trend_history.sqlite3", **kwargs)
+    raise ValueError(f"Stockage d'historique inconnu : {backend}")
@@ -1,16 +1,96 @@
-import xgboost as xgb
-import pandas as pd
 import numpy as np
 import os
-from collections import deque
+import random
+import threading
+import time
 import logging
+from collections import namedtuple
+from ml_engine.tree_engine import CompiledForest
+from ml_engine.features import FEATURE_COLUMNS, new_trend_history
+from ml_engine.registry import ModelRegistry
+
+try:
+    import xgboost as xgb
+except ImportError:  # moteur numpy uniquement
+    xgb = None
 
 logger = logging.getLogger(__name__)
 
-class RespiratoryAI:
+# Moteurs d'inférence disponibles : "xgboost" (Booster natif) ou "numpy" (CompiledForest)
+INFERENCE_ENGINES = ("xgboost", "numpy")
+# Part des mesures également scorées par la version shadow (coût d'inférence doublé)
+MODEL_SHADOW_SAMPLE = float(os.getenv("MODEL_SHADOW_SAMPLE", "1.0"))
+# Bornes des niveaux de risque de _decide : un désaccord shadow = niveau différent
+RISK_BANDS = np.array([0.35, 0.60, 0.80])
+
+# Modèle en service : remplacé d'un bloc par load_version(), jamais modifié en place
+LoadedModel = namedtuple("LoadedModel", "version model feature_names column_positions path mtime loaded_at")
+
+
+class VersionStats:
+    """Latence d'inférence et distribution des scores d'une version (live ou shadow)"""
+    LATENCY_SAMPLES = 2048
+
     def __init__(self):
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(base_path, "models", "respiratory_model_predictive.json")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rows = 0
+        self.latency_sum = 0.0
+        self.score_sum = 0.0
+        self.critical = 0
+        self._latencies = np.zeros(self.LATENCY_SAMPLES)
+        # Comparaison avec la version live (shadow uniquement)
+        self.compared = 0
+        self.abs_diff_sum = 0.0
+        self.disagreements = 0
+
+    def record(self, latency_s, scores, live_scores=None):
+        scores = np.asarray(scores, dtype=np.float64)
+        with self._lock:
+            self._latencies[self.calls % self.LATENCY_SAMPLES] = latency_s
+            self.calls += 1
+            self.latency_sum += latency_s
+            self.rows += len(scores)
+            self.score_sum += float(scores.sum())
+            self.critical += int((scores > RISK_BANDS[-1]).sum())
+            if live_scores is not None:
+                live_scores = np.asarray(live_scores, dtype=np.float64)
+                self.compared += len(scores)
+                self.abs_diff_sum += float(np.abs(scores - live_scores).sum())
+                self.disagreements += int((np.digitize(scores, RISK_BANDS) != np.digitize(live_scores, RISK_BANDS)).sum())
+
+    def snapshot(self):
+        with self._lock:
+            latencies = self._latencies[:min(self.calls, self.LATENCY_SAMPLES)] * 1000
+            out = {
+                "calls": self.calls,
+                "rows": self.rows,
+                "mean_score": round(self.score_sum / self.rows, 4) if self.rows else None,
+                "critical_rate": round(self.critical / self.rows, 4) if self.rows else None,
+            }
+            if len(latencies):
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                out["latency_ms"] = {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3)}
+            if self.compared:
+                out["vs_live"] = {
+                    "compared": self.compared,
+                    "mean_abs_diff": round(self.abs_diff_sum / self.compared, 4),
+                    "disagreement_rate": round(self.disagreements / self.compared, 4),
+                }
+        return out
+
+
+class RespiratoryAI:
+    def __init__(self, engine=None, registry=None):
+        self.engine = (engine or os.getenv("SMARTBREATH_ENGINE", "xgboost")).lower()
+        if self.engine not in INFERENCE_ENGINES:
+            raise ValueError(f"Moteur d'inférence inconnu : {self.engine} (choix : {', '.join(INFERENCE_ENGINES)})")
+        if self.engine == "xgboost" and xgb is None:
+            raise ImportError("Moteur xgboost indisponible : XGBoost n'est pas installé (SMARTBREATH_ENGINE=numpy)")
+
+        # Version servie : pointeur LIVE du registre, sinon models/respiratory_model_predictive.json
+        self.registry = registry or ModelRegistry()
+        version, model_path = self.registry.resolve("live")
         
         if not os.path.exists(model_path):
             error_msg = f" Modèle XGBoost introuvable à : {model_path}"
@@ -18,65 +98,187 @@ class RespiratoryAI:
             raise FileNotFoundError(error_msg)
             
         try:
-            self.model = xgb.Booster()
-            self.model.load_model(model_path)
-            self.history = {} 
+            self.stats = {}
+            self.reloads = 0
+            self._loaded = self._load(version, model_path)
+            self._shadow = None
+            # Fenêtres de tendance bornées : mémoire fixe même avec 100k patients.
+            # HISTORY_BACKEND=sqlite partage les tendances entre workers (mode multi-processus)
+            self.history = new_trend_history(
+                capacity=int(os.getenv("HISTORY_CAPACITY", "100000")),
+                idle_ttl=float(os.getenv("HISTORY_IDLE_TTL", str(6 * 3600))),
+                backend=os.getenv("HISTORY_BACKEND", "memory"),
+                path=os.getenv("HISTORY_SQLITE_PATH")
+            )
+            # Une ligne float32 préallouée par thread (predict peut tourner dans le threadpool)
+            self._rows = threading.local()
             self.model_ready = True
-            print(f" IA SmartBreath chargée avec succès depuis : {model_path}")
+            print(f" IA SmartBreath chargée avec succès depuis : {model_path} (version {version}, moteur {self.engine})")
             print(f" Mode : Apprentissage Supervisé par Feedback activé.")
         except Exception as e:
             logger.error(f" Erreur lors du chargement du modèle : {e}")
             raise e
+        try:
+            self.sync_models()
+        except Exception as e:
+            logger.error(f"Version shadow non chargée : {e}")
 
-    def predict(self, data):
+    # Liste des colonnes attendues par le modèle XGBoost (définition partagée avec l'entraînement)
+    FEATURE_COLUMNS = FEATURE_COLUMNS
+
+    def _load(self, version, model_path):
+        """Charge un modèle et fixe l'ordre des colonnes à partir de ses feature_names"""
+        mtime = os.path.getmtime(model_path)
+        if self.engine == "numpy":
+            model = CompiledForest.from_file(model_path)
+        else:
+            model = xgb.Booster()
+            model.load_model(model_path)
+        feature_names = list(model.feature_names or self.FEATURE_COLUMNS)
+        missing = set(feature_names) ^ set(self.FEATURE_COLUMNS)
+        if missing:
+            raise ValueError(f"Colonnes du modèle incompatibles : {sorted(missing)}")
+        # Position dans la ligne du modèle de chaque valeur produite par _feature_row
+        column_positions = np.array(
+            [feature_names.index(c) for c in self.FEATURE_COLUMNS], dtype=np.intp
+        )
+        self.stats.setdefault(version, VersionStats())
+        return LoadedModel(version, model, feature_names, column_positions, model_path, mtime, time.time())
+
+    def load_version(self, version, role="live"):
         """
-        Analyse les données capteurs, calcule les tendances et retourne 
-        un score de risque basé sur le modèle XGBoost.
+        Charge une version à côté de celle en service puis la substitue en une seule affectation :
+        les prédictions en cours terminent avec l'ancienne, les suivantes utilisent la nouvelle.
+        En cas d'échec, la version actuelle reste en service. version=None retire le shadow.
         """
+        if role == "shadow" and version is None:
+            self._shadow = None
+            return None
+        loaded = self._load(version, self.registry.path(version))
+        if role == "shadow":
+            self._shadow = loaded
+        else:
+            self._loaded = loaded
+            self.reloads += 1
+        logger.info(f"Modèle {version} chargé ({role}) depuis {loaded.path}")
+        return loaded
+
+    def sync_models(self):
+        """
+        Aligne les versions chargées sur les pointeurs du registre (promotion par un autre
+        worker, job de rafraîchissement). Le fichier historique est rechargé s'il a été remplacé.
+        Retourne la liste des rôles rechargés.
+        """
+        changed = []
+        live_version, live_path = self.registry.resolve("live")
+        current = self._loaded
+        if live_version != current.version or os.path.getmtime(live_path) != current.mtime:
+            self.load_version(live_version)
+            changed.append("live")
+        shadow_version, _ = self.registry.resolve("shadow")
+        if shadow_version != (self._shadow.version if self._shadow else None):
+            self.load_version(shadow_version, "shadow")
+            changed.append("shadow")
+        return changed
+
+    @property
+    def model(self):
+        return self._loaded.model
+
+    @property
+    def model_path(self):
+        return self._loaded.path
+
+    @property
+    def model_version(self):
+        return self._loaded.version
+
+    @property
+    def feature_names(self):
+        return self._loaded.feature_names
+
+    @property
+    def _column_positions(self):
+        return self._loaded.column_positions
+
+    def model_info(self):
+        def describe(loaded):
+            return {"version": loaded.version, "path": loaded.path, "loaded_at": loaded.loaded_at}
+
+        loaded, shadow = self._loaded, self._shadow
+        return {
+            "engine": self.engine,
+            "live": describe(loaded),
+            "shadow": describe(shadow) if shadow else None,
+            "reloads": self.reloads,
+            "versions": {v: s.snapshot() for v, s in self.stats.items()},
+        }
+
+    def _predict_matrix(self, matrix, loaded=None):
+        """Probabilités de crise pour une matrice float32 déjà ordonnée selon feature_names"""
+        loaded = loaded or self._loaded
+        if self.engine == "numpy":
+            return loaded.model.predict(matrix)
+        if matrix.shape[0] == 1:
+            return loaded.model.inplace_predict(matrix)
+        return loaded.model.predict(xgb.DMatrix(matrix, feature_names=loaded.feature_names))
+
+    def _score(self, matrix, loaded):
+        """Prédiction chronométrée, comptabilisée dans les statistiques de la version"""
+        start = time.perf_counter()
+        probas = self._predict_matrix(matrix, loaded)
+        self.stats[loaded.version].record(time.perf_counter() - start, probas)
+        return probas
+
+    def _score_shadow(self, matrix, loaded, live_probas):
+        """Score la même entrée avec la version shadow : comparé au live, jamais renvoyé au client"""
+        shadow = self._shadow
+        if shadow is None or shadow.version == loaded.version or (MODEL_SHADOW_SAMPLE < 1.0 and random.random() >= MODEL_SHADOW_SAMPLE):
+            return
+        try:
+            if shadow.feature_names != loaded.feature_names:
+                values = matrix[:, loaded.column_positions]
+                matrix = np.empty_like(matrix)
+                matrix[:, shadow.column_positions] = values
+            start = time.perf_counter()
+            probas = self._predict_matrix(matrix, shadow)
+            self.stats[shadow.version].record(time.perf_counter() - start, probas, live_probas)
+        except Exception as e:
+            logger.error(f"Erreur du modèle shadow {shadow.version} : {e}")
+
+    def _row_buffer(self):
+        row = getattr(self._rows, "row", None)
+        if row is None:
+            row = self._rows.row = np.empty((1, len(self.FEATURE_COLUMNS)), dtype=np.float32)
+        return row
+
+    def _update_trends(self, data):
+        """Ajoute la mesure à l'historique du patient et retourne (spo2_trend, bpm_trend, spo2_vol)"""
         p_id = str(data.get('patient_id', 'unknown'))
         
-        # Gestion de l'historique pour les tendances (Trends)
-        if p_id not in self.history:
-            self.history[p_id] = deque(maxlen=5)
-        
-        self.history[p_id].append({
-            'spo2': data.get('spo2', 95), 
-            'bpm': data.get('bpm', 70)
-        })
+        # Calcul des caractéristiques dynamiques (Feature Engineering, O(1) par mesure)
+        spo2_trend, bpm_trend, spo2_vol = self.history.update(
+            p_id, data.get('spo2', 95), data.get('bpm', 70)
+        )
+        return spo2_trend, bpm_trend, spo2_vol
 
-        hist = list(self.history[p_id])
-        
-        # Calcul des caractéristiques dynamiques (Feature Engineering)
-        spo2_trend = hist[-1]['spo2'] - hist[0]['spo2'] if len(hist) > 1 else 0
-        bpm_trend = hist[-1]['bpm'] - hist[0]['bpm'] if len(hist) > 1 else 0
-        spo2_vol = np.std([x['spo2'] for x in hist]) if len(hist) > 1 else 0
-
-        # Liste des colonnes attendues par le modèle XGBoost
-        feat_cols = [
-            'spo2', 'bpm', 'temperature', 'muscle_strength', 'flow_rate', 'age', 
-            'height', 'pathologie_enc', 'is_smoker', 'spo2_trend', 'bpm_trend', 'spo2_volatility'
+    def _feature_row(self, data, spo2_trend, bpm_trend, spo2_vol):
+        return [
+            data.get('spo2', 95),
+            data.get('bpm', 70),
+            data.get('temperature', 36.6),
+            data.get('muscle_strength', 75.0),
+            data.get('flow_rate', 4.0),
+            data.get('age', 45),
+            data.get('height', 170),
+            data.get('pathologie_enc', 1), 
+            int(data.get('is_smoker', False)),
+            spo2_trend,
+            bpm_trend,
+            spo2_vol
         ]
-        
-        # Construction du DataFrame pour la prédiction
-        feat_values = pd.DataFrame([{
-            'spo2': data.get('spo2', 95),
-            'bpm': data.get('bpm', 70),
-            'temperature': data.get('temperature', 36.6),
-            'muscle_strength': data.get('muscle_strength', 75.0),
-            'flow_rate': data.get('flow_rate', 4.0),
-            'age': data.get('age', 45),
-            'height': data.get('height', 170),
-            'pathologie_enc': data.get('pathologie_enc', 1), 
-            'is_smoker': int(data.get('is_smoker', False)),
-            'spo2_trend': spo2_trend,
-            'bpm_trend': bpm_trend,
-            'spo2_volatility': spo2_vol
-        }])
-
-        # Prédiction via XGBoost
-        dmatrix = xgb.DMatrix(feat_values[feat_cols])
-        proba = float(self.model.predict(dmatrix)[0])
-        
+
+    def _decide(self, proba, data, spo2_trend, bpm_trend):
         # Logique de décision (Heuristiques médicales + IA)
         temp = data.get('temperature', 36.6)
         spo2 = data.get('spo2', 95)
@@ -109,4 +311,44 @@ class RespiratoryAI:
                 "spo2_trend": round(spo2_trend, 2),
                 "bpm_trend": round(bpm_trend, 2)
             }
-        }
\ No newline at end of file
+        }
+
+    def predict(self, data):
+        """
+        Analyse les données capteurs, calcule les tendances et retourne 
+        un score de risque basé sur le modèle XGBoost.
+        """
+        spo2_trend, bpm_trend, spo2_vol = self._update_trends(data)
+        # Modèle lu une seule fois : un rechargement concurrent ne mélange pas deux versions
+        loaded = self._loaded
+
+        # Remplissage de la ligne préallouée dans l'ordre des colonnes du modèle
+        row = self._row_buffer()
+        row[0, loaded.column_positions] = self._feature_row(data, spo2_trend, bpm_trend, spo2_vol)
+
+        # Prédiction (sans DataFrame ni DMatrix intermédiaire)
+        probas = self._score(row, loaded)
+        self._score_shadow(row, loaded, probas)
+        
+        return {**self._decide(float(probas[0]), data, spo2_trend, bpm_trend), "model_version": loaded.version}
+
+    def predict_batch(self, items):
+        """
+        Analyse une liste de mesures en un seul appel au moteur d'inférence.
+        Les mesures sont traitées dans l'ordre reçu : les tendances d'un même
+        patient évoluent donc comme avec des appels successifs à predict().
+        """
+        if not items:
+            return []
+
+        trends = [self._update_trends(data) for data in items]
+        loaded = self._loaded
+        matrix = np.empty((len(items), len(loaded.feature_names)), dtype=np.float32)
+        matrix[:, loaded.column_positions] = [self._feature_row(data, *t) for data, t in zip(items, trends)]
+        probas = self._score(matrix, loaded)
+        self._score_shadow(matrix, loaded, probas)
+
+        return [
+            {**self._decide(float(proba), data, t[0], t[1]), "model_version": loaded.version}
+            for proba, data, t in zip(probas, items, trends)
+        ]
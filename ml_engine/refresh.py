@@ -0,0 +1,207 @@
+"""
+Apprentissage incrémental à partir des feedbacks patients (sans réentraînement complet).
+
+    python -m ml_engine.refresh              # une passe (cron), le backend recharge le modèle
+    python -m ml_engine.refresh --dry-run    # évalue le candidat sans le publier
+    python -m ml_engine.refresh --shadow     # publie le candidat en shadow au lieu de live
+
+Le modèle live est prolongé de quelques arbres entraînés sur les seuls feedbacks
+reçus depuis son dernier entraînement. Le filigrane (feedback_at, data_id) est stocké
+dans les attributs du modèle et avance quand le modèle est publié ; un candidat rejeté
+avance le filigrane de rejet (fichier REFRESH_REJECTED du registre, propre au modèle
+live courant) pour que la passe suivante ne réapprenne pas les mêmes feedbacks. Le candidat
+est évalué sur des feedbacks réservés (jamais appris) et sur un échantillon simulé de
+référence ; il n'est publié que s'il ne dégrade ni l'un ni l'autre, comme nouvelle
+version du registre (ml_engine/registry.py) que les workers chargent sans redémarrer.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from ml_engine.features import FEATURE_COLUMNS, TREND_COLUMNS, TREND_WINDOW, window_trend_features
+from ml_engine.simulation import generate_time_series_data
+from ml_engine.registry import MODEL_REGISTRY_DIR, ModelRegistry
+from ml_engine.train_model import TRAIN_PARAMS, _connect, get_watermark, set_watermark
+
+REFRESH_ROUNDS = int(os.getenv("MODEL_REFRESH_ROUNDS", "20"))
+# Feedbacks nouveaux minimum pour tenter une mise à jour
+REFRESH_MIN_FEEDBACK = int(os.getenv("MODEL_REFRESH_MIN_FEEDBACK", "50"))
+REFRESH_MAX_ROWS = int(os.getenv("MODEL_REFRESH_MAX_ROWS", "200000"))
+# Dégradation relative tolérée du logloss sur l'échantillon simulé de référence
+REFRESH_MAX_REGRESSION = float(os.getenv("MODEL_REFRESH_MAX_REGRESSION", "0.05"))
+# Feedbacks réservés à la validation : data_id % HOLDOUT_MODULO == 0
+HOLDOUT_MODULO = 5
+# Un feedback horodaté (NOW() de sa transaction) peut être validé un peu après : marge avant de l'apprendre,
+# sinon le filigrane le dépasserait avant qu'il soit visible
+FEEDBACK_SETTLE_S = 5
+# Dernier feedback d'un lot rejeté, par modèle parent (registre)
+REJECTED_FILE = "REFRESH_REJECTED"
+
+# Feedbacks postérieurs au filigrane, avec la fenêtre de tendance vue par l'IA au moment
+# de la mesure (TREND_WINDOW dernières mesures du patient, mesure incluse)
+NEW_FEEDBACK_QUERY = """
+    SELECT f.data_id, f.feedback_at, f.spo2, f.bpm, f.temperature, f.muscle_strength, f.flow_rate,
+           p.age, p.taille_cm AS height, 1 AS pathologie_enc, p.est_fumeur::int AS is_smoker,
+           f.actual_outcome AS target, w.spo2_window, w.bpm_window
+    FROM sensor_data f
+    JOIN patients p ON p.patient_id = f.patient_id
+    CROSS JOIN LATERAL (
+        SELECT array_agg(spo2 ORDER BY timestamp, data_id) AS spo2_window,
+               array_agg(bpm ORDER BY timestamp, data_id) AS bpm_window
+        FROM (
+            SELECT s.spo2, s.bpm, s.timestamp, s.data_id
+            FROM sensor_data s
+            WHERE s.patient_id = f.patient_id AND s.timestamp <= f.timestamp
+              AND (s.timestamp, s.data_id) <= (f.timestamp, f.data_id)
+            ORDER BY s.timestamp DESC, s.data_id DESC
+            LIMIT %(window)s
+        ) recent
+    ) w
+    WHERE f.feedback_at IS NOT NULL AND (f.feedback_at, f.data_id) > (%(at)s, %(id)s)
+      AND f.feedback_at < NOW() - make_interval(secs => %(settle)s)
+    ORDER BY f.feedback_at, f.data_id
+    LIMIT %(limit)s
+"""
+
+
+def fetch_new_feedback(conn, watermark, limit=REFRESH_MAX_ROWS):
+    with conn.cursor() as cur:
+        cur.execute(NEW_FEEDBACK_QUERY, {"window": TREND_WINDOW, "at": watermark[0], "id": watermark[1],
+                                         "settle": FEEDBACK_SETTLE_S, "limit": limit})
+        columns = [d[0] for d in cur.description]
+        df = pd.DataFrame(cur.fetchall(), columns=columns)
+    if not df.empty:
+        df[TREND_COLUMNS] = window_trend_features(df["spo2_window"], df["bpm_window"])
+    return df
+
+
+def get_rejected_watermark(registry, parent):
+    """Filigrane du dernier lot rejeté pour ce modèle parent, ou None"""
+    try:
+        with open(os.path.join(registry.root, REJECTED_FILE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("parent") != parent:
+        # Le live a changé depuis : ses feedbacks non appris sont à réévaluer
+        return None
+    return datetime.fromisoformat(state["feedback_at"]), int(state["data_id"])
+
+
+def set_rejected_watermark(registry, parent, watermark, reason):
+    """Enregistre atomiquement la fin du lot rejeté (remplace le précédent)"""
+    os.makedirs(registry.root, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=registry.root, prefix=".rejected-")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"parent": parent, "feedback_at": watermark[0].isoformat(), "data_id": watermark[1],
+                   "reason": reason, "rejected_at": datetime.now().isoformat()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(registry.root, REJECTED_FILE))
+
+
+def _matrix(df, feature_names):
+    X = df[FEATURE_COLUMNS].astype(np.float32)[feature_names]
+    return xgb.DMatrix(X.to_numpy(), label=df["target"].astype(np.float32).to_numpy(), feature_names=feature_names)
+
+
+def _logloss(booster, dmatrix):
+    p = np.clip(booster.predict(dmatrix), 1e-7, 1 - 1e-7)
+    y = dmatrix.get_label()
+    return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+
+
+def refresh_model(conn, registry=None, rounds=REFRESH_ROUNDS, min_feedback=REFRESH_MIN_FEEDBACK,
+                  max_rows=REFRESH_MAX_ROWS, max_regression=REFRESH_MAX_REGRESSION, nthread=None,
+                  dry_run=False, role="live"):
+    """Une passe d'apprentissage incrémental. Retourne un bilan (status : skipped, rejected, published, dry_run)."""
+    start = time.perf_counter()
+    registry = registry or ModelRegistry()
+    parent, model_path = registry.resolve("live")
+    current = xgb.Booster(model_file=model_path)
+    watermark = get_watermark(current)
+    rejected = get_rejected_watermark(registry, parent)
+    if rejected is not None and rejected > watermark:
+        # Les feedbacks d'un lot déjà rejeté pour ce modèle ne sont pas réappris à chaque passe
+        watermark = rejected
+    df = fetch_new_feedback(conn, watermark, max_rows)
+    # Lot chargé : aucune transaction ne reste ouverte pendant l'entraînement
+    conn.commit()
+    result = {"parent": parent, "watermark": f"{watermark[0].isoformat()}|{watermark[1]}", "new_feedback": len(df)}
+    if len(df) < min_feedback:
+        return {**result, "status": "skipped", "reason": f"moins de {min_feedback} nouveaux feedbacks"}
+
+    feature_names = list(current.feature_names or FEATURE_COLUMNS)
+    holdout = (df["data_id"] % HOLDOUT_MODULO == 0).to_numpy()
+    if holdout.all() or not holdout.any():
+        return {**result, "status": "skipped", "reason": "apprentissage ou validation vide"}
+    dtrain, dholdout = _matrix(df[~holdout], feature_names), _matrix(df[holdout], feature_names)
+    dreference = _matrix(generate_time_series_data(n_patients=50, n_steps=300, seed=7), feature_names)
+
+    # Poursuite du boosting à partir du modèle courant (copie : `current` reste la référence)
+    params = {**TRAIN_PARAMS, "nthread": nthread} if nthread else TRAIN_PARAMS
+    candidate = xgb.train(params, dtrain, num_boost_round=rounds, xgb_model=current.copy())
+
+    metrics = {
+        "holdout_rows": int(holdout.sum()),
+        "holdout_logloss": (_logloss(current, dholdout), _logloss(candidate, dholdout)),
+        "reference_logloss": (_logloss(current, dreference), _logloss(candidate, dreference)),
+    }
+    result.update(metrics, train_rows=int((~holdout).sum()), trees=candidate.num_boosted_rounds())
+
+    before, after = metrics["holdout_logloss"]
+    ref_before, ref_after = metrics["reference_logloss"]
+    last = df.iloc[-1]
+    new_watermark = (last["feedback_at"].to_pydatetime(), int(last["data_id"]))
+    if after > before:
+        status, reason = "rejected", "le candidat dégrade les feedbacks de validation"
+    elif ref_after > ref_before * (1 + max_regression):
+        status, reason = "rejected", f"le candidat dégrade l'échantillon de référence de plus de {max_regression:.0%}"
+    elif dry_run:
+        status, reason = "dry_run", "candidat valide, non publié"
+    else:
+        set_watermark(candidate, new_watermark)
+        version = registry.publish(candidate, "refresh", {
+            "parent": parent, "feedback_watermark": candidate.attr("feedback_watermark"),
+            **{k: v for k, v in result.items() if k not in ("parent", "watermark")},
+        }, promote=role == "live")
+        if role == "shadow":
+            registry.set_pointer("shadow", version)
+        result["version"] = version
+        status, reason = "published", f"version {version} ({role}), filigrane {new_watermark[0].isoformat()}|{new_watermark[1]}"
+    if status == "rejected" and not dry_run:
+        set_rejected_watermark(registry, parent, new_watermark, reason)
+        reason += f" ; lot ignoré jusqu'à {new_watermark[0].isoformat()}|{new_watermark[1]}"
+    return {**result, "status": status, "reason": reason, "duration_s": round(time.perf_counter() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apprentissage incrémental SmartBreath à partir des feedbacks")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR, help="Répertoire du registre des modèles")
+    parser.add_argument("--rounds", type=int, default=REFRESH_ROUNDS)
+    parser.add_argument("--min-feedback", type=int, default=REFRESH_MIN_FEEDBACK)
+    parser.add_argument("--max-rows", type=int, default=REFRESH_MAX_ROWS)
+    parser.add_argument("--max-regression", type=float, default=REFRESH_MAX_REGRESSION)
+    parser.add_argument("--dry-run", action="store_true", help="Évalue le candidat sans le publier")
+    parser.add_argument("--shadow", action="store_true", help="Publie le candidat en shadow (évalué en parallèle du live)")
+    args = parser.parse_args()
+
+    conn = _connect()
+    try:
+        result = refresh_model(conn, ModelRegistry(args.registry), args.rounds, args.min_feedback, args.max_rows,
+                               args.max_regression, dry_run=args.dry_run, role="shadow" if args.shadow else "live")
+    finally:
+        conn.close()
+    for key, value in result.items():
+        print(f"{key:<20}{value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Registre des modèles SmartBreath : versions immuables et pointeurs live / shadow.
+
+    ml_engine/models/registry/
+        20261017-031916-1a2b3c4d/model.json      artefact XGBoost
+        20261017-031916-1a2b3c4d/metadata.json   source, date, métriques, filigrane, parent
+        LIVE                                     version servie par /analyze
+        SHADOW                                   version évaluée en parallèle (optionnel)
+
+    python -m ml_engine.registry list
+    python -m ml_engine.registry import ml_engine/models/respiratory_model_predictive.json --promote
+    python -m ml_engine.registry promote <version>
+    python -m ml_engine.registry shadow <version>      # --clear pour arrêter
+
+Une version est écrite dans un répertoire temporaire puis renommée, un pointeur est
+remplacé par os.replace : un worker lit toujours un état complet. Les workers suivent
+les pointeurs (RespiratoryAI.sync_models) et rechargent sans redémarrage.
+Sans pointeur LIVE, le fichier historique models/respiratory_model_predictive.json est servi.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+LEGACY_MODEL_PATH = os.path.join(MODELS_DIR, "respiratory_model_predictive.json")
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(MODELS_DIR, "registry"))
+MODEL_FILE = "model.json"
+METADATA_FILE = "metadata.json"
+ROLES = ("live", "shadow")
+# Version servie sans registre (fichier historique)
+LEGACY_VERSION = "legacy"
+
+
+class ModelRegistry:
+    def __init__(self, root=MODEL_REGISTRY_DIR):
+        self.root = root
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(v for v in os.listdir(self.root) if os.path.isfile(os.path.join(self.root, v, MODEL_FILE)))
+
+    def path(self, version):
+        if version == LEGACY_VERSION:
+            return LEGACY_MODEL_PATH
+        path = os.path.join(self.root, version, MODEL_FILE)
+        if os.sep in version or version.startswith(".") or not os.path.isfile(path):
+            raise KeyError(f"Version de modèle inconnue : {version}")
+        return path
+
+    def metadata(self, version):
+        try:
+            with open(os.path.join(self.root, version, METADATA_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"version": version}
+
+    def pointer(self, role):
+        """Version désignée pour ce rôle, ou None"""
+        try:
+            with open(os.path.join(self.root, role.upper())) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_pointer(self, role, version):
+        """Désigne (ou retire, version=None) la version d'un rôle, atomiquement"""
+        if role not in ROLES:
+            raise ValueError(f"Rôle inconnu : {role} (attendu : {', '.join(ROLES)})")
+        target = os.path.join(self.root, role.upper())
+        if version is None:
+            if os.path.exists(target):
+                os.unlink(target)
+            return
+        self.path(version)
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f".{role}-")
+        with os.fdopen(fd, "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+
+    def resolve(self, role="live"):
+        """(version, chemin) servis pour ce rôle ; live retombe sur le fichier historique"""
+        version = self.pointer(role)
+        if version is not None:
+            return version, self.path(version)
+        if role == "live":
+            return LEGACY_VERSION, LEGACY_MODEL_PATH
+        return None, None
+
+    def publish(self, booster, source, metadata=None, promote=False):
+        """Enregistre un Booster comme nouvelle version immuable. Retourne l'identifiant de version."""
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.root, prefix=".staging-")
+        try:
+            model_path = os.path.join(staging, MODEL_FILE)
+            booster.save_model(model_path)
+            with open(model_path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:8]
+            version = f"{datetime.now():%Y%m%d-%H%M%S}-{digest}"
+            meta = {"version": version, "created_at": datetime.now().isoformat(), "source": source,
+                    "sha256_prefix": digest, **(metadata or {})}
+            with open(os.path.join(staging, METADATA_FILE), "w") as f:
+                json.dump(meta, f, indent=2, default=str)
+            for name in (MODEL_FILE, METADATA_FILE):
+                with open(os.path.join(staging, name), "rb") as f:
+                    os.fsync(f.fileno())
+            os.replace(staging, os.path.join(self.root, version))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if promote:
+            self.set_pointer("live", version)
+        return version
+
+    def describe(self):
+        live, shadow = self.pointer("live"), self.pointer("shadow")
+        return {
+            "root": self.root,
+            "live": live or LEGACY_VERSION,
+            "shadow": shadow,
+            "versions": [
+                {**self.metadata(v), "roles": [r for r, p in (("live", live), ("shadow", shadow)) if p == v]}
+                for v in self.versions()
+            ],
+        }
+
+
+def main():
+    import xgboost as xgb
+
+    parser = argparse.ArgumentParser(description="Registre des modèles SmartBreath")
+    parser.add_argument("--root", default=MODEL_REGISTRY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Versions enregistrées et pointeurs")
+    p_import = sub.add_parser("import", help="Enregistre un fichier modèle comme nouvelle version")
+    p_import.add_argument("path")
+    p_import.add_argument("--promote", action="store_true", help="Désigne la version comme live")
+    p_promote = sub.add_parser("promote", help="Désigne la version servie")
+    p_promote.add_argument("version")
+    p_shadow = sub.add_parser("shadow", help="Désigne la version évaluée en parallèle")
+    p_shadow.add_argument("version", nargs="?")
+    p_shadow.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.command == "import":
+        version = registry.publish(xgb.Booster(model_file=args.path), "import",
+                                   {"imported_from": os.path.abspath(args.path)}, promote=args.promote)
+        print(f"Version {version} enregistrée" + (" (live)" if args.promote else ""))
+    elif args.command == "promote":
+        registry.set_pointer("live", args.version)
+        print(f"Version live : {args.version}")
+    elif args.command == "shadow":
+        registry.set_pointer("shadow", None if args.clear else args.version)
+        print(f"Version shadow : {None if args.clear else args.version}")
+    else:
+        state = registry.describe()
+        print(f"Registre {state['root']} | live {state['live']} | shadow {state['shadow'] or '-'}")
+        for v in state["versions"]:
+            roles = ",".join(v["roles"])
+            print(f"  {v['version']:<28}{v.get('source', '?'):<9}{v.get('created_at', '')[:19]:<21}{roles}")
+
+
+if __name__ == "__main__":
+    main()
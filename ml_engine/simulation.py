@@ -0,0 +1,218 @@
+"""
+Simulation physiologique partagée entre mock_sensor.py (un patient, en temps réel)
+et l'entraînement (population entière, vectorisée NumPy).
+
+Chaque patient parcourt des cycles de CYCLE_STEPS mesures. Selon le scénario tiré au
+début du cycle, une crise survient entre `start` et `end` : dégradation progressive
+puis crise aiguë, suivie d'une récupération de RECOVERY_STEPS mesures. Les constantes
+convergent vers leur cible par lissage exponentiel.
+
+    python -m ml_engine.benchmark simulation   # débit, mémoire et parité avec mock_sensor
+"""
+import numpy as np
+import pandas as pd
+
+from ml_engine.features import FEATURE_COLUMNS, TREND_WINDOW
+
+SCENARIOS = [
+    {"name": "Crise Rapide", "start": 25, "end": 45, "severity": 1.2},
+    {"name": "Crise Lente", "start": 30, "end": 60, "severity": 0.8},
+    {"name": "Crise Sévère", "start": 20, "end": 40, "severity": 1.5},
+    {"name": "Stable Prolongé", "start": 999, "end": 999, "severity": 0.0},
+]
+# Tirage par défaut : 70 % de crises (scénarios équiprobables), 30 % stable
+DEFAULT_SCENARIO_WEIGHTS = [0.7 / 3, 0.7 / 3, 0.7 / 3, 0.3]
+
+CYCLE_STEPS = 100
+RECOVERY_STEPS = 20
+# Part de la fenêtre de crise consacrée à la dégradation (le reste est la crise aiguë)
+DEGRADATION_SHARE = 0.6
+SMOOTHING = 0.15
+TEMP_SMOOTHING = 0.1
+
+PHASES = ["STABLE", "DÉGRADATION", "CRISE AIGUË", "RÉCUPÉRATION"]
+STABLE, DEGRADATION, CRISE, RECUPERATION = range(4)
+# Écart à la ligne de base par unité d'intensité : (SpO2, BPM, température)
+PHASE_EFFECTS = np.array([
+    [0.0, 0.0, 0.0],
+    [15.0, 50.0, 2.5],
+    [15.0, 50.0, 2.5],
+    [5.0, 15.0, 0.5],
+])
+
+# Label d'entraînement : crise aiguë en cours ou attendue dans les PREDICTION_HORIZON mesures
+PREDICTION_HORIZON = 10
+MEASURE_INTERVAL_S = 1.5
+
+_SCENARIO_TABLE = np.array([[s["start"], s["end"], s["severity"]] for s in SCENARIOS])
+
+
+def baselines(age, is_smoker):
+    """Constantes de repos (scalaires ou tableaux) selon l'âge et le tabagisme"""
+    age = np.asarray(age, dtype=np.float64)
+    smoker = np.asarray(is_smoker, dtype=np.float64)
+    age_factor = (age - 40) * 0.05
+    return {
+        "spo2": 98.0 - age_factor - 2.0 * smoker,
+        "bpm": 70 + (age - 40) * 0.2 + 5 * smoker,
+        "temperature": np.full_like(age, 36.6),
+        "muscle_strength": 75.0 - age_factor * 2,
+        "flow_rate": 4.2 - age_factor * 0.05,
+    }
+
+
+def scenario_phase(cycle_pos, start, end, severity):
+    """Phase (indice dans PHASES) et intensité pour une position dans le cycle (vectorisé)"""
+    cycle_pos, start, end, severity = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (cycle_pos, start, end, severity))
+    )
+    in_crisis = (cycle_pos >= start) & (cycle_pos < end)
+    recovering = (cycle_pos >= end) & (cycle_pos < end + RECOVERY_STEPS)
+    progress = np.where(in_crisis, (cycle_pos - start) / np.maximum(end - start, 1), 0.0)
+    degrading = in_crisis & (progress < DEGRADATION_SHARE)
+
+    phase = np.select([degrading, in_crisis, recovering], [DEGRADATION, CRISE, RECUPERATION], STABLE)
+    intensity = np.select(
+        [degrading, in_crisis, recovering],
+        [np.exp(-5 * (1 - progress / DEGRADATION_SHARE)) * severity,
+         severity,
+         (1 - (cycle_pos - end) / RECOVERY_STEPS) * severity * 0.5],
+        0.0,
+    )
+    return phase, intensity
+
+
+def phase_targets(phase, intensity, base_spo2, base_bpm, base_temp):
+    """Cibles (SpO2, BPM, température) vers lesquelles les constantes convergent"""
+    effects = PHASE_EFFECTS[phase]
+    return (base_spo2 - effects[..., 0] * intensity,
+            base_bpm + effects[..., 1] * intensity,
+            base_temp + effects[..., 2] * intensity)
+
+
+def crisis_label(cycle_pos, start, end, horizon=PREDICTION_HORIZON):
+    """1 si la crise aiguë est en cours ou commence dans les `horizon` prochaines mesures"""
+    acute_start = start + DEGRADATION_SHARE * (end - start)
+    return ((cycle_pos >= acute_start - horizon) & (cycle_pos < end)).astype(np.int8)
+
+
+class PopulationSimulator:
+    """
+    Population de patients avancée d'une mesure à la fois, tous patients ensemble.
+    Mémoire proportionnelle au nombre de patients, indépendante du nombre de mesures.
+    """
+
+    def __init__(self, n_patients, seed=None, scenario_weights=None, id_offset=0):
+        self.n = n_patients
+        self.rng = np.random.default_rng(seed)
+        self.scenario_weights = np.asarray(scenario_weights or DEFAULT_SCENARIO_WEIGHTS, dtype=np.float64)
+        self.scenario_weights /= self.scenario_weights.sum()
+
+        rng = self.rng
+        self.patient_id = np.arange(id_offset, id_offset + n_patients, dtype=np.int64)
+        self.age = rng.integers(20, 86, n_patients).astype(np.float64)
+        self.is_smoker = rng.random(n_patients) < 0.3
+        self.height = rng.integers(150, 196, n_patients).astype(np.float64)
+
+        self.base = baselines(self.age, self.is_smoker)
+        self.current = {k: v.copy() for k, v in self.base.items()}
+        # Patients désynchronisés dans leur cycle
+        self.step = rng.integers(0, CYCLE_STEPS, n_patients)
+        self.scenario = self._pick_scenarios(n_patients)
+
+        # Fenêtres de tendance (mêmes définitions que ml_engine.features)
+        self._spo2_win = np.empty((n_patients, TREND_WINDOW))
+        self._bpm_win = np.empty((n_patients, TREND_WINDOW))
+        self.t = 0
+
+    def _pick_scenarios(self, size):
+        return self.rng.choice(len(SCENARIOS), size=size, p=self.scenario_weights)
+
+    def advance(self):
+        """Une mesure par patient : dictionnaire de colonnes (features, label, phase)"""
+        n, rng = self.n, self.rng
+        start, end, severity = _SCENARIO_TABLE[self.scenario].T
+        cycle_pos = self.step % CYCLE_STEPS
+        phase, intensity = scenario_phase(cycle_pos, start, end, severity)
+
+        target_spo2, target_bpm, target_temp = phase_targets(
+            phase, intensity, self.base["spo2"], self.base["bpm"], self.base["temperature"]
+        )
+        target_temp = target_temp + np.where(phase == STABLE, rng.uniform(-0.1, 0.1, n), 0.0)
+
+        cur = self.current
+        cur["spo2"] += (target_spo2 - cur["spo2"]) * SMOOTHING
+        cur["bpm"] += (target_bpm - cur["bpm"]) * SMOOTHING
+        cur["temperature"] += (target_temp - cur["temperature"]) * TEMP_SMOOTHING
+
+        spo2 = np.round(np.clip(cur["spo2"] + rng.uniform(-0.3, 0.3, n), 70.0, 100.0), 1)
+        bpm = np.trunc(np.clip(cur["bpm"] + rng.uniform(-1, 1, n), 40, 160))
+        temperature = np.round(cur["temperature"] + rng.uniform(-0.05, 0.05, n), 1)
+
+        # Tendances sur les TREND_WINDOW dernières mesures (la plus ancienne disponible au début)
+        col = self.t % TREND_WINDOW
+        self._spo2_win[:, col] = spo2
+        self._bpm_win[:, col] = bpm
+        filled = min(self.t + 1, TREND_WINDOW)
+        oldest = (self.t + 1) % TREND_WINDOW if self.t + 1 >= TREND_WINDOW else 0
+        spo2_trend = spo2 - self._spo2_win[:, oldest]
+        bpm_trend = bpm - self._bpm_win[:, oldest]
+        spo2_volatility = self._spo2_win[:, :filled].std(axis=1)
+
+        out = {
+            "spo2": spo2, "bpm": bpm, "temperature": temperature,
+            "muscle_strength": np.round(cur["muscle_strength"], 1),
+            "flow_rate": np.round(cur["flow_rate"], 2),
+            "age": self.age, "height": self.height,
+            "pathologie_enc": np.ones(n), "is_smoker": self.is_smoker.astype(np.float64),
+            "spo2_trend": spo2_trend, "bpm_trend": bpm_trend, "spo2_volatility": spo2_volatility,
+            "target": crisis_label(cycle_pos, start, end),
+            "phase": phase.astype(np.int8),
+        }
+
+        # Mesure suivante ; nouveau scénario au début de chaque cycle
+        self.step += 1
+        self.t += 1
+        new_cycle = self.step % CYCLE_STEPS == 0
+        if new_cycle.any():
+            self.scenario[new_cycle] = self._pick_scenarios(int(new_cycle.sum()))
+        return out
+
+    def chunks(self, n_steps, chunk_rows=1_000_000, start_time=None):
+        """
+        Génère n_steps mesures par patient, en DataFrames d'environ chunk_rows lignes
+        (lignes ordonnées par pas de temps puis par patient).
+        """
+        steps_per_chunk = max(chunk_rows // self.n, 1)
+        start_time = pd.Timestamp(start_time or "2024-01-01")
+        interval = pd.Timedelta(seconds=MEASURE_INTERVAL_S)
+        columns = FEATURE_COLUMNS + ["target", "phase"]
+        done = 0
+        while done < n_steps:
+            k = min(steps_per_chunk, n_steps - done)
+            buffers = {c: np.empty(k * self.n, dtype=np.int8 if c in ("target", "phase") else np.float32)
+                       for c in columns}
+            for i in range(k):
+                step = self.advance()
+                sl = slice(i * self.n, (i + 1) * self.n)
+                for c in columns:
+                    buffers[c][sl] = step[c]
+            frame = pd.DataFrame(buffers, copy=False)
+            frame.insert(0, "patient_id", np.tile(self.patient_id, k))
+            frame.insert(1, "timestamp", start_time + interval * np.repeat(np.arange(done, done + k), self.n))
+            yield frame
+            done += k
+
+
+def iter_time_series_chunks(n_patients=400, n_steps=300, chunk_rows=1_000_000, seed=42, scenario_weights=None):
+    """Flux de DataFrames d'entraînement à mémoire bornée (n_patients x n_steps lignes au total)"""
+    sim = PopulationSimulator(n_patients, seed=seed, scenario_weights=scenario_weights)
+    yield from sim.chunks(n_steps, chunk_rows)
+
+
+def generate_time_series_data(n_patients=400, n_steps=300, seed=42, scenario_weights=None):
+    """Jeu d'entraînement simulé complet (colonnes FEATURE_COLUMNS + target) en un seul DataFrame"""
+    return pd.concat(
+        list(iter_time_series_chunks(n_patients, n_steps, seed=seed, scenario_weights=scenario_weights)),
+        ignore_index=True,
+    )
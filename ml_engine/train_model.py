@@ -1,94 +1,261 @@
-import xgboost as xgb
-import pandas as pd
-import numpy as np
+"""
+Entraînement du modèle SmartBreath (simulation + feedback réel) à mémoire bornée.
+
+    python -m ml_engine.train_model
+    python -m ml_engine.train_model --patients 100000 --steps 300 --chunk-rows 500000
+    python -m ml_engine.train_model --no-feedback --rounds 100
+    python -m ml_engine.train_model --promote shadow    # évaluée en parallèle avant promotion
+
+Les mesures des patients ayant donné un feedback sont lues par un curseur serveur
+PostgreSQL, par morceaux, triées par patient puis par horodatage : les tendances sont
+calculées morceau par morceau (iter_trend_features). La population simulée est
+générée elle aussi par morceaux (ml_engine/simulation.py). XGBoost consomme ces
+morceaux via un DataIter et construit une matrice quantifiée en mémoire externe :
+ni les mesures brutes ni les features ne sont jamais chargées en entier.
+"""
+import argparse
 import os
+import resource
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
 import psycopg2
-from sklearn.model_selection import train_test_split
+import xgboost as xgb
 from dotenv import load_dotenv
 
+from ml_engine.features import FEATURE_COLUMNS, iter_trend_features
+from ml_engine.registry import MODEL_REGISTRY_DIR, ModelRegistry
+from ml_engine.simulation import iter_time_series_chunks
+
 load_dotenv()
 
-# --- CONFIGURATION BDD ---
-def get_real_feedback_data():
-    """Récupère les données réelles validées par les patients dans la BDD"""
+# Toutes les mesures des patients ayant donné un feedback : les tendances doivent être
+# calculées sur la même séquence que celle vue par l'IA en ligne
+FEEDBACK_QUERY = """
+    SELECT s.patient_id, s.timestamp, s.spo2, s.bpm, s.temperature, s.muscle_strength, s.flow_rate,
+           p.age, p.taille_cm as height, 1 as pathologie_enc,
+           p.est_fumeur::int as is_smoker, s.actual_outcome as target
+    FROM sensor_data s
+    JOIN patients p ON s.patient_id = p.patient_id
+    WHERE s.patient_id IN (SELECT DISTINCT patient_id FROM sensor_data WHERE actual_outcome IS NOT NULL)
+    ORDER BY s.patient_id, s.timestamp, s.data_id
+"""
+FEEDBACK_COUNT_QUERY = "SELECT count(*) FROM sensor_data WHERE actual_outcome IS NOT NULL"
+LATEST_FEEDBACK_QUERY = """
+    SELECT feedback_at, data_id FROM sensor_data WHERE feedback_at IS NOT NULL
+    ORDER BY feedback_at DESC, data_id DESC LIMIT 1
+"""
+# Dernier feedback appris, enregistré dans les attributs du modèle (ml_engine/refresh.py)
+WATERMARK_ATTR = "feedback_watermark"
+EPOCH = datetime(1970, 1, 1)
+
+# Patients réservés à la validation (par patient, pour ne pas évaluer sur une série déjà vue)
+VALIDATION_MODULO = 5
+
+TRAIN_PARAMS = {
+    "objective": "binary:logistic",
+    "tree_method": "hist",
+    "max_depth": 7,
+    "eta": 0.03,
+    # Les crises sont plus rares que la stabilité : plus de poids aux détections de crises
+    "scale_pos_weight": 4.0,
+    "eval_metric": ["logloss", "auc"],
+}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _connect():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD")
+    )
+
+
+def get_watermark(booster):
+    """(feedback_at, data_id) du dernier feedback appris par le modèle"""
+    value = booster.attr(WATERMARK_ATTR)
+    if not value:
+        return EPOCH, 0
+    at, _, data_id = value.partition("|")
+    return datetime.fromisoformat(at), int(data_id)
+
+
+def set_watermark(booster, watermark):
+    booster.set_attr(**{WATERMARK_ATTR: f"{watermark[0].isoformat()}|{watermark[1]}"})
+
+
+def count_feedback():
+    """(nombre de feedbacks réels, filigrane du plus récent), ou (None, None) si la base est inaccessible"""
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
-        )
-        # On ne prend que les lignes où le patient a donné un feedback (actual_outcome)
-        query = """
-            SELECT s.spo2, s.bpm, s.temperature, s.muscle_strength, s.flow_rate, 
-                   p.age, p.taille_cm as height, 1 as pathologie_enc, 
-                   p.est_fumeur::int as is_smoker, s.actual_outcome as target
-            FROM sensor_data s
-            JOIN patients p ON s.patient_id = p.patient_id
-            WHERE s.actual_outcome IS NOT NULL
-        """
-        df_real = pd.read_sql(query, conn)
-        conn.close()
-        
-        if not df_real.empty:
-            # Recalcul des tendances pour les données réelles
-            df_real['spo2_trend'] = df_real['spo2'].diff().fillna(0)
-            df_real['bpm_trend'] = df_real['bpm'].diff().fillna(0)
-            df_real['spo2_volatility'] = df_real['spo2'].rolling(window=3).std().fillna(0)
-            print(f"{len(df_real)} feedbacks réels récupérés pour l'entraînement.")
-            return df_real
-        return None
+        conn = _connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(FEEDBACK_COUNT_QUERY)
+                count = cur.fetchone()[0]
+                cur.execute(LATEST_FEEDBACK_QUERY)
+                return count, cur.fetchone()
+        finally:
+            conn.close()
     except Exception as e:
         print(f"Impossible de lire les feedbacks réels (BDD vide ?) : {e}")
-        return None
+        return None, None
+
+
+def stream_feedback_chunks(chunk_rows=100000):
+    """Mesures des patients avec feedback, par morceaux (curseur serveur) avec leurs tendances"""
+    def raw_chunks():
+        conn = _connect()
+        try:
+            with conn.cursor(name="smartbreath_train") as cur:
+                cur.itersize = chunk_rows
+                cur.execute(FEEDBACK_QUERY)
+                columns = None
+                while True:
+                    rows = cur.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    columns = columns or [d[0] for d in cur.description]
+                    yield pd.DataFrame(rows, columns=columns)
+        finally:
+            conn.close()
 
-def generate_simulated_base_data(n_patients=300):
-    """Génère la base théorique de données pour l'IA"""
-    all_data = []
-    for patient_id in range(n_patients):
-        pass 
-    return df_simulated # Simplifié pour l'exemple
+    for chunk in iter_trend_features(raw_chunks()):
+        # On ne garde que les lignes où le patient a donné un feedback (actual_outcome)
+        chunk = chunk[chunk["target"].notna()]
+        if not chunk.empty:
+            yield chunk
 
-# --- SCRIPT PRINCIPAL D'ENTRAÎNEMENT ---
 
-print(" Démarrage de l'entraînement hybride (Théorie + Feedback Réel)...")
+def is_validation(patient_id):
+    return pd.to_numeric(patient_id).to_numpy() % VALIDATION_MODULO == 0
 
-# 1. Charger les deux sources
-df_sim = generate_time_series_data(n_patients=400) # Base théorique
-df_real = get_real_feedback_data() # Expérience patient
 
-# 2. Fusionner les données
-if df_real is not None:
-    df = pd.concat([df_sim, df_real], ignore_index=True)
-else:
-    df = df_sim
+class TrainingBatches(xgb.DataIter):
+    """
+    Itérateur XGBoost sur les sources d'entraînement. `make_chunks` est rappelé à chaque
+    passe (XGBoost relit les données pour les quantiles puis pour la matrice).
+    """
 
-# 3. Préparation des features
-features = ['spo2', 'bpm', 'temperature', 'muscle_strength', 'flow_rate', 'age', 
-            'height', 'pathologie_enc', 'is_smoker', 'spo2_trend', 'bpm_trend', 'spo2_volatility']
+    def __init__(self, make_chunks, validation, cache_prefix):
+        self.make_chunks = make_chunks
+        self.validation = validation
+        self.rows = 0
+        self.positives = 0
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
 
-X = df[features]
-y = df['target']
+    def reset(self):
+        if self._chunks is not None:
+            self._chunks.close()
+        self._chunks = None
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = self.make_chunks()
+            self.rows = self.positives = 0
+        for chunk in self._chunks:
+            part = chunk[is_validation(chunk["patient_id"]) == self.validation]
+            if part.empty:
+                continue
+            label = part["target"].to_numpy(np.float32)
+            input_data(data=part[FEATURE_COLUMNS].to_numpy(np.float32), label=label)
+            self.rows += len(part)
+            self.positives += int(label.sum())
+            return True
+        return False
+
+
+def training_chunks(args, with_feedback):
+    """Base théorique (simulation) puis expérience patient (feedback réel)"""
+    if args.patients:
+        yield from iter_time_series_chunks(args.patients, args.steps, args.chunk_rows, seed=args.seed)
+    if with_feedback:
+        yield from stream_feedback_chunks(args.chunk_rows)
+
+
+def train(args):
+    n_feedback, watermark = (None, None) if args.no_feedback else count_feedback()
+    with_feedback = bool(n_feedback)
+    if with_feedback:
+        print(f"{n_feedback} feedbacks réels disponibles pour l'entraînement.")
+    if not args.patients and not with_feedback:
+        raise SystemExit("Aucune donnée d'entraînement (ni simulation, ni feedback).")
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="smartbreath_xgb_", dir=args.cache_dir) as cache_dir:
+        make_chunks = partial(training_chunks, args, with_feedback)
+        train_it = TrainingBatches(make_chunks, False, os.path.join(cache_dir, "train"))
+        valid_it = TrainingBatches(make_chunks, True, os.path.join(cache_dir, "valid"))
+        dtrain = xgb.ExtMemQuantileDMatrix(train_it, max_bin=args.max_bin)
+        dvalid = xgb.ExtMemQuantileDMatrix(valid_it, max_bin=args.max_bin, ref=dtrain)
+        print(f"Données : {train_it.rows} lignes d'entraînement ({train_it.positives / max(train_it.rows, 1):.1%} crises), "
+              f"{valid_it.rows} de validation | {time.perf_counter() - start:.1f}s | pic RSS {peak_rss_mb():.0f} Mo")
+
+        evals_result = {}
+        params = {**TRAIN_PARAMS, "nthread": args.nthread} if args.nthread else TRAIN_PARAMS
+        booster = xgb.train(
+            params, dtrain, num_boost_round=args.rounds,
+            evals=[(dvalid, "validation")] if valid_it.rows else [],
+            evals_result=evals_result, verbose_eval=args.verbose_eval,
+        )
+        # Les pages du cache disque doivent être libérées avant la suppression du répertoire
+        del dtrain, dvalid
 
-# On utilise scale_pos_weight car les crises sont plus rares que la stabilité
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+    if with_feedback and watermark:
+        # L'apprentissage incrémental reprendra après le dernier feedback connu au démarrage
+        set_watermark(booster, watermark)
+    metrics = {name: values[-1] for name, values in evals_result.get("validation", {}).items()}
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        booster.save_model(args.output)
+        print(f" Modèle mis à jour avec succès : {args.output}")
+    else:
+        registry = ModelRegistry(args.registry)
+        version = registry.publish(booster, "train", {
+            "train_rows": train_it.rows, "validation_rows": valid_it.rows, "validation": metrics,
+            "simulated_patients": args.patients, "simulated_steps": args.steps, "rounds": args.rounds,
+            "feedback_watermark": booster.attr(WATERMARK_ATTR),
+        }, promote=args.promote == "live")
+        if args.promote == "shadow":
+            registry.set_pointer("shadow", version)
+        print(f" Modèle mis à jour avec succès : version {version} ({args.promote}) dans {registry.root}")
+    print(f" Volume d'entraînement : {train_it.rows + valid_it.rows} mesures analysées "
+          f"en {time.perf_counter() - start:.1f}s | pic RSS {peak_rss_mb():.0f} Mo")
+    if metrics:
+        print(f" Validation : logloss {metrics['logloss']:.4f} | AUC {metrics['auc']:.4f}")
+    return booster
 
-model = xgb.XGBClassifier(
-    n_estimators=250, 
-    max_depth=7, 
-    learning_rate=0.03, 
-    scale_pos_weight=4.0, # Donne plus d'importance aux détections de crises
-    objective='binary:logistic'
-)
 
-model.fit(X_train, y_train)
+def main():
+    parser = argparse.ArgumentParser(description="Entraînement hybride SmartBreath (simulation + feedback réel)")
+    parser.add_argument("--patients", type=int, default=400, help="Patients simulés (0 = feedback réel seul)")
+    parser.add_argument("--steps", type=int, default=300, help="Mesures simulées par patient")
+    parser.add_argument("--chunk-rows", type=int, default=200000, help="Lignes par morceau (mémoire bornée)")
+    parser.add_argument("--no-feedback", action="store_true", help="Ignore les feedbacks réels de la BDD")
+    parser.add_argument("--rounds", type=int, default=250)
+    parser.add_argument("--max-bin", type=int, default=256)
+    parser.add_argument("--nthread", type=int, help="Threads XGBoost (défaut : tous)")
+    parser.add_argument("--cache-dir", help="Répertoire du cache mémoire externe XGBoost (défaut : temporaire)")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR, help="Registre où publier la nouvelle version")
+    parser.add_argument("--promote", choices=["live", "shadow", "none"], default="live",
+                        help="Rôle de la nouvelle version dans le registre")
+    parser.add_argument("--output", help="Écrit un simple fichier modèle au lieu de publier dans le registre")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose-eval", type=int, default=50)
+    args = parser.parse_args()
 
-# 5. Sauvegarde
-model_dir = 'ml_engine/models/'
-if not os.path.exists(model_dir):
-    os.makedirs(model_dir)
+    print(" Démarrage de l'entraînement hybride (Théorie + Feedback Réel)...")
+    train(args)
 
-model.save_model(os.path.join(model_dir, 'respiratory_model_predictive.json'))
 
-print(f" Modèle mis à jour avec succès !")
-print(f" Volume d'entraînement : {len(df)} mesures analysées.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Objectifs dont la transformation du score brut (margin) est connue
+_LOGISTIC_OBJECTIVES = {"binary:logistic", "reg:logistic"}
+_IDENTITY_OBJECTIVES = {"reg:squarederror"}
+
+
+def _parse_float(value):
+    """XGBoost >= 2 sérialise base_score sous la forme '[3.979445E-1]'"""
+    return float(str(value).strip("[]"))
+
+
+class CompiledForest:
+    """
+    Moteur d'inférence alternatif : l'ensemble d'arbres du modèle XGBoost (dump JSON)
+    est aplati en tables de noeuds contiguës (feature, seuil, enfants, valeur de feuille)
+    et évalué niveau par niveau en NumPy sur tout un lot de mesures.
+    Intérêt : servir sans XGBoost et réduire la latence d'une mesure isolée. Ce n'est pas un
+    gain de débit : dès ~100 lignes par lot, XGBoost inplace_predict est environ 1,5 à 3,5 fois plus rapide.
+    """
+
+    # Nombre de lignes évaluées à la fois (borne la mémoire des tables lignes x arbres)
+    CHUNK_ROWS = 1024
+
+    def __init__(self, model_json):
+        learner = model_json["learner"]
+        booster = learner["gradient_booster"]
+        if booster.get("name") != "gbtree":
+            raise ValueError(f"Booster non supporté par le moteur compilé : {booster.get('name')}")
+
+        params = learner["learner_model_param"]
+        if int(params.get("num_class", 0)) > 1 or int(params.get("num_target", 1)) > 1:
+            raise ValueError("Le moteur compilé ne supporte que les modèles à une sortie")
+
+        self.objective = learner["objective"]["name"]
+        if self.objective not in _LOGISTIC_OBJECTIVES | _IDENTITY_OBJECTIVES:
+            raise ValueError(f"Objectif non supporté par le moteur compilé : {self.objective}")
+
+        self.feature_names = learner.get("feature_names") or None
+        self.num_features = int(params["num_feature"])
+
+        base_score = _parse_float(params["base_score"])
+        if self.objective in _LOGISTIC_OBJECTIVES:
+            self.base_margin = float(np.log(base_score / (1.0 - base_score)))
+        else:
+            self.base_margin = base_score
+
+        self._compile(booster["model"]["trees"])
+
+    @classmethod
+    def from_file(cls, model_path):
+        with open(model_path, "r") as f:
+            return cls(json.load(f))
+
+    def _compile(self, trees):
+        split_feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for tree in trees:
+            if tree.get("categories_nodes"):
+                raise ValueError("Les splits catégoriels ne sont pas supportés par le moteur compilé")
+
+            lc = np.asarray(tree["left_children"], dtype=np.int32)
+            rc = np.asarray(tree["right_children"], dtype=np.int32)
+            cond = np.asarray(tree["split_conditions"], dtype=np.float32)
+            is_leaf = lc == -1
+            local_ids = np.arange(len(lc), dtype=np.int32)
+
+            # Les feuilles pointent sur elles-mêmes : un parcours de longueur fixe reste stable
+            left.append(np.where(is_leaf, local_ids, lc) + offset)
+            right.append(np.where(is_leaf, local_ids, rc) + offset)
+            split_feature.append(np.where(is_leaf, 0, tree["split_indices"]).astype(np.int32))
+            threshold.append(np.where(is_leaf, 0.0, cond).astype(np.float32))
+            default_left.append(np.asarray(tree["default_left"], dtype=bool))
+            # Pour une feuille, split_conditions contient la valeur de sortie
+            value.append(np.where(is_leaf, cond, 0.0).astype(np.float32))
+            roots.append(offset)
+
+            max_depth = max(max_depth, self._tree_depth(lc, rc))
+            offset += len(lc)
+
+        self.split_feature = np.concatenate(split_feature)
+        self.threshold = np.concatenate(threshold)
+        self.left = np.concatenate(left)
+        self.right = np.concatenate(right)
+        # Enfants entrelacés : children[2 * noeud + go_left] donne le noeud suivant sans np.where
+        self.children = np.stack([self.right, self.left], axis=1).ravel()
+        self.default_left = np.concatenate(default_left)
+        self.value = np.concatenate(value)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.max_depth = max_depth
+        self.num_trees = len(roots)
+        self.num_nodes = offset
+
+    @staticmethod
+    def _tree_depth(lc, rc):
+        depth, level = 0, [0]
+        while True:
+            level = [c for n in level for c in (lc[n], rc[n]) if c != -1]
+            if not level:
+                return depth
+            depth += 1
+
+    def predict_margin(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.num_features:
+            raise ValueError(f"{X.shape[1]} colonnes reçues, {self.num_features} attendues")
+
+        n_features = X.shape[1]
+        out = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], self.CHUNK_ROWS):
+            chunk = np.ascontiguousarray(X[start:start + self.CHUNK_ROWS])
+            flat = chunk.ravel()
+            n = chunk.shape[0]
+            row_offsets = (np.arange(n, dtype=np.int64) * n_features)[:, None]
+            nodes = np.broadcast_to(self.roots, (n, self.num_trees)).copy()
+
+            # Tous les arbres descendent d'un niveau à chaque itération (np.take évite le coût du fancy indexing)
+            for _ in range(self.max_depth):
+                x = np.take(flat, row_offsets + np.take(self.split_feature, nodes))
+                # NaN < seuil est faux : la branche par défaut ne s'applique qu'aux valeurs manquantes
+                go_left = (x < np.take(self.threshold, nodes)) | (np.isnan(x) & np.take(self.default_left, nodes))
+                nodes = np.take(self.children, nodes * 2 + go_left)
+
+            out[start:start + n] = np.take(self.value, nodes).sum(axis=1, dtype=np.float64)
+        return out + self.base_margin
+
+    def predict(self, X):
+        """Probabilités (ou valeurs brutes selon l'objectif) pour chaque ligne de X"""
+        margin = self.predict_margin(X)
+        if self.objective in _LOGISTIC_OBJECTIVES:
+            return 1.0 / (1.0 + np.exp(-margin))
+        return margin
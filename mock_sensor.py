@@ -7,6 +7,10 @@ import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
 
+from ml_engine.simulation import (
+    CYCLE_STEPS, PHASES, SCENARIOS, SMOOTHING, TEMP_SMOOTHING, baselines, phase_targets, scenario_phase,
+)
+
 load_dotenv()
 
 
@@ -46,19 +50,19 @@ def get_patient_by_email(email):
         print(f"Erreur lecture BDD : {e}"); return None
 
 class PhysiologicalSimulator:
-    def __init__(self, patient_info):
+    def __init__(self, patient_info, scenario_weights=None):
         self.patient = patient_info
+        # Pondération des scénarios (même ordre que self.scenarios) ; None = 70 % de crises, 30 % stable
+        self.scenario_weights = scenario_weights
         self.step = 0
         self.buffer = [] 
         
-        age_factor = (self.patient['age'] - 40) * 0.05
-        smoker_penalty = 2.0 if self.patient['est_fumeur'] else 0.0
-        
-        self.baseline_spo2 = 98.0 - age_factor - smoker_penalty
-        self.baseline_bpm = 70 + (self.patient['age'] - 40) * 0.2 + (5 if self.patient['est_fumeur'] else 0)
-        self.baseline_temp = 36.6
-        self.baseline_muscle = 75.0 - age_factor * 2
-        self.baseline_flow = 4.2 - age_factor * 0.05
+        base = baselines(self.patient['age'], self.patient['est_fumeur'])
+        self.baseline_spo2 = float(base["spo2"])
+        self.baseline_bpm = float(base["bpm"])
+        self.baseline_temp = float(base["temperature"])
+        self.baseline_muscle = float(base["muscle_strength"])
+        self.baseline_flow = float(base["flow_rate"])
         
         self.current_spo2 = self.baseline_spo2
         self.current_bpm = self.baseline_bpm
@@ -66,47 +70,31 @@ class PhysiologicalSimulator:
         self.current_muscle = self.baseline_muscle
         self.current_flow = self.baseline_flow
         
-        self.scenarios = [
-            {"name": "Crise Rapide", "start": 25, "end": 45, "severity": 1.2},
-            {"name": "Crise Lente", "start": 30, "end": 60, "severity": 0.8},
-            {"name": "Crise Sévère", "start": 20, "end": 40, "severity": 1.5},
-            {"name": "Stable Prolongé", "start": 999, "end": 999, "severity": 0.0},
-        ]
-        self.current_scenario = random.choice(self.scenarios[:3]) if random.random() < 0.7 else self.scenarios[3]
+        # Physiologie partagée avec le simulateur de population (ml_engine/simulation.py)
+        self.scenarios = SCENARIOS
+        self.current_scenario = self.pick_scenario()
+
+    def pick_scenario(self):
+        if self.scenario_weights is not None:
+            return random.choices(self.scenarios, weights=self.scenario_weights)[0]
+        return random.choice(self.scenarios[:3]) if random.random() < 0.7 else self.scenarios[3]
 
     def get_phase(self):
-        cycle_pos = self.step % 100
         scenario = self.current_scenario
-        if scenario['start'] <= cycle_pos < scenario['end']:
-            progress = (cycle_pos - scenario['start']) / (scenario['end'] - scenario['start'])
-            if progress < 0.6:
-                decay = np.exp(-5 * (1 - progress / 0.6))
-                return "DÉGRADATION", decay * scenario['severity']
-            return "CRISE AIGUË", scenario['severity']
-        elif scenario['end'] <= cycle_pos < scenario['end'] + 20:
-            recovery = (cycle_pos - scenario['end']) / 20
-            return "RÉCUPÉRATION", (1 - recovery) * scenario['severity'] * 0.5
-        return "STABLE", 0.0
+        phase, intensity = scenario_phase(self.step % CYCLE_STEPS, scenario['start'], scenario['end'], scenario['severity'])
+        return PHASES[int(phase)], float(intensity)
 
     def generate_measure(self):
         phase, intensity = self.get_phase()
-        
+        target_spo2, target_bpm, target_temp = phase_targets(
+            PHASES.index(phase), intensity, self.baseline_spo2, self.baseline_bpm, self.baseline_temp
+        )
         if phase == "STABLE":
-            target_spo2, target_bpm = self.baseline_spo2, self.baseline_bpm
-            target_temp = self.baseline_temp + random.uniform(-0.1, 0.1)
-        elif phase == "DÉGRADATION" or phase == "CRISE AIGUË":
-            target_spo2 = self.baseline_spo2 - (15 * intensity)
-            target_bpm = self.baseline_bpm + (50 * intensity)
-            target_temp = self.baseline_temp + (2.5 * intensity)
-        else: 
-            target_spo2 = self.baseline_spo2 - (5 * intensity)
-            target_bpm = self.baseline_bpm + (15 * intensity)
-            target_temp = self.baseline_temp + (0.5 * intensity)
-
-        smoothing = 0.15
-        self.current_spo2 += (target_spo2 - self.current_spo2) * smoothing
-        self.current_bpm += (target_bpm - self.current_bpm) * smoothing
-        self.current_temp += (target_temp - self.current_temp) * 0.1 
+            target_temp += random.uniform(-0.1, 0.1)
+
+        self.current_spo2 += (target_spo2 - self.current_spo2) * SMOOTHING
+        self.current_bpm += (target_bpm - self.current_bpm) * SMOOTHING
+        self.current_temp += (target_temp - self.current_temp) * TEMP_SMOOTHING
         
         final_spo2 = round(max(70.0, min(100.0, self.current_spo2 + random.uniform(-0.3, 0.3))), 1)
         final_bpm = int(max(40, min(160, self.current_bpm + random.uniform(-1, 1))))
@@ -127,54 +115,59 @@ class PhysiologicalSimulator:
 
     def next_step(self):
         self.step += 1
-        if self.step % 100 == 0:
-            self.current_scenario = random.choice(self.scenarios[:3]) if random.random() < 0.7 else self.scenarios[3]
+        if self.step % CYCLE_STEPS == 0:
+            self.current_scenario = self.pick_scenario()
 
 
-print("Démarrage du Simulateur Physiologique v3.0 (Boucle de Feedback IA)")
-email_input = input("Email du patient : ").strip()
-patient = get_patient_by_email(email_input)
+def main():
+    print("Démarrage du Simulateur Physiologique v3.0 (Boucle de Feedback IA)")
+    email_input = input("Email du patient : ").strip()
+    patient = get_patient_by_email(email_input)
 
-if not patient:
-    print("Erreur : Patient introuvable."); exit(1)
+    if not patient:
+        print("Erreur : Patient introuvable."); exit(1)
 
-simulator = PhysiologicalSimulator(patient)
-print(f"Simulation lancée pour {patient['prenom']} {patient['nom']}")
-print(f"Cible API : {URL_API}")
+    simulator = PhysiologicalSimulator(patient)
+    print(f"Simulation lancée pour {patient['prenom']} {patient['nom']}")
+    print(f"Cible API : {URL_API}")
 
-try:
-    while True:
-        measure = simulator.generate_measure()
-        phase = measure.pop('phase')
-        
-        try:
-            response = session.post(URL_API, json=measure, timeout=20)
-            
-            if response.status_code == 200:
-                data = response.json()
-                data_id = data.get('data_id') 
-                status = data.get('status', 'STABLE')
-                risk = data.get('risk_score', 0)
-
-                if risk > 0.6 and random.random() < 0.85:
-                    feedback_payload = {
-                        "data_id": data_id,
-                        "actual_outcome": 1,
-                        "comment": "Simulation: Patient confirme la gêne respiratoire."
-                    }
-                    session.post(URL_FEEDBACK, json=feedback_payload, timeout=5)
-                
-                color = "\033[92m" if status == "STABLE" else "\033[93m" if status == "PRÉVENTION" else "\033[91m"
-                print(f"[{simulator.step:03d}] {phase:12s} | SpO2: {measure['spo2']}% | Temp: {measure['temperature']}°C | Risque: {risk*100:4.1f}% | {color}{status}\033[0m")
-            else:
-                print(f"Erreur Serveur: {response.status_code}")
-            
-        except requests.exceptions.ConnectTimeout:
-            print(f"[{simulator.step:03d}] Erreur : Connexion expirée (Timeout). Le serveur à {URL_API} est-il lancé ?")
-        except Exception as e:
-            print(f"Erreur : {e}")
-        
-        simulator.next_step()
-        time.sleep(1.5)
-except KeyboardInterrupt:
-    print("\nSimulation arrêtée.")
\ No newline at end of file
+    try:
+        while True:
+            measure = simulator.generate_measure()
+            phase = measure.pop('phase')
+
+            try:
+                response = session.post(URL_API, json=measure, timeout=20)
+
+                if response.status_code == 200:
+                    data = response.json()
+                    data_id = data.get('data_id') 
+                    status = data.get('status', 'STABLE')
+                    risk = data.get('risk_score', 0)
+
+                    if risk > 0.6 and random.random() < 0.85:
+                        feedback_payload = {
+                            "data_id": data_id,
+                            "actual_outcome": 1,
+                            "comment": "Simulation: Patient confirme la gêne respiratoire."
+                        }
+                        session.post(URL_FEEDBACK, json=feedback_payload, timeout=5)
+
+                    color = "\033[92m" if status == "STABLE" else "\033[93m" if status == "PRÉVENTION" else "\033[91m"
+                    print(f"[{simulator.step:03d}] {phase:12s} | SpO2: {measure['spo2']}% | Temp: {measure['temperature']}°C | Risque: {risk*100:4.1f}% | {color}{status}\033[0m")
+                else:
+                    print(f"Erreur Serveur: {response.status_code}")
+
+            except requests.exceptions.ConnectTimeout:
+                print(f"[{simulator.step:03d}] Erreur : Connexion expirée (Timeout). Le serveur à {URL_API} est-il lancé ?")
+            except Exception as e:
+                print(f"Erreur : {e}")
+
+            simulator.next_step()
+            time.sleep(1.5)
+    except KeyboardInterrupt:
+        print("\nSimulation arrêtée.")
+
+
+if __name__ == "__main__":
+    main()